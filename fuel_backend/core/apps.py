@@ -0,0 +1,48 @@
+import multiprocessing
+import os
+import sys
+import threading
+
+from django.apps import AppConfig
+from django.conf import settings
+
+# Entry points whose first argument is a management command
+_MANAGEMENT_SCRIPTS = {'manage.py', 'django-admin', 'django-admin.py', '__main__.py'}
+
+
+def serving_process():
+    """
+    Whether this process serves requests: not a management command (other
+    than runserver's serving child), runserver's autoreloader parent, or a
+    multiprocessing child such as an optimizer pool worker.
+    """
+    if multiprocessing.parent_process() is not None:
+        return False
+    if os.path.basename(sys.argv[0]) not in _MANAGEMENT_SCRIPTS or len(sys.argv) < 2:
+        # gunicorn, uvicorn, daphne, ...
+        return True
+    if sys.argv[1] != 'runserver':
+        return False
+    # The autoreloader parent only watches files; its child has RUN_MAIN set
+    return os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv
+
+
+class CoreConfig(AppConfig):
+    name = 'fuel_backend.core'
+    label = 'core'
+
+    def ready(self):
+        # DATA_WARMUP: 'sync' loads station/city data before the worker takes
+        # traffic, 'background' loads it in a thread (readiness reports 503
+        # until done), anything falsy keeps the lazy load on first request.
+        # Only in serving processes: commands and pool workers load what
+        # they use themselves.
+        mode = getattr(settings, 'DATA_WARMUP', None)
+        if not mode or not serving_process():
+            return
+
+        from .data_manager import warm_up
+        if mode == 'background':
+            threading.Thread(target=warm_up, name='data-warmup', daemon=True).start()
+        else:
+            warm_up()
@@ -0,0 +1,214 @@
+"""
+Microbenchmarks for the request hot path: geocoding, station data loading
+and lookup, and RouteOptimizer setup and optimization.
+
+Run with `python manage.py benchmark`. Routes come from recorded fixtures
+(benchmarks/routes, replay format) for three lane lengths, so results don't
+depend on OSRM. Timings are compared against the stored baseline for this
+machine (benchmarks/baselines/<machine>.json) and reported as % change.
+"""
+import datetime
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import time
+
+import numpy as np
+from django.conf import settings
+from django.test.utils import override_settings
+
+from .data_manager import CityGeocoder, FuelStationManager
+from .optimizer import RouteOptimizer
+from .routing import ReplayBackend
+
+# Recorded lanes: short (~90 mi), medium (~800 mi) and cross-country, plus
+# one with OSRM steps (highway refs), so highway matching is timed too.
+# Each must have a plan in both modes (see collect_benchmarks).
+LANES = {
+    'short': ('Chicago, IL', 'Milwaukee, WI'),
+    'medium': ('Dallas, TX', 'Atlanta, GA'),
+    'cross_country': ('Philadelphia, PA', 'Sacramento, CA'),
+    'steps': ('Dallas, TX', 'Kansas City, MO'),
+}
+
+
+def benchmark_dir():
+    return os.path.join(settings.BASE_DIR, 'benchmarks')
+
+
+def fixtures_dir():
+    return os.path.join(benchmark_dir(), 'routes')
+
+
+def baseline_path(machine):
+    return os.path.join(benchmark_dir(), 'baselines', f"{machine}.json")
+
+
+def lane_coords(lane):
+    geocoder = CityGeocoder.get_instance()
+    start, finish = LANES[lane]
+    return geocoder.geocode(start), geocoder.geocode(finish)
+
+
+def record_fixtures(backend):
+    """Fetch every lane from backend and save it as a replay fixture."""
+    recorder = ReplayBackend(fixtures_dir())
+    paths = {}
+    for lane in LANES:
+        start_coords, end_coords = lane_coords(lane)
+        route = backend.fetch_route(start_coords, end_coords)
+        paths[lane] = recorder.save(start_coords, end_coords, route)
+    return paths
+
+
+def load_fixtures():
+    """{lane: route_data} for every recorded lane."""
+    replay = ReplayBackend(fixtures_dir())
+    return {lane: replay.fetch_route(*lane_coords(lane)) for lane in LANES}
+
+
+def _fresh_load(cls):
+    # A new instance, outside the singleton; without the per-load log lines
+    logging.disable(logging.INFO)
+    try:
+        cls().load_data()
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def collect_benchmarks(routes):
+    """
+    [(name, fn)]: fn() is the timed call. Setup (singletons, optimizers for
+    the optimize cases) happens here, outside the timing. Raises ValueError
+    for a route the optimizer finds no plan on: timing its error exit says
+    nothing about the optimizer.
+    """
+    geocoder = CityGeocoder.get_instance()
+    manager = FuelStationManager.get_instance()
+    manager.df  # built lazily on first find_nearby_stations call
+
+    cases = [
+        ('geocoder.geocode[exact]', lambda: geocoder.geocode('Chicago, IL')),
+        ('geocoder.geocode[alias]', lambda: geocoder.geocode('St. Louis, Missouri')),
+        ('geocoder.geocode[miss]', lambda: geocoder.geocode('Nowhere Town, ZZ')),
+        ('stations.find_nearby_stations', lambda: manager.find_nearby_stations(35.4676, -97.5164, radius_miles=10)),
+    ]
+    if manager.data_version != 'csv':
+        cases.append(('stations.load_data[snapshot]', lambda: _fresh_load(FuelStationManager)))
+
+    def load_csv():
+        with override_settings(DATA_SNAPSHOT_DIR=None):
+            _fresh_load(FuelStationManager)
+    cases.append(('stations.load_data[csv]', load_csv))
+
+    for lane, route_data in routes.items():
+        optimizer = RouteOptimizer(route_data)
+        for mode in RouteOptimizer.MODES:
+            result = optimizer.optimize(mode)
+            if 'error' in result:
+                raise ValueError(f"No {mode} plan on the {lane} route ({result['error']}), "
+                                 f"re-record it or pick another lane")
+        cases += [
+            (f'optimizer.init[{lane}]', lambda route_data=route_data: RouteOptimizer(route_data)),
+            (f'optimizer.greedy[{lane}]', lambda optimizer=optimizer: optimizer.optimize('greedy')),
+            (f'optimizer.exact[{lane}]', lambda optimizer=optimizer: optimizer.optimize('exact')),
+        ]
+    return cases
+
+
+def time_call(fn, min_time=0.5, min_rounds=5, max_rounds=1000, min_round_time=0.001):
+    """
+    Per-call timings (seconds), one per round: at least min_rounds, and
+    min_time in total. Fast calls are looped within a round (timeit-style)
+    until a round takes min_round_time, so timer noise doesn't dominate
+    microsecond-scale results. Returns (timings, loops per round).
+    """
+    # Calibrate; also serves as warm-up
+    loops = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        if time.perf_counter() - t0 >= min_round_time or loops >= 100000:
+            break
+        loops *= 10
+
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < max_rounds and (len(timings) < min_rounds or time.perf_counter() - started < min_time):
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        timings.append((time.perf_counter() - t0) / loops)
+    return timings, loops
+
+
+def summarize(timings, loops=1):
+    ms = np.asarray(timings) * 1000
+    return {
+        'rounds': len(ms),
+        'loops': loops,
+        'median_ms': round(float(np.median(ms)), 4),
+        'min_ms': round(float(ms.min()), 4),
+        'mean_ms': round(float(ms.mean()), 4),
+        'stdev_ms': round(statistics.stdev(ms.tolist()), 4) if len(ms) > 1 else 0.0,
+    }
+
+
+def compare(results, baseline, threshold_pct=10.0):
+    """
+    Adds baseline_ms, change_pct and status ('regression' / 'improvement' /
+    'ok' / 'new') to each result, comparing medians.
+    """
+    base_results = (baseline or {}).get('results', {})
+    for name, result in results.items():
+        base = base_results.get(name)
+        if not base:
+            result.update(baseline_ms=None, change_pct=None, status='new')
+            continue
+        change = (result['median_ms'] - base['median_ms']) / base['median_ms'] * 100
+        if change > threshold_pct:
+            status = 'regression'
+        elif change < -threshold_pct:
+            status = 'improvement'
+        else:
+            status = 'ok'
+        result.update(baseline_ms=base['median_ms'], change_pct=round(change, 1), status=status)
+    return results
+
+
+def read_baseline(machine):
+    try:
+        with open(baseline_path(machine)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_baseline(machine, results):
+    path = baseline_path(machine)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    keep = ('rounds', 'loops', 'median_ms', 'min_ms', 'mean_ms', 'stdev_ms')
+    data = {
+        'machine': machine,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'results': {name: {k: r[k] for k in keep} for name, r in sorted(results.items())},
+    }
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+    return path
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                             capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
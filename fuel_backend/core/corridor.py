@@ -0,0 +1,107 @@
+import numpy as np
+
+
+class RouteCorridor:
+    """
+    All fuel stations near a route, found once per route.
+
+    Co-located stations (same city, same point) are collapsed to the
+    cheapest one at each location for the price snapshot in use; the rest
+    can never be a better stop. Every location within radius_miles of any
+    route point is kept once, pinned to its closest route point. The arrays
+    below are parallel and sorted by along-route mile, so a mile range is a
+    contiguous slice (see window()).
+
+        station_idx       positional index into FuelStationManager.df of the
+                          cheapest station there (lowest index on a price tie)
+        station_idx_last  same, highest index on a price tie (the one the
+                          exact engine ends up buying at)
+        route_idx         index of the closest point in route_points
+        miles             cumulative route distance at that point
+        offroute          distance from the station to that point (miles)
+        prices            price per gallon
+
+    With highways (route segments, see highways.route_highways), stations
+    whose address puts them on highways the route doesn't use near them
+    are dropped before picking the cheapest per location: a city's cheapest
+    stop may be on a crossing state route miles off the interstate.
+    """
+
+    def __init__(self, route_points, cum_dist, manager, radius_miles=10, price_snapshot=None, tiles=None,
+                 highways=None, window_miles=15):
+        points = np.asarray(route_points, dtype=np.float64).reshape(-1, 2)
+        if tiles is not None:
+            # StationTileCache: same answer, reusing searches from earlier routes
+            point_idx, location_idx, dist = tiles.query_locations(manager, points, radius_miles=radius_miles)
+        else:
+            point_idx, location_idx, dist = manager.query_locations(points, radius_miles=radius_miles)
+        # The caller's snapshot, so one optimization never mixes two price versions
+        snapshot = manager.price_snapshot if price_snapshot is None else price_snapshot
+
+        if len(location_idx):
+            # Dedupe: keep the closest route point for each location
+            order = np.lexsort((dist, location_idx))
+            location_idx, point_idx, dist = location_idx[order], point_idx[order], dist[order]
+            first = np.ones(len(location_idx), dtype=bool)
+            first[1:] = location_idx[1:] != location_idx[:-1]
+            location_idx, point_idx, dist = location_idx[first], point_idx[first], dist[first]
+            miles = np.asarray(cum_dist)[point_idx]
+            if highways:
+                keep, station_idx, station_idx_last = _cheapest_on_route(
+                    manager, snapshot, location_idx, miles, highways, window_miles)
+                location_idx, point_idx, dist, miles = location_idx[keep], point_idx[keep], dist[keep], miles[keep]
+            else:
+                station_idx = snapshot.location_cheapest[location_idx]
+                station_idx_last = snapshot.location_cheapest_last[location_idx]
+
+            # Sort by position along the route (station index breaks ties so
+            # results are deterministic; the exact engine takes the last of
+            # equally cheap stations at one mile, so order by its pick)
+            order = np.lexsort((station_idx_last, miles))
+            station_idx, station_idx_last, point_idx, dist, miles = (
+                station_idx[order], station_idx_last[order], point_idx[order], dist[order], miles[order])
+        else:
+            station_idx = station_idx_last = point_idx = np.zeros(0, dtype=np.intp)
+            dist = miles = np.zeros(0)
+
+        self.station_idx = station_idx
+        self.station_idx_last = station_idx_last
+        self.route_idx = point_idx
+        self.miles = miles
+        self.offroute = dist
+        self.prices = snapshot.prices[station_idx]
+
+    def __len__(self):
+        return len(self.station_idx)
+
+    def window(self, min_mile, max_mile):
+        """Slice of corridor positions whose mile lies in [min_mile, max_mile]."""
+        lo = np.searchsorted(self.miles, min_mile, side='left')
+        hi = np.searchsorted(self.miles, max_mile, side='right')
+        return slice(lo, hi)
+
+
+def _cheapest_on_route(manager, snapshot, location_idx, miles, highways, window_miles):
+    """
+    PriceSnapshot.location_cheapest / location_cheapest_last for the given
+    locations, counting only stations HighwayIndex.on_route accepts.
+    Returns (keep, cheapest, cheapest_last) for the locations with any.
+    """
+    # Every station of those locations, grouped by location
+    counts = np.diff(manager.location_start)[location_idx]
+    bounds = np.cumsum(counts) - counts
+    owner = np.repeat(np.arange(len(location_idx)), counts)
+    members = manager.location_members[manager.location_start[location_idx][owner] + np.arange(len(owner)) - bounds[owner]]
+    allowed = manager.highways.on_route(members, miles[owner], highways, window_miles)
+    if allowed.all():
+        return (np.ones(len(location_idx), dtype=bool),
+                snapshot.location_cheapest[location_idx], snapshot.location_cheapest_last[location_idx])
+
+    # Same ties as PriceSnapshot: lowest price, then lowest / highest index
+    prices = np.where(allowed, snapshot.prices[members], np.inf)
+    cheapest = np.minimum.reduceat(prices, bounds)
+    is_cheapest = allowed & (prices == np.repeat(cheapest, counts))
+    first = np.minimum.reduceat(np.where(is_cheapest, members, len(snapshot.prices)), bounds)
+    last = np.maximum.reduceat(np.where(is_cheapest, members, -1), bounds)
+    keep = np.isfinite(cheapest)
+    return keep, first[keep], last[keep]
@@ -1,22 +1,139 @@
+import logging
+import numpy as np
 import pandas as pd
 import os
+import re
+import threading
+import time
 from django.conf import settings
 from scipy.spatial import cKDTree
+from .geo import to_unit_vectors, miles_to_chord, chord_to_miles
+from .highways import HighwayIndex
+from .metrics import KDTREE_QUERIES, KDTREE_QUERY_POINTS, REGISTRY
+from .snapshot import load_snapshot, current_price_version, read_prices, source_fingerprint, write_prices
+from .store import StringColumn
 
-class FuelStationManager:
+logger = logging.getLogger(__name__)
+
+class DataSingleton:
+    """
+    Process-wide instance with its data loaded exactly once.
+
+    get_instance() uses double-checked locking: concurrent first callers wait
+    for a single load instead of each loading, and the instance is only
+    published once load_data() has finished. Load status and time are kept
+    on the class for the readiness endpoint.
+    """
     _instance = None
-    df = None
-    tree = None
+    load_status = 'not_loaded'  # not_loaded | loading | loaded | error
+    load_seconds = None
+    load_error = None
 
     @classmethod
     def get_instance(cls):
-        if cls._instance is None:
-            cls._instance = FuelStationManager()
-            cls._instance.load_data()
-        return cls._instance
+        instance = cls._instance
+        if instance is None:
+            with cls._init_lock:
+                if cls._instance is None:
+                    cls._load()
+            instance = cls._instance
+        return instance
+
+    @classmethod
+    def _load(cls):
+        cls.load_status = 'loading'
+        started = time.perf_counter()
+        try:
+            instance = cls()
+            instance.load_data()
+        except Exception as e:
+            cls.load_status = 'error'
+            cls.load_error = str(e)
+            raise
+        cls.load_seconds = time.perf_counter() - started
+        cls.load_error = None
+        cls.load_status = 'loaded'
+        cls._instance = instance
+
+    @classmethod
+    def status(cls):
+        instance = cls._instance
+        return {
+            'status': cls.load_status,
+            'load_seconds': round(cls.load_seconds, 4) if cls.load_seconds is not None else None,
+            'data_version': getattr(instance, 'data_version', None),
+            'error': cls.load_error,
+        }
+
+
+PRICE_CSV_COLUMNS = ['OPIS Truckstop ID', 'Truckstop Name', 'Address', 'City', 'State', 'Retail Price']
+
+
+class PriceSnapshot:
+    """
+    One immutable version of the station prices. Readers grab the current
+    snapshot once and use it for the whole computation; updates publish a
+    new snapshot instead of touching the array in place.
+    """
+
+    def __init__(self, version, prices, source='dataset', locations=None):
+        prices = np.asarray(prices, dtype=np.float64)
+        if prices.flags.writeable:
+            prices = prices.copy()
+            prices.flags.writeable = False
+        self.version = version
+        self.prices = prices
+        self.source = source
+        self.updated_at = time.time()
+
+        # Cheapest station at each location for these prices; locations is
+        # the manager's (location_members, location_start) grouping. Ties are
+        # kept both ways: greedy takes the lowest station index among equally
+        # cheap co-located stations, the exact engine the highest.
+        self.location_cheapest = self.location_cheapest_last = None
+        if locations is not None:
+            members, start = locations
+            member_prices = prices[members]
+            cheapest = np.minimum.reduceat(member_prices, start[:-1])
+            is_cheapest = member_prices == np.repeat(cheapest, np.diff(start))
+            self.location_cheapest = np.minimum.reduceat(np.where(is_cheapest, members, len(prices)), start[:-1])
+            self.location_cheapest_last = np.maximum.reduceat(np.where(is_cheapest, members, -1), start[:-1])
+
+
+class FuelStationManager(DataSingleton):
+    _init_lock = threading.Lock()
+    tree = None
 
     def load_data(self):
-        print("Loading Fuel and City Data...")
+        # Prefer the prebuilt binary snapshot (memory-mapped, see snapshot.py)
+        snapshot = load_snapshot()
+        if snapshot is not None:
+            logger.info("Loading fuel stations from snapshot %s", snapshot.version)
+            self.data_version = snapshot.version
+            self.dataset_id = snapshot.version
+            self._set_arrays(snapshot.group('stations'))
+        else:
+            logger.info("Loading fuel stations from CSV")
+            self.data_version = 'csv'
+            # Changes with the files: names the price dir (snapshot.py) and
+            # is part of cached result keys (results.py)
+            self.dataset_id = f"csv-{source_fingerprint()}"
+            self._set_arrays(self.read_csv())
+
+        logger.info("Loaded %s fuel stations with coordinates", len(self.prices))
+
+        # Pick up prices refreshed since the dataset was built
+        self._price_lock = threading.Lock()
+        self._next_price_poll = 0.0
+        self.poll_prices(force=True)
+
+    @staticmethod
+    def read_csv():
+        """
+        Parse and merge the source CSVs. Returns the station columns as
+        NumPy arrays, with the text columns dictionary-encoded
+        (store.StringColumn).
+        """
         base_dir = settings.BASE_DIR
         
         # Load Data
@@ -39,66 +156,443 @@ class FuelStationManager:
         cities_lookup = cities_df.drop_duplicates(subset=['City_Norm', 'State_Norm'])
         
         # Merge to get Lat/Lon for Fuel Stations
-        self.df = pd.merge(fuel_df, cities_lookup[['City_Norm', 'State_Norm', 'LATITUDE', 'LONGITUDE']], 
-                           on=['City_Norm', 'State_Norm'], how='inner')
+        df = pd.merge(fuel_df, cities_lookup[['City_Norm', 'State_Norm', 'LATITUDE', 'LONGITUDE']], 
+                      on=['City_Norm', 'State_Norm'], how='inner')
         
         # Rename for clarity
-        self.df.rename(columns={'LATITUDE': 'lat', 'LONGITUDE': 'lon', 'Retail Price': 'price', 'Truckstop Name': 'name', 'Address': 'address'}, inplace=True)
+        df.rename(columns={'LATITUDE': 'lat', 'LONGITUDE': 'lon', 'Retail Price': 'price', 'Truckstop Name': 'name', 'Address': 'address'}, inplace=True)
         
         # Drop invalid rows
-        self.df.dropna(subset=['lat', 'lon', 'price'], inplace=True)
-        
-        print(f"Loaded {len(self.df)} fuel stations with coordinates.")
-        
+        df.dropna(subset=['lat', 'lon', 'price'], inplace=True)
+
+        addresses = StringColumn.from_values(df['address'].astype(str))
+        return {
+            'opis_id': df['OPIS Truckstop ID'].to_numpy(dtype=np.int64),
+            'name': StringColumn.from_values(df['name'].astype(str)),
+            'address': addresses,
+            'city': StringColumn.from_values(df['City_Norm']),
+            'state': StringColumn.from_values(df['State_Norm']),
+            'lat': df['lat'].to_numpy(dtype=np.float64),
+            'lon': df['lon'].to_numpy(dtype=np.float64),
+            'price': df['price'].to_numpy(dtype=np.float64),
+            # Highways and exits parsed from the addresses (highways.py)
+            **HighwayIndex.parse(addresses).to_arrays(),
+        }
+
+    def _set_arrays(self, arrays):
+        self.arrays = arrays
+        self.opis_ids = arrays['opis_id']
+        # Text columns are store.StringColumn: int32 codes + distinct values
+        self.names = arrays['name']
+        self.addresses = arrays['address']
+        self.cities = arrays['city']
+        self.states = arrays['state']
+        self.highways = HighwayIndex.from_arrays(arrays)
+        self.points = np.column_stack([arrays['lat'], arrays['lon']])
+        self._df = None
+        self._df_price_version = None
+        self._key_index = None
+
+        # Stations get their coordinates from a city+state join, so every
+        # stop in a city shares one point (7.5k stations, ~3.8k locations).
+        # The tree indexes locations; station_location maps station ->
+        # location, and location_members[location_start[l]:location_start[l+1]]
+        # lists a location's stations in index order.
+        order = np.lexsort((self.points[:, 1], self.points[:, 0]))
+        new_location = np.ones(len(order), dtype=bool)
+        new_location[1:] = (self.points[order[1:]] != self.points[order[:-1]]).any(axis=1)
+        self.location_points = self.points[order[new_location]]
+        self.station_location = np.empty(len(order), dtype=np.intp)
+        self.station_location[order] = np.cumsum(new_location) - 1
+        self.location_members = order
+        self.location_start = np.append(np.nonzero(new_location)[0], len(order))
+        self.price_snapshot = self._price_snapshot(1, arrays['price'])
+
         # Build Spatial Tree for fast querying
-        # KDTree expects (x, y) -> (lon, lat) usually, or we can just use 2D points.
-        # For small distances, Equirectangular approximation is okay for nearest neighbour search, 
-        # but for accuracy we should project. However, for "finding stations near route", 
-        # a simple lat/lon KDTree is fast and 'good enough' for this assignment scale.
-        self.points = self.df[['lat', 'lon']].values
-        self.tree = cKDTree(self.points)
-
-    def find_nearby_stations(self, lat, lon, radius_deg=0.5):
-        # radius_deg: 1 deg approx 69 miles. 0.1 deg approx 7 miles.
-        # We want stations within ~10 miles of the point.
-        # 10 miles ~ 0.15 degrees.
-        indices = self.tree.query_ball_point([lat, lon], r=radius_deg)
+        # The tree is built on 3D unit vectors rather than raw lat/lon degrees,
+        # so a radius is the same true distance at every latitude (a degree of
+        # longitude is ~60 miles in Texas but ~45 in Montana).
+        self.location_xyz = to_unit_vectors(self.location_points[:, 0], self.location_points[:, 1])
+        self.tree = cKDTree(self.location_xyz)
+
+    def _price_snapshot(self, version, prices, source='dataset'):
+        return PriceSnapshot(version, prices, source=source, locations=(self.location_members, self.location_start))
+
+    @property
+    def prices(self):
+        return self.price_snapshot.prices
+
+    @property
+    def price_version(self):
+        return self.price_snapshot.version
+
+    @property
+    def df(self):
+        # DataFrame view of the stations, built on first use (display and
+        # find_nearby_stations). The hot paths work on the arrays directly.
+        if self._df is None or self._df_price_version != self.price_version:
+            self._df_price_version = self.price_version
+            self._df = pd.DataFrame({
+                'OPIS Truckstop ID': self.opis_ids,
+                'name': self.names.to_numpy(),
+                'address': self.addresses.to_numpy(),
+                'City_Norm': self.cities.to_numpy(),
+                'State_Norm': self.states.to_numpy(),
+                'lat': self.points[:, 0],
+                'lon': self.points[:, 1],
+                'price': self.prices,
+            })
+        return self._df
+
+    def _station_keys(self, opis_ids, names, addresses, cities, states):
+        # (station identity, n-th occurrence). The OPIS feed lists some
+        # stations several times with different prices, so rows are matched
+        # to stations in order of appearance within each identity.
+        seen = {}
+        keys = []
+        for key in zip(opis_ids, (str(v).strip().upper() for v in names), (str(v).strip().upper() for v in addresses),
+                       (str(v).strip().upper() for v in cities), (str(v).strip().upper() for v in states)):
+            n = seen.get(key, 0)
+            seen[key] = n + 1
+            keys.append(key + (n,))
+        return keys
+
+    def apply_price_update(self, fuel_df, source='update', persist=True):
+        """
+        Swap in prices from an OPIS-format DataFrame without touching
+        geometry or the KD-tree. Only rows whose price changed are written
+        into a copy of the current array, which is then published atomically
+        as a new PriceSnapshot. Stations missing from the update keep their
+        price; rows for unknown stations are ignored.
+        With persist=True the result is also written to the snapshot dir so
+        other workers pick it up (poll_prices).
+        """
+        missing = [c for c in PRICE_CSV_COLUMNS if c not in fuel_df.columns]
+        if missing:
+            raise ValueError(f"Price file is missing columns: {', '.join(missing)}")
+        fuel_df = fuel_df.dropna(subset=['Retail Price'])
+
+        with self._price_lock:
+            if self._key_index is None:
+                self._key_index = {key: i for i, key in enumerate(self._station_keys(
+                    self.opis_ids.tolist(), self.names.tolist(), self.addresses.tolist(),
+                    self.cities.tolist(), self.states.tolist()))}
+
+            keys = self._station_keys(fuel_df['OPIS Truckstop ID'].astype(np.int64).tolist(), fuel_df['Truckstop Name'].tolist(),
+                                      fuel_df['Address'].tolist(), fuel_df['City'].tolist(), fuel_df['State'].tolist())
+            idx = np.fromiter((self._key_index.get(k, -1) for k in keys), dtype=np.intp, count=len(keys))
+            new_values = fuel_df['Retail Price'].to_numpy(dtype=np.float64)
+            matched = idx >= 0
+            idx, new_values = idx[matched], new_values[matched]
+
+            current = self.price_snapshot
+            changed = current.prices[idx] != new_values
+            if changed.any():
+                prices = current.prices.copy()
+                prices[idx[changed]] = new_values[changed]
+
+                version = current.version + 1
+                if persist:
+                    version = write_prices(self.dataset_id, prices, min_version=version) or version
+                self.price_snapshot = self._price_snapshot(version, prices, source=source)
+            else:
+                # Nothing to publish; keep the version (and caches keyed on it)
+                prices, version = current.prices, current.version
+
+        stats = {
+            'price_version': version,
+            'rows': len(keys),
+            'matched': int(matched.sum()),
+            'unmatched': int((~matched).sum()),
+            'changed': int(changed.sum()),
+            'stations_not_in_update': len(prices) - len(idx),
+        }
+        logger.info("Applied price update from %s: %s", source, stats)
+        return stats
+
+    def poll_prices(self, force=False):
+        """
+        Cheap check (at most every PRICE_POLL_SECONDS) for a newer price
+        version written by another process; swaps it in if found.
+        """
+        now = time.monotonic()
+        if not force and now < self._next_price_poll:
+            return False
+        self._next_price_poll = now + getattr(settings, 'PRICE_POLL_SECONDS', 10)
+
+        latest = current_price_version(self.dataset_id)
+        if latest is None or latest <= self.price_version:
+            return False
+        with self._price_lock:
+            if latest <= self.price_version:
+                return False
+            prices = read_prices(self.dataset_id, latest)
+            if len(prices) != len(self.opis_ids):
+                logger.warning("Ignoring price version %s: %s prices for %s stations", latest, len(prices), len(self.opis_ids))
+                return False
+            self.price_snapshot = self._price_snapshot(latest, prices, source='snapshot')
+        logger.info("Switched to price version %s", latest)
+        return True
+
+    def station_record(self, idx):
+        """Plain-Python fields of one station, for responses."""
+        return {
+            'name': self.names[idx],
+            'address': self.addresses[idx],
+            'city': self.cities[idx],
+            'state': self.states[idx],
+            'lat': float(self.points[idx, 0]),
+            'lon': float(self.points[idx, 1]),
+            'price': float(self.prices[idx]),
+        }
+
+    def find_nearby_stations(self, lat, lon, radius_miles=10):
+        # Stations within radius_miles (great-circle) of the point.
+        point_idx, indices, dist = self.query_radius([(lat, lon)], radius_miles=radius_miles)
         return self.df.iloc[indices]
 
-class CityGeocoder:
-    _instance = None
-    df = None
+    def query_locations(self, points, radius_miles=10):
+        """
+        Batch radius search for a set of (lat, lon) points over station
+        locations. Returns three parallel arrays (point_idx, location_idx,
+        dist_miles) with one entry per (point, location) pair within
+        radius_miles, where dist_miles is the great-circle distance.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if len(points) == 0:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp), np.zeros(0)
+
+        KDTREE_QUERIES.inc(kind='radius')
+        KDTREE_QUERY_POINTS.inc(len(points), kind='radius')
+        xyz = to_unit_vectors(points[:, 0], points[:, 1])
+        hits = self.tree.query_ball_point(xyz, r=miles_to_chord(radius_miles), return_sorted=False)
+        counts = np.fromiter((len(h) for h in hits), dtype=np.intp, count=len(hits))
+        point_idx = np.repeat(np.arange(len(points)), counts)
+        location_idx = np.fromiter((i for h in hits for i in h), dtype=np.intp, count=counts.sum())
+        chord = np.linalg.norm(xyz[point_idx] - self.location_xyz[location_idx], axis=1)
+        return point_idx, location_idx, chord_to_miles(chord)
+
+    def query_radius(self, points, radius_miles=10):
+        """
+        Like query_locations, but one entry per (point, station) pair:
+        (point_idx, station_idx, dist_miles). station_idx is positional
+        (use self.df.iloc / self.prices).
+        """
+        point_idx, location_idx, dist = self.query_locations(points, radius_miles)
+        station_idx, owner = self._expand_locations(location_idx)
+        return point_idx[owner], station_idx, dist[owner]
+
+    def _expand_locations(self, location_idx):
+        # Every station at each location: (station_idx, position in location_idx)
+        starts = self.location_start[location_idx]
+        counts = self.location_start[location_idx + 1] - starts
+        owner = np.repeat(np.arange(len(location_idx)), counts)
+        offset = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+        return self.location_members[starts[owner] + offset], owner
+
+    def query_nearest(self, points, k=1, radius_miles=np.inf):
+        """
+        k nearest stations for each (lat, lon) point.
+        Returns (station_idx, dist_miles), both shaped (len(points), k).
+        Missing neighbours (fewer than k within radius_miles) have
+        station_idx == len(self.df) and dist_miles == inf.
+        Ties in distance (co-located stations) go to the lower index.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        KDTREE_QUERIES.inc(kind='nearest')
+        KDTREE_QUERY_POINTS.inc(len(points), kind='nearest')
+        xyz = to_unit_vectors(points[:, 0], points[:, 1])
+        n_stations, n_locations = len(self.station_location), len(self.location_points)
+
+        # Every location holds at least one station, so the k nearest
+        # stations are among the stations of the k nearest locations.
+        # k as a list keeps the (n, k) shape even for k=1
+        chord, location_idx = self.tree.query(xyz, k=list(range(1, k + 1)), distance_upper_bound=miles_to_chord(radius_miles))
+        found = location_idx < n_locations
+        station_idx, owner = self._expand_locations(location_idx[found])
+
+        # Candidates per point, padded to a rectangle, then the k best
+        rows = np.nonzero(found)[0][owner]
+        col = np.arange(len(rows)) - np.searchsorted(rows, rows)
+        width = max(int(col.max()) + 1 if len(col) else 0, k)
+        cand_station = np.full((len(points), width), n_stations, dtype=np.intp)
+        cand_chord = np.full((len(points), width), np.inf)
+        cand_station[rows, col] = station_idx
+        cand_chord[rows, col] = chord[found][owner]
+        best = np.lexsort((cand_station, cand_chord), axis=-1)[:, :k]
+
+        station_idx = np.take_along_axis(cand_station, best, axis=-1)
+        chord = np.take_along_axis(cand_chord, best, axis=-1)
+        missing = np.isinf(chord)
+        dist = chord_to_miles(np.where(missing, 0.0, chord))
+        dist[missing] = np.inf
+        return station_idx, dist
+
+# Abbreviations folded to their long form when building/looking up alias keys
+CITY_ALIASES = {
+    'st': 'saint',
+    'ste': 'sainte',
+    'ft': 'fort',
+    'mt': 'mount',
+    'pt': 'point',
+}
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_place(text, apostrophe=''):
+    """
+    Loose form of a city or state name for alias matching:
+    "St. Louis" / "saint  louis" / "ST LOUIS" -> "saint louis".
+    Apostrophes are replaced by `apostrophe`: dropped by default ("Lee's
+    Summit" -> "lees summit"), or a word break with ' ' ("O'Fallon" ->
+    "o fallon"); us_cities.csv spells names both ways. Other punctuation
+    splits words ("Winston-Salem" -> "winston salem").
+    """
+    text = str(text).lower().replace("'", apostrophe).replace("\u2019", apostrophe)
+    return " ".join(CITY_ALIASES.get(tok, tok) for tok in _NON_ALNUM.split(text) if tok)
 
-    @classmethod
-    def get_instance(cls):
-        if cls._instance is None:
-            cls._instance = CityGeocoder()
-            cls._instance.load_data()
-        return cls._instance
+
+class CityGeocoder(DataSingleton):
+    _init_lock = threading.Lock()
 
     def load_data(self):
+        # Same snapshot as FuelStationManager; falls back to us_cities.csv
+        snapshot = load_snapshot()
+        if snapshot is not None:
+            self.data_version = snapshot.version
+            self._set_arrays(snapshot.group('cities'))
+        else:
+            self.data_version = 'csv'
+            self._set_arrays(self.read_csv())
+
+    @staticmethod
+    def read_csv():
+        """
+        Coordinates plus the precomputed lookup keys for every city row:
+        1. "city, state_code" (e.g. "phoenix, az")
+        2. "city, state_name" (e.g. "phoenix, arizona")
+        3. normalized alias "city|state_code" (e.g. "saint louis|mo")
+        and the normalized state code/name -> state code table.
+        """
         base_dir = settings.BASE_DIR
         cities_path = os.path.join(base_dir, 'us_cities.csv')
-        self.df = pd.read_csv(cities_path)
-        # Create multiple lookup keys:
-        # 1. "city, state_code" (e.g. "phoenix, az")
-        # 2. "city, state_name" (e.g. "phoenix, arizona")
-        
-        self.df['key_code'] = self.df['CITY'].str.lower().str.strip() + ", " + self.df['STATE_CODE'].str.lower().str.strip()
-        self.df['key_name'] = self.df['CITY'].str.lower().str.strip() + ", " + self.df['STATE_NAME'].str.lower().str.strip()
+        df = pd.read_csv(cities_path)
+
+        cities = df['CITY'].astype(str).tolist()
+        codes = df['STATE_CODE'].astype(str).str.lower().str.strip().tolist()
+        names = df['STATE_NAME'].astype(str).tolist()
+
+        key_code, key_name, key_alias = [], [], []
+        state_codes = {}
+        for city, code, name in zip(cities, codes, names):
+            city_key = city.lower().strip()
+            key_code.append(f"{city_key}, {code}")
+            key_name.append(f"{city_key}, {name.lower().strip()}")
+            key_alias.append(f"{normalize_place(city)}|{code}")
+            state_codes.setdefault(normalize_place(code), code)
+            state_codes.setdefault(normalize_place(name), code)
+
+        return {
+            'lat': df['LATITUDE'].to_numpy(dtype=np.float64),
+            'lon': df['LONGITUDE'].to_numpy(dtype=np.float64),
+            'key_code': np.array(key_code, dtype=str),
+            'key_name': np.array(key_name, dtype=str),
+            'key_alias': np.array(key_alias, dtype=str),
+            'state_key': np.array(list(state_codes.keys()), dtype=str),
+            'state_code': np.array(list(state_codes.values()), dtype=str),
+        }
+
+    def _set_arrays(self, arrays):
+        self.lats = arrays['lat']
+        self.lons = arrays['lon']
+        # Hash indexes, key -> row
+        self._by_code = self._first_row_index(arrays['key_code'])
+        self._by_name = self._first_row_index(arrays['key_name'])
+        self._by_alias = self._first_row_index(arrays['key_alias'])
+        self._state_codes = dict(zip(arrays['state_key'].tolist(), arrays['state_code'].tolist()))
+
+    @staticmethod
+    def _first_row_index(keys):
+        # The first row wins for duplicate keys, same as the old
+        # boolean-mask lookup: insert in reverse so earlier rows overwrite.
+        keys = keys.tolist()
+        return dict(zip(reversed(keys), range(len(keys) - 1, -1, -1)))
+
+    def _coords(self, row):
+        return float(self.lats[row]), float(self.lons[row])
+
+    def _alias_lookup(self, query):
+        # "City, State" with the state as code or name; without a comma, try
+        # the trailing one to three words as the state ("new york ny").
+        if ',' in query:
+            city, state = query.rsplit(',', 1)
+            candidates = [(city, state)]
+        else:
+            words = query.split()
+            candidates = [(" ".join(words[:-n]), " ".join(words[-n:])) for n in (1, 2, 3) if len(words) > n]
+
+        for city, state in candidates:
+            code = self._state_codes.get(normalize_place(state))
+            if code is None:
+                continue
+            # Names with an apostrophe are in the data without it, either
+            # joined ("Lees Summit") or split ("O Fallon", "Coeur D Alene")
+            for apostrophe in ('', ' '):
+                row = self._by_alias.get(f"{normalize_place(city, apostrophe)}|{code}")
+                if row is not None:
+                    return row
+        return None
 
     def geocode(self, query):
         # Query format: "City, StateCode" or "City, StateName"
         query = query.lower().strip()
         
-        # Try match with code
-        match = self.df[self.df['key_code'] == query]
-        if match.empty:
-            # Try match with full name
-            match = self.df[self.df['key_name'] == query]
-            
-        if not match.empty:
-            row = match.iloc[0]
-            return row['LATITUDE'], row['LONGITUDE']
+        # Exact keys first (code, then full name), then the normalized alias
+        row = self._by_code.get(query)
+        if row is None:
+            row = self._by_name.get(query)
+        if row is None:
+            row = self._alias_lookup(query)
+
+        if row is not None:
+            return self._coords(row)
         
         return None
+
+    def geocode_many(self, queries):
+        """
+        Geocode a list of queries; returns a list of (lat, lon) or None in
+        the same order. Repeated queries are only resolved once.
+        """
+        resolved = {}
+        results = []
+        for query in queries:
+            if query not in resolved:
+                resolved[query] = self.geocode(query) if query else None
+            results.append(resolved[query])
+        return results
+
+
+def warm_up():
+    """Load every data singleton now (see CoreConfig.ready)."""
+    for cls in (FuelStationManager, CityGeocoder):
+        try:
+            cls.get_instance()
+        except Exception:
+            logger.exception("Warmup of %s failed", cls.__name__)
+        else:
+            logger.info("%s ready in %.3fs", cls.__name__, cls.load_seconds)
+
+
+@REGISTRY.register_collector
+def data_metrics():
+    singletons = (('stations', FuelStationManager), ('geocoder', CityGeocoder))
+    yield ('fuel_data_loaded', 'gauge', 'Whether each dataset is loaded in this process.',
+           [({'component': name}, int(cls.load_status == 'loaded')) for name, cls in singletons])
+    yield ('fuel_data_load_seconds', 'gauge', 'Time taken to load each dataset.',
+           [({'component': name}, cls.load_seconds) for name, cls in singletons if cls.load_seconds is not None])
+    manager = FuelStationManager._instance
+    if manager is not None:
+        yield ('fuel_price_version', 'gauge', 'Station price version in use.', [({}, manager.price_version)])
+        yield ('fuel_stations', 'gauge', 'Stations in the index.', [({}, len(manager.opis_ids))])
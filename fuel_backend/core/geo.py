@@ -0,0 +1,229 @@
+import numpy as np
+
+# Mean earth radius (IUGG) and WGS-84 ellipsoid parameters, in miles.
+EARTH_RADIUS_MILES = 3958.7613
+WGS84_A_MILES = 6378137.0 / 1609.344
+WGS84_F = 1 / 298.257223563
+
+
+def _as_lat_lon(points):
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return pts[:, 0], pts[:, 1]
+
+
+def haversine_miles(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance on a sphere of radius EARTH_RADIUS_MILES.
+    All arguments are degrees and broadcast like NumPy arrays.
+    Within ~0.5% of the WGS-84 geodesic for any pair of points.
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def lambert_miles(lat1, lon1, lat2, lon2):
+    """
+    Lambert's formula for distance on the WGS-84 ellipsoid.
+    Closed form, so it vectorizes; within ~0.001% of geopy's geodesic
+    (Karney) for the segment lengths found in OSRM route geometry.
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    # Reduced latitudes
+    b1 = np.arctan((1 - WGS84_F) * np.tan(lat1))
+    b2 = np.arctan((1 - WGS84_F) * np.tan(lat2))
+
+    # Central angle between the reduced points
+    h = np.sin((b2 - b1) / 2) ** 2 + np.cos(b1) * np.cos(b2) * np.sin((lon2 - lon1) / 2) ** 2
+    sigma = 2 * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+    p = (b1 + b2) / 2
+    q = (b2 - b1) / 2
+    sin_half = np.sin(sigma / 2) ** 2
+    cos_half = np.cos(sigma / 2) ** 2
+
+    # Identical points give 0/0 in Y; their distance is 0 either way.
+    nonzero = sin_half > 0
+    safe_sin_half = np.where(nonzero, sin_half, 1.0)
+    safe_cos_half = np.where(cos_half > 0, cos_half, 1.0)
+    x = (sigma - np.sin(sigma)) * np.sin(p) ** 2 * np.cos(q) ** 2 / safe_cos_half
+    y = np.where(nonzero, (sigma + np.sin(sigma)) * np.cos(p) ** 2 * np.sin(q) ** 2 / safe_sin_half, 0.0)
+
+    return WGS84_A_MILES * (sigma - WGS84_F / 2 * (x + y))
+
+
+def geodesic_miles(lat1, lon1, lat2, lon2):
+    # Reference implementation (geopy, one Karney solve per pair). Slow, kept
+    # for accuracy checks and benchmarking against the vectorized kernels.
+    from geopy.distance import geodesic
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(
+        *(np.asarray(v, dtype=np.float64) for v in (lat1, lon1, lat2, lon2))
+    )
+    out = np.empty(lat1.shape)
+    for i in np.ndindex(lat1.shape):
+        out[i] = geodesic((lat1[i], lon1[i]), (lat2[i], lon2[i])).miles
+    return out
+
+
+def to_unit_vectors(lats, lons):
+    """
+    (lat, lon) degrees -> 3D points on the unit sphere (ECEF directions).
+    Euclidean (chord) distance between these is monotonic in great-circle
+    distance everywhere, so a KD-tree over them answers true-distance queries.
+    """
+    lat = np.radians(np.asarray(lats, dtype=np.float64))
+    lon = np.radians(np.asarray(lons, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def miles_to_chord(miles):
+    return 2 * np.sin(np.minimum(np.asarray(miles, dtype=np.float64) / EARTH_RADIUS_MILES, np.pi) / 2)
+
+
+def chord_to_miles(chord):
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.clip(np.asarray(chord, dtype=np.float64) / 2, 0.0, 1.0))
+
+
+def simplify_path(points, tolerance_miles):
+    """
+    Douglas-Peucker simplification of a (lat, lon) path. Keeps the endpoints
+    and every vertex needed so the simplified line stays within
+    tolerance_miles of the original. Distances use a local equirectangular
+    projection (fine at vertex spacing).
+
+    Vectorized breadth-first: each pass splits every still-open segment at
+    its farthest vertex in one set of NumPy operations, so the number of
+    Python-level iterations is the recursion depth, not the vertex count.
+    Returns the kept points as an (m, 2) array.
+    """
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    n = len(pts)
+    if n < 3 or tolerance_miles <= 0:
+        return pts
+
+    # Project to miles around the path's mean latitude
+    miles_per_deg = np.radians(1) * EARTH_RADIUS_MILES
+    x = pts[:, 1] * miles_per_deg * np.cos(np.radians(pts[:, 0].mean()))
+    y = pts[:, 0] * miles_per_deg
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    # Vertices whose segment may still need a split
+    open_pts = ~keep
+
+    while open_pts.any():
+        kept = np.flatnonzero(keep)
+        cand = np.flatnonzero(open_pts)
+        seg = np.searchsorted(kept, cand, side='right') - 1
+        start, end = kept[seg], kept[seg + 1]
+
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[cand] - x[start], y[cand] - y[start]
+        seg_len2 = dx * dx + dy * dy
+        # Distance to the segment (clamped projection), not the infinite line
+        t = np.clip((px * dx + py * dy) / np.where(seg_len2 > 0, seg_len2, 1.0), 0.0, 1.0)
+        dist = np.hypot(px - t * dx, py - t * dy)
+
+        # Farthest candidate of each segment (candidates are grouped by segment)
+        bounds = np.flatnonzero(np.r_[True, seg[1:] != seg[:-1]])
+        seg_max = np.maximum.reduceat(dist, bounds)
+        seg_of = np.repeat(np.arange(len(bounds)), np.diff(np.r_[bounds, len(cand)]))
+        first_max = _first_true_per_group(dist == seg_max[seg_of], seg_of, len(bounds))
+
+        split = seg_max > tolerance_miles
+        keep[cand[first_max[split]]] = True
+        # Segments within tolerance are final: close their vertices
+        open_pts[cand[~split[seg_of]]] = False
+        open_pts[keep] = False
+
+    return pts[keep]
+
+
+def _first_true_per_group(mask, group, n_groups):
+    # Index of the first True in mask for each group (groups are contiguous)
+    idx = np.flatnonzero(mask)
+    first = np.full(n_groups, -1, dtype=np.intp)
+    first[group[idx][::-1]] = idx[::-1]
+    return first
+
+
+def encode_polyline(points, precision=5):
+    """
+    Google encoded polyline of (lat, lon) points, same output as
+    polyline.encode() but vectorized (the pure-Python encoder costs about as
+    much as dumping the raw coordinates to JSON).
+    """
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if not len(pts):
+        return ''
+    scaled = pts * 10 ** precision
+    # Round half away from zero, like the reference implementation
+    ints = (np.sign(scaled) * np.floor(np.abs(scaled) + 0.5)).astype(np.int64)
+    deltas = np.diff(ints, axis=0, prepend=0).ravel()
+
+    # Zig-zag sign encoding, then 5-bit chunks, least significant first
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+    chunks = (values[:, None] >> (5 * np.arange(7))) & 0x1f
+    n_chunks = (np.floor(np.log2(np.maximum(values, 1))).astype(np.int64) + 5) // 5
+    used = np.arange(7) < n_chunks[:, None]
+    more = np.arange(7) < (n_chunks - 1)[:, None]
+    chars = chunks + 63 + np.where(more, 0x20, 0)
+    return chars[used].astype(np.uint8).tobytes().decode('ascii')
+
+
+DISTANCE_METHODS = {
+    'haversine': haversine_miles,
+    'ellipsoidal': lambert_miles,
+    'geodesic': geodesic_miles,
+}
+
+
+def segment_distances(points, method='haversine'):
+    """
+    Distances in miles between consecutive (lat, lon) points, computed
+    in one vectorized pass. Returns an array of len(points) - 1.
+    """
+    try:
+        kernel = DISTANCE_METHODS[method]
+    except KeyError:
+        raise ValueError(f"Unknown distance method: {method}")
+
+    lats, lons = _as_lat_lon(points)
+    if len(lats) < 2:
+        return np.zeros(0)
+    return kernel(lats[:-1], lons[:-1], lats[1:], lons[1:])
+
+
+def cumulative_distance(points, method='haversine'):
+    """
+    Cumulative along-path distance in miles, starting at 0 for the first point.
+    """
+    seg = segment_distances(points, method)
+    cum = np.zeros(len(seg) + 1)
+    np.cumsum(seg, out=cum[1:])
+    return cum
+
+
+def resample_path(points, step_miles, cum_dist=None, method='haversine'):
+    """
+    Evenly spaced points every step_miles along a (lat, lon) path, plus the
+    final point. Positions are linearly interpolated within each original
+    segment (segments are short enough for that to stay on the road).
+
+    cum_dist: the path's cumulative distance if already known (e.g. scaled
+    to the router's total); otherwise computed with `method`.
+    Returns (points (m, 2), miles (m,)) where miles is the along-path
+    distance of each resampled point.
+    """
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    cum = cumulative_distance(pts, method) if cum_dist is None else np.asarray(cum_dist, dtype=np.float64)
+    total = cum[-1] if len(cum) else 0.0
+    if len(pts) < 2 or total <= 0 or step_miles <= 0:
+        return pts, cum
+
+    miles = np.arange(0.0, total, step_miles)
+    miles = np.append(miles, total) if total - miles[-1] > 1e-9 else miles
+    lats = np.interp(miles, cum, pts[:, 0])
+    lons = np.interp(miles, cum, pts[:, 1])
+    return np.stack([lats, lons], axis=-1), miles
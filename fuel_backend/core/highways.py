@@ -0,0 +1,226 @@
+"""
+Highways of stations and routes, for matching one against the other.
+
+The station Address column names the roads a truck stop sits on, e.g.
+"I-44, EXIT 283 & US-69" or "I-39/US-51, EXIT 111 & SR-72". Routes from
+OSRM (with steps) carry the same kind of refs per maneuver, e.g.
+"I 44;US 69". Both are reduced to highway ids: 'I-44', 'US-69' (also
+written "US HWY 69"), 'SR-72' (state routes of any state, whatever the
+local prefix: SR, ST, HWY, TX, OH, ...) and 'FM-1938'. County roads and
+unnumbered names are left out.
+"""
+import re
+
+import numpy as np
+from django.conf import settings
+
+from .store import StringColumn
+
+HIGHWAY_MATCHING_DEFAULTS = {
+    'ENABLED': True,
+    # A station on known highways is a candidate only if the route is on one
+    # of them within this many miles of the station's along-route position
+    # (stations sit at their city's centroid, so this stays loose)
+    'WINDOW_MILES': 15,
+}
+
+
+def highway_matching_options():
+    return dict(HIGHWAY_MATCHING_DEFAULTS, **getattr(settings, 'HIGHWAY_MATCHING', {}))
+
+
+# Prefix -> highway class. Anything else followed by a number in an OSRM
+# ref is a state route (state postal codes: "TX 114", "NJ 17"); addresses
+# use the postal codes too ("OH 225", "WI-29"), next to the generic ones.
+_CLASSES = {'I': 'I', 'IH': 'I', 'US': 'US', 'FM': 'FM', 'RM': 'FM'}
+_STATE_ROUTES = {'SR', 'ST', 'SH', 'HWY', 'HIGHWAY', 'ROUTE', 'RT', 'RTE', 'STATE'}
+_STATE_CODES = {
+    'AL', 'AK', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'FL', 'GA', 'HI', 'ID', 'IL', 'IN', 'IA', 'KS', 'KY',
+    'LA', 'ME', 'MD', 'MA', 'MI', 'MN', 'MS', 'MO', 'MT', 'NE', 'NV', 'NH', 'NJ', 'NM', 'NY', 'NC', 'ND',
+    'OH', 'OK', 'OR', 'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA', 'WV', 'WI', 'WY',
+    'AB', 'BC', 'MB', 'NB', 'NL', 'NS', 'ON', 'PE', 'QC', 'SK', 'YT',
+}
+# CO is a county road in addresses ("CO RD 12") and OR mostly the word
+# ("EXIT 227 OR 225"); Oregon routes still match as "OR-58"
+_SKIP = {'CR', 'EXIT', 'MM', 'MILE', 'CO', 'COUNTY'}
+_WORDS = {'OR'}
+
+_ROAD = re.compile(r'\b([A-Z]{1,8})\s*(-?)\s*(\d{1,4})[A-Z]?\b')
+# "US HWY 63" is US-63, not a state highway
+_US_HIGHWAY = re.compile(r'\bUS\s*(?:HWY|HIGHWAY)\b')
+_EXIT = re.compile(r'\bEXIT\s*#?\s*(\d+\s?[A-Z]?)\b')
+
+
+def _highway_id(prefix, number, any_prefix=False, hyphen=''):
+    if prefix in _CLASSES:
+        return f"{_CLASSES[prefix]}-{int(number)}"
+    if prefix in _STATE_ROUTES or (any_prefix and prefix not in _SKIP):
+        return f"SR-{int(number)}"
+    if prefix in _STATE_CODES and prefix not in _SKIP and (hyphen or prefix not in _WORDS):
+        return f"SR-{int(number)}"
+    return None
+
+
+def _highway_ids(text, any_prefix=False):
+    ids = []
+    for prefix, hyphen, number in _ROAD.findall(_US_HIGHWAY.sub('US', text)):
+        highway = _highway_id(prefix, number, any_prefix, hyphen)
+        if highway is not None and highway not in ids:
+            ids.append(highway)
+    return ids
+
+
+def parse_address(address):
+    """(highway ids, exit or None) of a station Address, e.g. (['I-44', 'US-69'], '283')."""
+    text = str(address).upper()
+    exit_match = _EXIT.search(text)
+    return _highway_ids(text), exit_match.group(1).replace(' ', '') if exit_match else None
+
+
+def parse_ref(ref):
+    """Highway ids of an OSRM step ref, e.g. 'I 44;US 69' -> ['I-44', 'US-69']."""
+    return _highway_ids(str(ref).upper(), any_prefix=True)
+
+
+def route_highways(legs, distance_miles):
+    """
+    [[start_mile, end_mile, [highway ids]], ...] for the steps of an OSRM
+    route (legs[].steps[] with distance and ref), consecutive steps on the
+    same highways merged. Miles are scaled to distance_miles, as the
+    optimizer scales its own. Steps without a ref are left out.
+    """
+    steps = [step for leg in legs for step in leg.get('steps', [])]
+    meters = np.cumsum([0.0] + [step['distance'] for step in steps])
+    if not steps or meters[-1] <= 0:
+        return []
+    miles = meters * (distance_miles / meters[-1])
+
+    segments = []
+    for step, start, end in zip(steps, miles[:-1].tolist(), miles[1:].tolist()):
+        ids = parse_ref(step.get('ref') or '')
+        if not ids or end <= start:
+            continue
+        if segments and segments[-1][2] == ids and segments[-1][1] >= start - 1e-6:
+            segments[-1][1] = end
+        else:
+            segments.append([start, end, ids])
+    return segments
+
+
+def _merged(intervals, pad):
+    # Sorted (starts, ends) of the union of intervals widened by pad
+    intervals = sorted((start - pad, end + pad) for start, end in intervals)
+    starts, ends = [], []
+    for start, end in intervals:
+        if ends and start <= ends[-1]:
+            ends[-1] = max(ends[-1], end)
+        else:
+            starts.append(start)
+            ends.append(end)
+    return np.array(starts), np.array(ends)
+
+
+def _within(miles, starts, ends):
+    # Whether each mile lies in one of the (merged, sorted) intervals
+    if len(starts) == 0:
+        return np.zeros(len(miles), dtype=bool)
+    i = np.searchsorted(starts, miles, side='right') - 1
+    return (i >= 0) & (miles <= ends[np.maximum(i, 0)])
+
+
+class HighwayIndex:
+    """
+    Highways and exit of every station, from its Address. Parsed once per
+    distinct address (the column is a store.StringColumn, ~5.6k distinct
+    values for 8k rows), so stations only carry the column's codes. Built
+    with the CSV data and stored in the data snapshot (to_arrays), since
+    the regexes take longer than loading everything else.
+
+        names                      highway ids ('I-44', ...), indexed below
+        value_highways[value_start[v]:value_start[v + 1]]
+                                   highways of distinct address v
+        value_exits[v]             its exit ('283', '29A') or None
+    """
+
+    def __init__(self, codes, names, value_highways, value_start, value_exits):
+        self.codes = codes
+        self.names = list(names)
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        self.value_highways = np.asarray(value_highways, dtype=np.int32)
+        self.value_start = np.asarray(value_start, dtype=np.intp)
+        self.value_exits = list(value_exits)
+
+    @classmethod
+    def parse(cls, addresses):
+        """Index for an address StringColumn."""
+        ids = {}
+        highways, counts, exits = [], [], []
+        for value in addresses.values:
+            names, exit_label = parse_address(value)
+            highways.extend(ids.setdefault(name, len(ids)) for name in names)
+            counts.append(len(names))
+            exits.append(exit_label)
+        return cls(addresses.codes, list(ids), highways, np.concatenate([[0], np.cumsum(counts)]), exits)
+
+    def to_arrays(self):
+        """Station arrays for the snapshot (see FuelStationManager.read_csv)."""
+        return {
+            'highway_name': StringColumn(np.arange(len(self.names)), self.names),
+            'address_highways': self.value_highways,
+            'address_highway_start': self.value_start.astype(np.int64),
+            'address_exit': StringColumn.from_values([e or '' for e in self.value_exits]),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(arrays['address'].codes, arrays['highway_name'].values, arrays['address_highways'],
+                   arrays['address_highway_start'], [e or None for e in arrays['address_exit'].tolist()])
+
+    def station_highways(self, idx):
+        value = self.codes[idx]
+        return [self.names[h] for h in self.value_highways[self.value_start[value]:self.value_start[value + 1]]]
+
+    def station_exit(self, idx):
+        return self.value_exits[self.codes[idx]]
+
+    def on_route(self, stations, miles, segments, window_miles=15):
+        """
+        Mask over stations (with their along-route miles): False for a
+        station on known highways none of which the route (segments from
+        route_highways) uses within window_miles of it. Stations with no
+        parsed highway, or where the route has no highway refs nearby, are
+        kept.
+        """
+        stations = np.asarray(stations, dtype=np.intp)
+        miles = np.asarray(miles, dtype=np.float64)
+        keep = np.ones(len(stations), dtype=bool)
+        if not segments or not len(stations):
+            return keep
+
+        values = self.codes[stations]
+        counts = self.value_start[values + 1] - self.value_start[values]
+        covered_starts, covered_ends = _merged([(s, e) for s, e, _ in segments], window_miles)
+        subject = (counts > 0) & _within(miles, covered_starts, covered_ends)
+        if not subject.any():
+            return keep
+
+        # (station position, highway) pairs of the stations to check
+        positions = np.repeat(np.flatnonzero(subject), counts[subject])
+        offsets = np.arange(len(positions)) - np.repeat(np.cumsum(counts[subject]) - counts[subject], counts[subject])
+        pair_highway = self.value_highways[self.value_start[values[positions]] + offsets]
+
+        by_highway = {}
+        for start, end, ids in segments:
+            for name in ids:
+                if name in self.ids:
+                    by_highway.setdefault(self.ids[name], []).append((start, end))
+
+        matched = np.zeros(len(stations), dtype=bool)
+        for highway, intervals in by_highway.items():
+            pairs = np.flatnonzero(pair_highway == highway)
+            if len(pairs):
+                starts, ends = _merged(intervals, window_miles)
+                hit = positions[pairs][_within(miles[positions[pairs]], starts, ends)]
+                matched[hit] = True
+        keep[subject] = matched[subject]
+        return keep
@@ -0,0 +1,83 @@
+import platform
+
+from django.core.management.base import BaseCommand, CommandError
+
+from fuel_backend.core import benchmarks
+from fuel_backend.core.routing import SyntheticBackend, get_backend
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the geocoder, station index and optimizer on recorded routes and "
+        "compare against the stored baseline for this machine."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('-k', dest='filter', help="Only run benchmarks whose name contains this string")
+        parser.add_argument('--machine', default=platform.node() or 'default',
+                            help="Baseline name (default: this host's name)")
+        parser.add_argument('--save-baseline', action='store_true', help="Store these results as the new baseline")
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help="%% slower than baseline reported as a regression (default 10)")
+        parser.add_argument('--fail-on-regression', action='store_true', help="Exit non-zero if anything regressed")
+        parser.add_argument('--min-time', type=float, default=0.5, help="Seconds to spend per benchmark (default 0.5)")
+        parser.add_argument('--record', action='store_true',
+                            help="Re-record the route fixtures from the configured routing backend and exit")
+        parser.add_argument('--synthetic-step', type=float, default=0.1,
+                            help="Vertex spacing in miles when recording with the synthetic backend "
+                                 "(default 0.1, close to OSRM's full-overview density)")
+
+    def handle(self, *args, **options):
+        if options['record']:
+            backend = get_backend()
+            if isinstance(backend, SyntheticBackend):
+                backend = SyntheticBackend(step_miles=options['synthetic_step'])
+            for lane, path in benchmarks.record_fixtures(backend).items():
+                self.stdout.write(f"{lane}: {path}")
+            return
+
+        try:
+            routes = benchmarks.load_fixtures()
+        except Exception as e:
+            raise CommandError(f"{e}. Record fixtures with: manage.py benchmark --record")
+
+        try:
+            cases = benchmarks.collect_benchmarks(routes)
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['filter']:
+            cases = [(name, fn) for name, fn in cases if options['filter'] in name]
+
+        results = {}
+        for name, fn in cases:
+            results[name] = benchmarks.summarize(*benchmarks.time_call(fn, min_time=options['min_time']))
+
+        baseline = benchmarks.read_baseline(options['machine'])
+        benchmarks.compare(results, baseline, options['threshold'])
+        self._report(results, baseline)
+
+        if options['save_baseline']:
+            path = benchmarks.write_baseline(options['machine'], results)
+            self.stdout.write(self.style.SUCCESS(f"Saved baseline {path}"))
+
+        regressions = [name for name, r in results.items() if r['status'] == 'regression']
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f"{len(regressions)} benchmark(s) regressed more than {options['threshold']}%")
+
+    def _report(self, results, baseline):
+        if baseline:
+            self.stdout.write(f"Baseline: {baseline['machine']} @ {baseline.get('commit') or '?'} ({baseline['created'][:19]})")
+        else:
+            self.stdout.write("No baseline for this machine yet (use --save-baseline)")
+
+        width = max(len(name) for name in results) if results else 0
+        self.stdout.write(f"{'benchmark':<{width}}  {'rounds':>6}  {'median ms':>10}  {'min ms':>10}  {'baseline':>10}  change")
+        for name, r in results.items():
+            base = f"{r['baseline_ms']:.4f}" if r['baseline_ms'] is not None else '-'
+            change = f"{r['change_pct']:+.1f}%" if r['change_pct'] is not None else ''
+            line = f"{name:<{width}}  {r['rounds']:>6}  {r['median_ms']:>10.4f}  {r['min_ms']:>10.4f}  {base:>10}  {change}"
+            if r['status'] == 'regression':
+                line = self.style.ERROR(f"{line}  REGRESSION")
+            elif r['status'] == 'improvement':
+                line = self.style.SUCCESS(line)
+            self.stdout.write(line)
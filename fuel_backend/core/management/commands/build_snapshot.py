@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from fuel_backend.core.data_manager import CityGeocoder, FuelStationManager
+from fuel_backend.core.snapshot import snapshot_dir, write_snapshot
+
+
+class Command(BaseCommand):
+    help = "Compile the station and city CSVs into the memory-mappable data snapshot."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="Snapshot directory (default: settings.DATA_SNAPSHOT_DIR)")
+
+    def handle(self, *args, **options):
+        directory = options['output'] or snapshot_dir()
+        if not directory:
+            raise CommandError("No output directory: pass --output or set DATA_SNAPSHOT_DIR.")
+
+        started = time.perf_counter()
+        stations = FuelStationManager.read_csv()
+        cities = CityGeocoder.read_csv()
+        path = write_snapshot({'stations': stations, 'cities': cities}, directory)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {path}: {len(stations['price'])} stations, {len(cities['lat'])} cities "
+            f"in {time.perf_counter() - started:.2f}s"
+        ))
@@ -0,0 +1,36 @@
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+
+from fuel_backend.core.data_manager import FuelStationManager
+from fuel_backend.core.snapshot import snapshot_dir
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply a new OPIS-format price CSV without rebuilding station geometry. "
+        "The new price version is written to the data snapshot directory; running "
+        "workers switch to it within PRICE_POLL_SECONDS."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path', help="OPIS price CSV (same columns as fuel-prices-for-be-assessment.csv)")
+
+    def handle(self, *args, **options):
+        if not snapshot_dir():
+            # The new prices would only live in this (exiting) process
+            raise CommandError("DATA_SNAPSHOT_DIR is not set: nowhere to write the new price version")
+        try:
+            fuel_df = pd.read_csv(options['csv_path'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not read {options['csv_path']}: {e}")
+
+        manager = FuelStationManager.get_instance()
+        try:
+            stats = manager.apply_price_update(fuel_df, source=options['csv_path'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Price version {stats['price_version']}: {stats['changed']} prices changed "
+            f"({stats['matched']} rows matched, {stats['unmatched']} unmatched)"
+        ))
@@ -0,0 +1,199 @@
+"""
+In-process metrics, exposed in the Prometheus text format at /api/metrics.
+
+    with span('geocode'):            # stage latency histogram
+        ...
+    KDTREE_QUERIES.inc()             # counters
+
+Metrics are per process: scrape each worker (or aggregate upstream).
+Optimizer work done in the batch process pool is timed in those
+processes and doesn't show up here; the batch request latency does.
+
+Collectors registered with register_collector() are called at scrape time
+for values that already live elsewhere (route cache stats, data status).
+"""
+import contextlib
+import contextvars
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds; fine-grained at the low end, where most stages land
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_str(labelnames, values):
+    if not labelnames:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels[name]) for name in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name + '_total', _label_str(self.labelnames, key), value) for key, value in items]
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            entry[-2] += value
+            entry[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, list(entry)) for key, entry in self._values.items())
+        out = []
+        for key, entry in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, entry):
+                cumulative += n
+                labels = _label_str(self.labelnames + ('le',), key + (_format_value(bound),))
+                out.append((self.name + '_bucket', labels, cumulative))
+            labels = _label_str(self.labelnames, key)
+            out.append((self.name + '_sum', labels, entry[-2]))
+            out.append((self.name + '_count', labels, entry[-1]))
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, fn):
+        """fn() -> iterable of (name, type, documentation, [(labels dict, value)])."""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            # Counters are exposed (and typed) under their _total name
+            family = metric.name + '_total' if metric.type == 'counter' else metric.name
+            lines.append(f"# HELP {family} {metric.documentation}")
+            lines.append(f"# TYPE {family} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+
+        for collector in self._collectors:
+            try:
+                families = list(collector())
+            except Exception:
+                logger.exception("Metrics collector %s failed", getattr(collector, '__name__', collector))
+                continue
+            for name, metric_type, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    label_str = _label_str(tuple(labels), tuple(labels.values()))
+                    lines.append(f"{name}{label_str} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'fuel_request_seconds', 'API request latency.', ('endpoint', 'status')))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'fuel_stage_seconds', 'Latency of each request stage.', ('stage',)))
+KDTREE_QUERIES = REGISTRY.register(Counter(
+    'fuel_kdtree_queries', 'Station KD-tree queries.', ('kind',)))
+KDTREE_QUERY_POINTS = REGISTRY.register(Counter(
+    'fuel_kdtree_query_points', 'Points looked up in the station KD-tree.', ('kind',)))
+CANDIDATE_STATIONS = REGISTRY.register(Counter(
+    'fuel_candidate_stations_examined', 'Corridor stations examined by the optimizer.', ('mode',)))
+SINGLE_FLIGHT_CALLS = REGISTRY.register(Counter(
+    'fuel_single_flight_calls', 'Routing/optimization calls, executed or coalesced into an identical in-flight call.',
+    ('stage', 'result')))
+RESULT_CACHE_LOOKUPS = REGISTRY.register(Counter(
+    'fuel_result_cache_lookups', 'Route result cache lookups by result.', ('result',)))
+
+
+# Stage timings of the current request, for the per-request log line
+_request_spans = contextvars.ContextVar('request_spans', default=None)
+
+
+@contextlib.contextmanager
+def span(stage):
+    """Time a block into fuel_stage_seconds{stage=...} (and the request's span log)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans[stage] = spans.get(stage, 0.0) + elapsed
+
+
+@contextlib.contextmanager
+def collect_spans():
+    """Collect the span timings recorded in this block into a dict {stage: seconds}."""
+    spans = {}
+    token = _request_spans.set(spans)
+    try:
+        yield spans
+    finally:
+        _request_spans.reset(token)
+
+
+def format_spans(spans):
+    return ' '.join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in spans.items())
@@ -0,0 +1,50 @@
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .metrics import REQUEST_SECONDS, collect_spans, format_spans
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsMiddleware:
+    """
+    Request latency histogram per URL name and status, plus one DEBUG log
+    line per request with its stage timings (see metrics.span). Wraps
+    response rendering too, so serialization time is included.
+    Sync and async capable, so async views under ASGI stay on the event loop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with collect_spans() as spans:
+            response = self.get_response(request)
+        return self._observe(request, response, started, spans)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with collect_spans() as spans:
+            response = await self.get_response(request)
+        return self._observe(request, response, started, spans)
+
+    def _observe(self, request, response, started, spans):
+        elapsed = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        endpoint = match.url_name if match is not None and match.url_name else 'unmatched'
+        if endpoint != 'metrics':
+            REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, status=response.status_code)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("%s %s %s %.1fms %s", request.method, request.path, response.status_code,
+                             elapsed * 1000, format_spans(spans))
+        return response
@@ -1,48 +1,168 @@
+import copy
+
 import numpy as np
-import pandas as pd
+from django.conf import settings
 from .data_manager import FuelStationManager
-from geopy.distance import geodesic
+from .geo import cumulative_distance, resample_path
+from .corridor import RouteCorridor
+from .metrics import CANDIDATE_STATIONS, span
+from .highways import highway_matching_options
+from .tiles import StationTileCache, station_tiles_options
+
+class OptimizerError(Exception):
+    """No feasible plan (e.g. no station within range)."""
+
 
 class RouteOptimizer:
-    def __init__(self, route_data):
-        raw_points = route_data['path']
-        # Downsample to speed up initialization and searching
-        # Keep first and last, sample every 10th in between
-        if len(raw_points) > 1000:
-            self.route_points = [raw_points[0]] + raw_points[1:-1:10] + [raw_points[-1]]
-        else:
-            self.route_points = raw_points
-            
+    MODES = ('greedy', 'exact')
+
+    # Vehicle defaults
+    TANK_RANGE_MILES = 500
+    MPG = 10.0
+    SAFETY_BUFFER_MILES = 10
+    # Greedy never refuels closer than this to its last stop
+    MIN_PROGRESS_MILES = 15
+    # Spacing of the resampled route points (ROUTE_RESAMPLE_MILES setting)
+    RESAMPLE_MILES = 2.0
+
+    def __init__(self, route_data, distance_method='ellipsoidal', tank_range_miles=None, mpg=None, safety_buffer_miles=None,
+                 resample_miles=None, start_fuel=1.0):
+        self.tank_range = tank_range_miles if tank_range_miles is not None else self.TANK_RANGE_MILES
+        self.mpg = mpg if mpg is not None else self.MPG
+        self.safety_buffer = safety_buffer_miles if safety_buffer_miles is not None else self.SAFETY_BUFFER_MILES
+        # Fraction of a full tank at the start
+        self.start_fuel = start_fuel
+        # Vehicle-independent tables, shared with for_vehicle() copies
+        self._shared = {}
+        if resample_miles is None:
+            resample_miles = getattr(settings, 'ROUTE_RESAMPLE_MILES', self.RESAMPLE_MILES)
+
+        raw_points = np.asarray(route_data['path'], dtype=np.float64).reshape(-1, 2)
         self.total_distance = route_data['distance_miles']
         self.manager = FuelStationManager.get_instance()
+        # Price refreshes swap the snapshot; this optimization keeps the one it started with
+        self.manager.poll_prices()
+        self.price_snapshot = self.manager.price_snapshot
         
-        self.cum_dist = [0]
-        cur = 0
-        for i in range(1, len(self.route_points)):
-            # Dist between i-1 and i
-            d = geodesic(self.route_points[i-1], self.route_points[i]).miles
-            cur += d
-            self.cum_dist.append(cur)
-        
-        self.cum_dist = np.array(self.cum_dist)
-        
-        # Normalize to match OSRM total distance
-        if cur > 0:
-            scale = self.total_distance / cur
-            self.cum_dist = self.cum_dist * scale
-            
-    def optimize(self):
+        with span('cum_dist'):
+            # One vectorized pass instead of a geodesic() call per segment.
+            # See geo.py for the tolerance of each method vs. geopy's geodesic.
+            cum_dist = cumulative_distance(raw_points, method=distance_method)
+            cur = cum_dist[-1] if len(cum_dist) else 0
+
+            # Normalize to match OSRM total distance
+            if cur > 0:
+                scale = self.total_distance / cur
+                cum_dist = cum_dist * scale
+
+            # Resample to a point every resample_miles, so the work per route
+            # follows trip length rather than how densely OSRM drew the geometry
+            # (dense in cities, sparse on interstates).
+            self.route_points, self.cum_dist = resample_path(raw_points, resample_miles, cum_dist=cum_dist)
+
+        # Every station near the route, found once; optimize() slices it by mile.
+        tiles = StationTileCache.get_instance() if station_tiles_options()['ENABLED'] else None
+        # Highway refs of the route (OSRM steps), to drop stations on other roads
+        highways = highway_matching_options()
+        with span('candidate_search'):
+            self.corridor = RouteCorridor(self.route_points, self.cum_dist, self.manager,
+                                          price_snapshot=self.price_snapshot, tiles=tiles,
+                                          highways=route_data.get('highways') if highways['ENABLED'] else None,
+                                          window_miles=highways['WINDOW_MILES'])
+
+    def optimize(self, mode='greedy'):
+        """
+        mode='greedy': cheapest reachable station, fill to full.
+        mode='exact': minimum-cost plan with partial fills (see iter_exact).
+        The exact result also carries the greedy cost and the savings vs. greedy.
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown optimizer mode: {mode}")
+        with span('selection'):
+            if mode == 'greedy':
+                return self.optimize_greedy()
+
+            result = self.optimize_exact()
+            if 'error' in result:
+                return result
+            greedy = self.optimize_greedy()
+            if 'error' not in greedy:
+                result['greedy_total_cost'] = greedy['total_cost']
+                result['savings_vs_greedy'] = round(greedy['total_cost'] - result['total_cost'], 2)
+            return result
+
+    def for_vehicle(self, vehicle):
+        """
+        This optimizer for another VehicleProfile. The route, corridor and
+        price tables are shared, not rebuilt, so each extra vehicle only
+        costs its own plan.
+        """
+        optimizer = copy.copy(self)
+        optimizer.tank_range = vehicle.tank_range_miles
+        optimizer.mpg = vehicle.mpg
+        optimizer.safety_buffer = vehicle.safety_buffer_miles
+        optimizer.start_fuel = vehicle.start_fuel
+        return optimizer
+
+    def optimize_vehicles(self, vehicles, mode='greedy'):
+        """optimize() for each VehicleProfile: [{"vehicle": ..., "stops", "total_cost"... or "error"}]."""
+        return [dict(vehicle=vehicle.as_dict(), **self.for_vehicle(vehicle).optimize(mode)) for vehicle in vehicles]
+
+    def iter_stops(self, mode='greedy'):
+        """(stop, cost) pairs of the mode's plan, produced as they are picked."""
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown optimizer mode: {mode}")
+        return self.iter_greedy() if mode == 'greedy' else self.iter_exact()
+
+    def _collect(self, steps, total_fuel_cost):
+        # Run an iter_* plan to completion into the result dict
         stops = []
-        total_fuel_cost = 0
-        
+        try:
+            for stop, cost in steps:
+                total_fuel_cost += cost
+                stops.append(stop)
+        except OptimizerError as e:
+            return {"error": str(e)}
+        return {
+            "stops": stops,
+            "total_cost": round(total_fuel_cost, 2)
+        }
+
+    def _stop_record(self, pos, gallons, station_idx=None):
+        # Build the response entry for corridor position pos
+        if station_idx is None:
+            station_idx = self.corridor.station_idx
+        station = self.manager.station_record(station_idx[pos])
+        price = float(self.corridor.prices[pos])
+        cost = gallons * price
+        return {
+            "city": station['city'], # or name?
+            "name": station['name'],
+            "address": station['address'],
+            "lat": station['lat'],
+            "lon": station['lon'],
+            "price": price,
+            "gallons": round(gallons, 2),
+            "cost_chunk": round(cost, 2)
+        }, cost
+            
+    def optimize_greedy(self):
+        return self._collect(self.iter_greedy(), 0)
+
+    def iter_greedy(self):
+        """
+        Greedy plan, one (stop, cost) at a time as stops are picked.
+        Raises OptimizerError when no station is in range.
+        """
         # Simulation State
         current_route_idx = 0
-        current_tank_range = 500 # Start full
-        tank_capacity_range = 500
+        current_tank_range = self.tank_range * self.start_fuel # Start full (by default)
+        tank_capacity_range = self.tank_range
         total_dist = self.cum_dist[-1]
         
-        # While we cannot reach the end
-        while (self.cum_dist[current_route_idx] + current_tank_range) < total_dist:
+        # While we cannot reach the end with the safety buffer still in the
+        # tank (held back on the last leg too, as in iter_exact)
+        while (self.cum_dist[current_route_idx] + current_tank_range - self.safety_buffer) < total_dist:
             
             # Defines the window of "reachable" route indices
             current_dist = self.cum_dist[current_route_idx]
@@ -75,58 +195,32 @@ class RouteOptimizer:
             
             search_start_idx = current_route_idx + 1
             # Find index strictly less than max reachable (minus a buffer for safety, say 10 miles)
-            safe_max_dist = max_reachable_dist - 10
+            safe_max_dist = max_reachable_dist - self.safety_buffer
             
             # Numpy searchsorted to find boundary
             search_end_idx = np.searchsorted(self.cum_dist, safe_max_dist, side='right') - 1
             
             if search_end_idx <= search_start_idx:
-                # Should not happen unless steps are huge or stuck
-                raise Exception("No progress possible - stuck at location.")
-            
-            # Scan for stations along this segment
-            # Sampling to avoid checking every point
-            # Sample every ~20th point or ~5 miles?
-            # Step size based on array size
-            step = max(1, (search_end_idx - search_start_idx) // 20) 
-            
-            candidates = []
-            
-            for i in range(search_start_idx, search_end_idx + 1, step): 
-                # Optimization: Skip points too close to current location (prevent 0-progress loops)
-                if (self.cum_dist[i] - self.cum_dist[current_route_idx]) < 15:
-                    continue
-
-                pt = self.route_points[i]
-                lat, lon = pt
-                # Search stations within 10 miles (approx 0.15 deg)
-                nearby = self.manager.find_nearby_stations(lat, lon, radius_deg=0.15)
-                
-                if not nearby.empty:
-                    # Calculate exact distance from start for each station (projection)
-                    # Simple approx: assume it's at self.cum_dist[i]
-                    # Better: Re-calc geodesic
-                    for _, station in nearby.iterrows():
-                        candidates.append({
-                            'station': station,
-                            'route_idx': i,
-                            'price': station['price'],
-                            'lat': station['lat'],
-                            'lon': station['lon']
-                        })
-            
-            if not candidates:
+                # Steps are huge, or we started with less than the buffer
+                raise OptimizerError("No progress possible - stuck at location.")
+            
+            # Stations in the reachable window, straight from the corridor index.
+            # Skip stations too close to current location (prevent 0-progress loops)
+            window = self.corridor.window(current_dist + self.MIN_PROGRESS_MILES, self.cum_dist[search_end_idx])
+            prices = self.corridor.prices[window]
+            CANDIDATE_STATIONS.inc(len(prices), mode='greedy')
+            
+            if len(prices) == 0:
                 # Emergency extend search?
                 # Or just Fail
-                return {"error": "No fuel stations found within range."}
+                raise OptimizerError("No fuel stations found within range.")
             
             # Logic: Find Cheapest. 
-            # Tie-break: Furthest along route (maximize i).
-            best_stop = sorted(candidates, key=lambda x: (x['price'], -x['route_idx']))[0]
+            # Tie-break: Furthest along route (maximize i), then lowest station index.
+            best = window.start + np.lexsort((self.corridor.station_idx[window], -self.corridor.miles[window], prices))[0]
             
             # Execute Stop
-            stop_station = best_stop['station']
-            stop_idx = best_stop['route_idx']
+            stop_idx = self.corridor.route_idx[best]
             
             # Calculate Fuel Consumed to get here
             # dist_driven = self.cum_dist[stop_idx] - self.cum_dist[current_route_idx]
@@ -170,28 +264,17 @@ class RouteOptimizer:
             # Conclusion: We want to target the CHEAPEST station. Matches intuition.
             
             dist_leg = self.cum_dist[stop_idx] - self.cum_dist[current_route_idx]
-            gallons_filled = dist_leg / 10.0
-            cost = gallons_filled * float(stop_station['price'])
-            
-            total_fuel_cost += cost
-            stops.append({
-                "city": stop_station['City_Norm'], # or name?
-                "name": stop_station['name'],
-                "address": stop_station['address'],
-                "lat": stop_station['lat'],
-                "lon": stop_station['lon'],
-                "price": float(stop_station['price']),
-                "gallons": round(gallons_filled, 2),
-                "cost_chunk": round(cost, 2)
-            })
+            # (plus whatever the tank was short of full when we set off)
+            gallons_filled = (dist_leg + (tank_capacity_range - current_tank_range)) / self.mpg
+            yield self._stop_record(best, gallons_filled)
             
             # Update state
             current_route_idx = stop_idx
             # Tank is now full
-            current_tank_range = 500
+            current_tank_range = tank_capacity_range
         
         # Finally, reach destination?
-        # The while loop breaks when (current + 500) >= total.
+        # The while loop breaks when (current + tank range - buffer) >= total.
         # Implies we can drive to finish.
         # Do we pay for the fuel used on the last leg?
         # "Total money spent on fuel".
@@ -210,8 +293,7 @@ class RouteOptimizer:
         # Let's Implement **Return Full**.
         # It makes the cost comparison fair.
         
-        final_leg_dist = total_dist - self.cum_dist[current_route_idx]
-        # We need to price this leg.
+        # The final leg would need pricing.
         # We don't have a station at destination.
         # I will use the average price of the USA ($3.50?) or the last paid price?
         # Or just not charge it.
@@ -220,8 +302,158 @@ class RouteOptimizer:
         # But I'll add a note in the response.
         # Wait, if I choose "Return Full", I need a price.
         # I'll just skip it to be literal to "Fuel Ups".
-        
-        return {
-            "stops": stops,
-            "total_cost": round(total_fuel_cost, 2)
-        }
+
+    def optimize_exact(self):
+        return self._collect(self.iter_exact(), 0.0)
+
+    def iter_exact(self):
+        """
+        Exact minimum-cost refueling along the corridor (the classic
+        "gas station problem" with partial fills).
+
+        Starting full, at each station we look at the next station that is no
+        more expensive (found for all stations at once with a monotonic stack):
+          - if it is within range, buy only enough to reach it and go there;
+          - otherwise fill up here and go to the cheapest station in range
+            (range-minimum query on a sparse table, ties -> furthest).
+        The destination acts as a free station, so we never buy fuel we
+        don't burn. The safety buffer is held back as a reserve on every leg.
+        O(n log n) in the number of corridor stations.
+        Yields (stop, cost) as stops are fixed; raises OptimizerError when
+        no station is in range.
+        """
+        capacity = self.tank_range - self.safety_buffer  # usable miles
+        start = self.tank_range * self.start_fuel - self.safety_buffer
+        total_dist = self.cum_dist[-1]
+        n = len(self.corridor.miles)
+
+        if total_dist <= start:
+            return
+        if n == 0 or self.corridor.miles[0] > start:
+            raise OptimizerError("No fuel stations found within range.")
+        CANDIDATE_STATIONS.inc(n, mode='exact')
+        pos, next_cheaper, cheapest_in = self._exact_tables()
+
+        # Leave with the starting fuel (minus reserve) and drive to the
+        # first decision point: the cheapest station we can reach.
+        i = cheapest_in(0, np.searchsorted(pos, start, side='right') - 1)
+        fuel = start - pos[i]
+
+        while i < n:
+            # Furthest station reachable on a full tank from here
+            reach = np.searchsorted(pos, pos[i] + capacity, side='right') - 1
+            j = next_cheaper[i]
+
+            if j <= reach:
+                need = pos[j] - pos[i]
+                buy = max(0.0, need - fuel)
+                nxt = j
+            else:
+                if reach <= i:
+                    raise OptimizerError("No fuel stations found within range.")
+                buy = capacity - fuel
+                nxt = cheapest_in(i + 1, reach)
+
+            if buy > 1e-9:
+                yield self._stop_record(i, buy / self.mpg, self.corridor.station_idx_last)
+
+            fuel = fuel + buy - (pos[nxt] - pos[i])
+            i = nxt
+
+    def _exact_tables(self):
+        # (pos, next_cheaper, cheapest_in) for iter_exact. They only depend
+        # on the corridor, so vehicles sharing it build them once.
+        tables = self._shared.get('exact')
+        if tables is None:
+            prices = self.corridor.prices
+            n = len(prices)
+            # Stations plus the destination as a zero-cost sentinel at index n
+            pos = np.append(self.corridor.miles, self.cum_dist[-1])
+            price = np.append(prices, -np.inf)
+
+            # Next station with price <= ours (monotonic stack)
+            next_cheaper = np.full(n, n, dtype=np.intp)
+            stack = []
+            for i in range(n - 1, -1, -1):
+                while stack and price[stack[-1]] > price[i]:
+                    stack.pop()
+                if stack:
+                    next_cheaper[i] = stack[-1]
+                stack.append(i)
+
+            tables = self._shared['exact'] = (pos, next_cheaper, _RangeMin(prices))
+        return tables
+
+
+class VehicleProfile:
+    """
+    One vehicle for the optimizer: tank range, fuel economy, the reserve
+    held back on every leg, and the starting fuel as a fraction of a full
+    tank. Unset fields take RouteOptimizer's defaults.
+    """
+    FIELDS = ('name', 'tank_range_miles', 'mpg', 'safety_buffer_miles', 'start_fuel')
+
+    def __init__(self, tank_range_miles=None, mpg=None, safety_buffer_miles=None, start_fuel=1.0, name=None):
+        self.name = name
+        self.tank_range_miles = tank_range_miles if tank_range_miles is not None else RouteOptimizer.TANK_RANGE_MILES
+        self.mpg = mpg if mpg is not None else RouteOptimizer.MPG
+        self.safety_buffer_miles = (safety_buffer_miles if safety_buffer_miles is not None
+                                    else RouteOptimizer.SAFETY_BUFFER_MILES)
+        self.start_fuel = start_fuel
+
+    @classmethod
+    def from_data(cls, data):
+        """Profile from a request body entry. Raises ValueError with a client-facing message."""
+        if not isinstance(data, dict):
+            raise ValueError("Each vehicle must be an object.")
+        unknown = sorted(set(data) - set(cls.FIELDS))
+        if unknown:
+            raise ValueError(f"Unknown vehicle field: {unknown[0]}")
+        name = data.get('name')
+        if name is not None and not isinstance(name, str):
+            raise ValueError("Vehicle name must be a string.")
+
+        values = {}
+        for field in cls.FIELDS[1:]:
+            value = data.get(field)
+            if value is None:
+                continue
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f"Vehicle {field} must be a number.")
+            values[field] = value
+        vehicle = cls(name=name, **values)
+
+        if not vehicle.tank_range_miles > 0 or not vehicle.mpg > 0:
+            raise ValueError("Vehicle tank_range_miles and mpg must be > 0.")
+        if not 0 <= vehicle.safety_buffer_miles < vehicle.tank_range_miles:
+            raise ValueError("Vehicle safety_buffer_miles must be >= 0 and less than tank_range_miles.")
+        if not 0 <= vehicle.start_fuel <= 1:
+            raise ValueError("Vehicle start_fuel must be between 0 and 1 (fraction of a full tank).")
+        return vehicle
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+
+class _RangeMin:
+    """
+    Sparse table over prices: index of the cheapest station in [lo, hi],
+    preferring the furthest one on ties. O(n log n) build, O(1) query.
+    """
+
+    def __init__(self, prices):
+        n = len(prices)
+        self.prices = prices
+        self.table = [np.arange(n)]
+        k = 1
+        while 2 * k <= n:
+            prev = self.table[-1]
+            left, right = prev[:n - 2 * k + 1], prev[k:n - k + 1]
+            self.table.append(np.where(prices[right] <= prices[left], right, left))
+            k *= 2
+
+    def __call__(self, lo, hi):
+        level = int(hi - lo + 1).bit_length() - 1
+        a = self.table[level][lo]
+        b = self.table[level][hi - (1 << level) + 1]
+        return b if self.prices[b] <= self.prices[a] else a
@@ -0,0 +1,32 @@
+from rest_framework.renderers import JSONRenderer
+
+from .metrics import span
+
+try:
+    import orjson
+except ImportError:  # optional; fall back to DRF's stdlib-json renderer
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer backed by orjson, several times faster on the large
+    coordinate lists in map responses. NumPy arrays and scalars serialize
+    natively. Browsable-API indentation requests fall back to DRF's encoder.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            with span('serialization'):
+                return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # Types orjson doesn't know (lazy translation strings, Decimal...)
+            # go through DRF's encoder
+            return super().render(data, accepted_media_type, renderer_context)
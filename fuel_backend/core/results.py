@@ -0,0 +1,135 @@
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .data_manager import FuelStationManager
+from .highways import highway_matching_options
+from .metrics import RESULT_CACHE_LOOKUPS
+from .optimizer import RouteOptimizer
+from .renderers import FastJSONRenderer
+
+try:
+    import orjson
+except ImportError:  # optional, as in renderers.py
+    orjson = None
+
+RESULT_CACHE_DEFAULTS = {
+    'ENABLED': True,
+    # Django cache (settings.CACHES) holding the results
+    'CACHE_ALIAS': 'default',
+    # Seconds. Entries of older price versions are never looked up again
+    # and just age out.
+    'TIMEOUT': 3600,
+}
+
+# Bump when the response body changes shape or the optimizer plans
+# differently, so long-lived (file) caches don't serve the old one
+RESULT_FORMAT = 2
+
+
+def result_cache_options():
+    return dict(RESULT_CACHE_DEFAULTS, **getattr(settings, 'RESULT_CACHE', {}))
+
+
+def optimizer_params():
+    """Vehicle and optimizer settings a result depends on (see RouteOptimizer)."""
+    return {
+        'tank_range_miles': RouteOptimizer.TANK_RANGE_MILES,
+        'mpg': RouteOptimizer.MPG,
+        'safety_buffer_miles': RouteOptimizer.SAFETY_BUFFER_MILES,
+        'min_progress_miles': RouteOptimizer.MIN_PROGRESS_MILES,
+        'resample_miles': getattr(settings, 'ROUTE_RESAMPLE_MILES', RouteOptimizer.RESAMPLE_MILES),
+        'highway_matching': highway_matching_options(),
+    }
+
+
+class RouteResultCache:
+    """
+    Finished route responses, as rendered JSON, in a Django cache.
+
+    A repeated quote for a lane skips routing, optimization and rendering:
+    the lookup is geocoding plus one cache get. The key covers everything
+    the body depends on: the lane (RouteService.lane_key, so the routing
+    backend and options too), the request options, the vehicle parameters,
+    and the station dataset and price version in use. A price update or a
+    new dataset therefore changes every key, and results computed with the
+    old data are never returned again.
+
+    Lanes are matched on resolved coordinates, so "Dallas, TX" and
+    "dallas tx" share an entry; the start/finish strings echoed in the body
+    are swapped in when they differ.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    KEY_PREFIX = 'route-result'
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    options = result_cache_options()
+                    cls._instance = RouteResultCache(alias=options['CACHE_ALIAS'], timeout=options['TIMEOUT'])
+        return cls._instance
+
+    def __init__(self, alias='default', timeout=3600):
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        # Django hands out cache connections per thread
+        return caches[self.alias]
+
+    def key(self, lane_key, options):
+        """Cache key for a lane and validated route_options(), at the current prices."""
+        manager = FuelStationManager.get_instance()
+        manager.poll_prices()
+        parts = {
+            'format': RESULT_FORMAT,
+            'lane': lane_key,
+            'mode': options['mode'],
+            'return_map': bool(options['return_map']),
+            'geometry_format': options['geometry_format'],
+            'simplify_tolerance': options['simplify_tolerance'],
+            'vehicle': optimizer_params(),
+            'vehicles': [v.as_dict() for v in options['vehicles']] if options.get('vehicles') else None,
+            'dataset': manager.dataset_id,
+            'prices': manager.price_version,
+        }
+        # Hashed: memcached limits keys to 250 characters
+        digest = hashlib.sha1(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+        return f"{self.KEY_PREFIX}:{digest}"
+
+    def get(self, key, start_query, finish_query):
+        """Cached response body (bytes) for key, or None."""
+        return self._body(self.cache.get(key), start_query, finish_query)
+
+    async def aget(self, key, start_query, finish_query):
+        return self._body(await self.cache.aget(key), start_query, finish_query)
+
+    def set(self, key, start_query, finish_query, body):
+        self.cache.set(key, (start_query, finish_query, body), self.timeout)
+
+    async def aset(self, key, start_query, finish_query, body):
+        await self.cache.aset(key, (start_query, finish_query, body), self.timeout)
+
+    def _body(self, entry, start_query, finish_query):
+        if entry is None:
+            RESULT_CACHE_LOOKUPS.inc(result='miss')
+            return None
+        RESULT_CACHE_LOOKUPS.inc(result='hit')
+        cached_start, cached_finish, body = entry
+        if (cached_start, cached_finish) == (start_query, finish_query):
+            return body
+
+        # Same lane asked with different spelling: echo this request's
+        # strings, as a fresh response would
+        data = orjson.loads(body) if orjson is not None else json.loads(body)
+        data['route']['start'] = start_query
+        data['route']['finish'] = finish_query
+        return FastJSONRenderer().render(data)
@@ -1,43 +1,704 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+import numpy as np
 import requests
 import polyline
+from asgiref.sync import sync_to_async
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.utils.module_loading import import_string
+from .geo import EARTH_RADIUS_MILES, to_unit_vectors
+from .highways import highway_matching_options, route_highways
+from .metrics import REGISTRY
+from .singleflight import SingleFlight
 
-class RouteService:
-    BASE_URL = "http://router.project-osrm.org/route/v1/driving"
+try:
+    import httpx
+except ImportError:  # async OSRM calls then fall back to a thread running requests
+    httpx = None
 
-    def get_route(self, start_coords, end_coords):
-        """
-        start_coords: (lat, lon)
-        end_coords: (lat, lon)
-        """
+logger = logging.getLogger(__name__)
+
+ROUTE_CACHE_DEFAULTS = {
+    'ENABLED': True,
+    # In-process LRU tier (decoded routes, per worker)
+    'MAX_ENTRIES': 128,
+    # On-disk tier (SQLite, shared by workers, survives restarts). None disables it.
+    'PATH': None,
+    'MAX_DISK_ENTRIES': 5000,
+    'TTL_SECONDS': 7 * 24 * 3600,
+    # Start/end coordinates are rounded to this many decimals for the key
+    # (4 decimals ~ 11 m).
+    'COORD_PRECISION': 4,
+}
+
+
+ROUTE_SERVICE_DEFAULTS = {
+    # 'osrm', 'replay', 'synthetic' or a dotted path to a RoutingBackend subclass
+    'BACKEND': 'osrm',
+    # OSRM route endpoint, e.g. a self-hosted router. None = public demo server.
+    'OSRM_BASE_URL': None,
+    # Directory of recorded routes for the replay backend
+    'REPLAY_DIR': None,
+    # If set, every route fetched is also saved there as a replay fixture
+    'RECORD_DIR': None,
+    # Synthetic backend: vertex spacing and road/great-circle distance ratio
+    'SYNTHETIC_STEP_MILES': 1.0,
+    'SYNTHETIC_DETOUR_FACTOR': 1.0,
+    # Keep-alive connection pool shared by every RouteService in the process
+    'POOL_CONNECTIONS': 4,
+    'POOL_MAXSIZE': 16,
+    # Async client (async route endpoint): concurrent connections to the router
+    'ASYNC_MAX_CONNECTIONS': 100,
+    # Seconds; requests' (connect, read) timeout
+    'CONNECT_TIMEOUT': 3.05,
+    'READ_TIMEOUT': 15,
+    # Retries on connection errors, timeouts and 429/5xx, with exponential
+    # backoff (BACKOFF_SECONDS * 2**attempt, capped) and full jitter
+    'RETRIES': 2,
+    'BACKOFF_SECONDS': 0.25,
+    'BACKOFF_MAX_SECONDS': 4,
+    # After this many consecutive failed calls, fail fast for BREAKER_RESET_SECONDS
+    'BREAKER_FAILURE_THRESHOLD': 5,
+    'BREAKER_RESET_SECONDS': 30,
+}
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def route_service_options():
+    return dict(ROUTE_SERVICE_DEFAULTS, **getattr(settings, 'ROUTE_SERVICE', {}))
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after failure_threshold consecutive failures. While open,
+    calls are rejected until reset_seconds have passed; then one trial call
+    is let through (half-open) and its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, failure_threshold=5, reset_seconds=30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """A call ended with no verdict on the router (e.g. cancelled): free a half-open trial."""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+def route_from_polyline(encoded, distance_miles, highways=None):
+    # Rebuild the route dict returned by RouteService from its compact form
+    path_points = polyline.decode(encoded, 6)
+    route = {
+        'distance_miles': distance_miles,
+        'path': path_points,
+        'geojson': {'type': 'LineString', 'coordinates': [[lon, lat] for lat, lon in path_points]},
+    }
+    if highways:
+        route['highways'] = highways
+    return route
+
+
+def route_key(start_coords, end_coords, options=None, precision=4):
+    """Lane key: rounded start/end coordinates plus anything that changes the route."""
+    p = precision
+    parts = [f"{start_coords[0]:.{p}f},{start_coords[1]:.{p}f}", f"{end_coords[0]:.{p}f},{end_coords[1]:.{p}f}"]
+    if options:
+        parts.append(json.dumps(options, sort_keys=True, separators=(',', ':')))
+    return ';'.join(parts)
+
+
+class RouteCache:
+    """
+    Two-tier LRU + TTL cache for routes.
+
+    The memory tier keeps decoded route dicts (callers must not mutate them).
+    The disk tier keeps (distance, encoded polyline) rows in SQLite, which is
+    ~10x smaller than the GeoJSON and survives restarts. Both tiers evict
+    the least recently used entries beyond their size limit, and drop
+    entries older than TTL_SECONDS.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    options = dict(ROUTE_CACHE_DEFAULTS, **getattr(settings, 'ROUTE_CACHE', {}))
+                    cls._instance = RouteCache(
+                        max_entries=options['MAX_ENTRIES'],
+                        ttl_seconds=options['TTL_SECONDS'],
+                        path=options['PATH'],
+                        max_disk_entries=options['MAX_DISK_ENTRIES'],
+                        precision=options['COORD_PRECISION'],
+                    )
+        return cls._instance
+
+    def __init__(self, max_entries=128, ttl_seconds=7 * 24 * 3600, path=None, max_disk_entries=5000, precision=4):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_entries = max_disk_entries
+        self.precision = precision
+        self._memory = OrderedDict()  # key -> (stored_at, route)
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS routes ('
+                ' key TEXT PRIMARY KEY, stored_at REAL, accessed_at REAL,'
+                ' distance_miles REAL, geometry TEXT)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS routes_accessed ON routes (accessed_at)')
+            columns = {row[1] for row in self._db.execute('PRAGMA table_info(routes)')}
+            if 'highways' not in columns:
+                # Added with highway matching; older rows just have none
+                self._db.execute('ALTER TABLE routes ADD COLUMN highways TEXT')
+
+    def key(self, start_coords, end_coords, options=None):
+        return route_key(start_coords, end_coords, options, self.precision)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[0] <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self._counters['hits'] += 1
+                    self._counters['memory_hits'] += 1
+                    return entry[1]
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    'SELECT stored_at, distance_miles, geometry, highways FROM routes WHERE key = ?', (key,)
+                ).fetchone()
+                if row is not None and now - row[0] <= self.ttl_seconds:
+                    self._db.execute('UPDATE routes SET accessed_at = ? WHERE key = ?', (now, key))
+                    route = route_from_polyline(row[2], row[1], json.loads(row[3]) if row[3] else None)
+                    self._remember(key, row[0], route)
+                    self._counters['hits'] += 1
+                    self._counters['disk_hits'] += 1
+                    return route
+
+            self._counters['misses'] += 1
+            return None
+
+    def set(self, key, route):
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, route)
+            if self._db is not None:
+                encoded = polyline.encode(route['path'], 6)
+                highways = json.dumps(route['highways']) if route.get('highways') else None
+                self._db.execute(
+                    'INSERT OR REPLACE INTO routes (key, stored_at, accessed_at, distance_miles, geometry, highways)'
+                    ' VALUES (?, ?, ?, ?, ?, ?)',
+                    (key, now, now, route['distance_miles'], encoded, highways),
+                )
+                self._evict_disk(now)
+
+    def _remember(self, key, stored_at, route):
+        self._memory[key] = (stored_at, route)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._counters['evictions'] += 1
+
+    def _evict_disk(self, now):
+        cur = self._db.execute('DELETE FROM routes WHERE stored_at < ?', (now - self.ttl_seconds,))
+        evicted = max(cur.rowcount, 0)
+        (count,) = self._db.execute('SELECT COUNT(*) FROM routes').fetchone()
+        if count > self.max_disk_entries:
+            cur = self._db.execute(
+                'DELETE FROM routes WHERE key IN (SELECT key FROM routes ORDER BY accessed_at LIMIT ?)',
+                (count - self.max_disk_entries,),
+            )
+            evicted += max(cur.rowcount, 0)
+        self._counters['evictions'] += evicted
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM routes')
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters, memory_entries=len(self._memory))
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+
+@REGISTRY.register_collector
+def route_cache_metrics():
+    cache = RouteCache._instance
+    if cache is None:
+        return
+    stats = cache.stats()
+    yield ('fuel_route_cache_lookups_total', 'counter', 'Route cache lookups by result and tier.', [
+        ({'result': 'hit', 'tier': 'memory'}, stats['memory_hits']),
+        ({'result': 'hit', 'tier': 'disk'}, stats['disk_hits']),
+        ({'result': 'miss', 'tier': 'none'}, stats['misses']),
+    ])
+    yield ('fuel_route_cache_evictions_total', 'counter', 'Route cache evictions (both tiers).', [({}, stats['evictions'])])
+    yield ('fuel_route_cache_memory_entries', 'gauge', 'Routes in the memory tier.', [({}, stats['memory_entries'])])
+
+def parse_osrm_route(data):
+    """
+    OSRM /route response (GeoJSON or polyline6 geometry) -> route dict:
+    {'distance_miles', 'path': [(lat, lon), ...], 'geojson'}, plus
+    'highways' (highways.route_highways) when the response has steps.
+    """
+    if data['code'] != 'Ok':
+        raise Exception(f"OSRM Error: {data['code']}")
+
+    route = data['routes'][0]
+    distance_meters = route['distance']
+    distance_miles = distance_meters * 0.000621371
+
+    highways = route_highways(route.get('legs', []), distance_miles)
+    geometry = route['geometry'] # GeoJSON {type: LineString, coordinates: [[lon, lat], ...]}
+    if isinstance(geometry, str):
+        # geometries=polyline6, as OSRMBackend asks for (recorded fixtures
+        # may have either)
+        return route_from_polyline(geometry, distance_miles, highways)
+    coordinates = geometry['coordinates'] # List of [lon, lat]
+
+    # Convert [lon, lat] to [lat, lon] for internal use if needed,
+    # but standard GeoJSON is lon, lat.
+    # Let's keep consistent: internal logic usually lat, lon.
+    path_points = [(p[1], p[0]) for p in coordinates]
+
+    parsed = {
+        'distance_miles': distance_miles,
+        'path': path_points, # list of (lat, lon)
+        'geojson': geometry
+    }
+    if highways:
+        parsed['highways'] = highways
+    return parsed
+
+
+class RoutingBackend:
+    """
+    Source of route geometry. Subclasses implement fetch_route(start, end)
+    with (lat, lon) tuples and return the route dict described in
+    parse_osrm_route. Results of cacheable backends go through RouteCache.
+    """
+    name = None
+    cacheable = False
+
+    def key_options(self):
+        """What else identifies this backend's routes (lane keys), beyond its name."""
+        return {}
+
+    def fetch_route(self, start_coords, end_coords):
+        raise NotImplementedError
+
+    async def afetch_route(self, start_coords, end_coords):
+        """Async fetch_route; by default fetch_route in a worker thread."""
+        return await sync_to_async(self.fetch_route, thread_sensitive=False)(start_coords, end_coords)
+
+
+class OSRMBackend(RoutingBackend):
+    """OSRM HTTP API (the public demo server unless OSRM_BASE_URL is set)."""
+    name = 'osrm'
+    cacheable = True
+    DEFAULT_BASE_URL = "http://router.project-osrm.org/route/v1/driving"
+
+    # Shared per process: one keep-alive pool and one breaker for the router
+    _session = None
+    _breaker = None
+    _shared_lock = threading.Lock()
+    # Async clients, one per event loop (their connections belong to it)
+    _async_clients = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def get_session(cls):
+        if cls._session is None:
+            with cls._shared_lock:
+                if cls._session is None:
+                    options = route_service_options()
+                    session = requests.Session()
+                    # Retries are done in _request so they can back off with jitter
+                    adapter = HTTPAdapter(pool_connections=options['POOL_CONNECTIONS'],
+                                          pool_maxsize=options['POOL_MAXSIZE'], max_retries=0)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    cls._session = session
+        return cls._session
+
+    @classmethod
+    def get_breaker(cls):
+        if cls._breaker is None:
+            with cls._shared_lock:
+                if cls._breaker is None:
+                    options = route_service_options()
+                    cls._breaker = CircuitBreaker(options['BREAKER_FAILURE_THRESHOLD'], options['BREAKER_RESET_SECONDS'])
+        return cls._breaker
+
+    @classmethod
+    def get_async_client(cls):
+        loop = asyncio.get_running_loop()
+        client = cls._async_clients.get(loop)
+        if client is None:
+            options = route_service_options()
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=options['ASYNC_MAX_CONNECTIONS'],
+                                    max_keepalive_connections=options['POOL_MAXSIZE']),
+                timeout=httpx.Timeout(options['READ_TIMEOUT'], connect=options['CONNECT_TIMEOUT']),
+            )
+            cls._async_clients[loop] = client
+        return client
+
+    def __init__(self, base_url=None, options=None):
+        self.options = options or route_service_options()
+        self.base_url = (base_url or self.options.get('OSRM_BASE_URL') or self.DEFAULT_BASE_URL).rstrip('/')
+
+    def key_options(self):
+        # Another router (profile, map build) answers differently
+        return {'base_url': self.base_url}
+
+    def _url(self, start_coords, end_coords):
         # OSRM expects: lon,lat;lon,lat
         loc_str = f"{start_coords[1]},{start_coords[0]};{end_coords[1]},{end_coords[0]}"
-        url = f"{self.BASE_URL}/{loc_str}?overview=full&geometries=geojson"
-        
+        # polyline6 rather than GeoJSON: ~4.5x fewer bytes for the overview
+        # and for the per-step geometries steps=true adds
+        url = f"{self.base_url}/{loc_str}?overview=full&geometries=polyline6"
+        if highway_matching_options()['ENABLED']:
+            # Steps are only wanted for their highway refs (highways.py)
+            url += "&steps=true"
+        return url
+
+    def _backoff(self, attempt):
+        # Full jitter on an exponential, capped delay
+        return random.uniform(0, min(self.options['BACKOFF_MAX_SECONDS'], self.options['BACKOFF_SECONDS'] * 2 ** attempt))
+
+    def fetch_route(self, start_coords, end_coords):
+        url = self._url(start_coords, end_coords)
         try:
-            response = requests.get(url)
+            response = self._request(url)
             response.raise_for_status()
-            data = response.json()
-            
-            if data['code'] != 'Ok':
-                raise Exception(f"OSRM Error: {data['code']}")
-            
-            route = data['routes'][0]
-            distance_meters = route['distance']
-            distance_miles = distance_meters * 0.000621371
-            
-            geometry = route['geometry'] # GeoJSON {type: LineString, coordinates: [[lon, lat], ...]}
-            coordinates = geometry['coordinates'] # List of [lon, lat]
-            
-            # Convert [lon, lat] to [lat, lon] for internal use if needed, 
-            # but standard GeoJSON is lon, lat. 
-            # Let's keep consistent: internal logic usually lat, lon.
-            path_points = [(p[1], p[0]) for p in coordinates]
-            
-            return {
-                'distance_miles': distance_miles,
-                'path': path_points, # list of (lat, lon)
-                'geojson': geometry
-            }
-            
+            return parse_osrm_route(response.json())
         except requests.exceptions.RequestException as e:
             raise Exception(f"Routing API Error: {str(e)}")
+
+    def _request(self, url):
+        """
+        GET through the pooled session with timeouts, retries and the circuit
+        breaker. Client errors (4xx other than 429) are returned as-is: the
+        router is up and retrying won't change the answer.
+        """
+        breaker = self.get_breaker()
+        if not breaker.allow():
+            raise Exception("Routing API Error: router unavailable (circuit open), try again later")
+
+        session = self.get_session()
+        timeout = (self.options['CONNECT_TIMEOUT'], self.options['READ_TIMEOUT'])
+        retries = self.options['RETRIES']
+
+        try:
+            for attempt in range(retries + 1):
+                try:
+                    response = session.get(url, timeout=timeout)
+                    if response.status_code not in RETRY_STATUS_CODES:
+                        breaker.record_success()
+                        return response
+                    error = requests.exceptions.HTTPError(f"{response.status_code} from router", response=response)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    error = e
+
+                if attempt < retries:
+                    logger.warning("Routing request failed (%s), retry %d/%d", error, attempt + 1, retries)
+                    time.sleep(self._backoff(attempt))
+        except Exception:
+            # Any other error from the router (a broken body) still counts
+            breaker.record_failure()
+            raise
+        except BaseException:
+            # An interrupt says nothing about the router, but must not leave
+            # a half-open trial in flight: the breaker would never close
+            breaker.release_trial()
+            raise
+
+        breaker.record_failure()
+        raise error
+
+    async def afetch_route(self, start_coords, end_coords):
+        """
+        fetch_route on the shared httpx.AsyncClient: waiting on the router
+        holds no thread, and cancelling the caller aborts the request.
+        """
+        if httpx is None:
+            return await super().afetch_route(start_coords, end_coords)
+
+        url = self._url(start_coords, end_coords)
+        try:
+            response = await self._arequest(url)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            raise Exception(f"Routing API Error: {str(e)}")
+        # Decoding a full-overview route is a few ms of CPU; keep it off the loop
+        return await sync_to_async(lambda: parse_osrm_route(response.json()), thread_sensitive=False)()
+
+    async def _arequest(self, url):
+        # _request for the async client: same retries, backoff and breaker
+        breaker = self.get_breaker()
+        if not breaker.allow():
+            raise Exception("Routing API Error: router unavailable (circuit open), try again later")
+
+        client = self.get_async_client()
+        retries = self.options['RETRIES']
+
+        try:
+            for attempt in range(retries + 1):
+                try:
+                    response = await client.get(url)
+                    if response.status_code not in RETRY_STATUS_CODES:
+                        breaker.record_success()
+                        return response
+                    error = httpx.HTTPStatusError(f"{response.status_code} from router",
+                                                  request=response.request, response=response)
+                except httpx.TransportError as e:
+                    error = e
+
+                if attempt < retries:
+                    logger.warning("Routing request failed (%s), retry %d/%d", error, attempt + 1, retries)
+                    await asyncio.sleep(self._backoff(attempt))
+        except Exception:
+            breaker.record_failure()
+            raise
+        except BaseException:
+            # CancelledError when the client goes away: not a router failure,
+            # but a half-open trial must not be left in flight (as in _request)
+            breaker.release_trial()
+            raise
+
+        breaker.record_failure()
+        raise error
+
+
+class ReplayBackend(RoutingBackend):
+    """
+    Serves routes recorded on disk, one JSON file per start/end pair (see
+    fixture_name). A fixture is either {"distance_miles", "polyline6",
+    "highways"} as written by save(), or a raw OSRM /route response.
+    """
+    name = 'replay'
+
+    def __init__(self, fixtures_dir=None, options=None):
+        options = options or route_service_options()
+        self.fixtures_dir = str(fixtures_dir or options['REPLAY_DIR'])
+
+    @staticmethod
+    def fixture_name(start_coords, end_coords):
+        return f"{start_coords[0]:.4f}_{start_coords[1]:.4f}__{end_coords[0]:.4f}_{end_coords[1]:.4f}.json"
+
+    def fetch_route(self, start_coords, end_coords):
+        path = os.path.join(self.fixtures_dir, self.fixture_name(start_coords, end_coords))
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            raise Exception(f"Routing API Error: no recorded route {os.path.basename(path)}")
+
+        if 'routes' in data:
+            return parse_osrm_route(data)
+        return route_from_polyline(data['polyline6'], data['distance_miles'], data.get('highways'))
+
+    def save(self, start_coords, end_coords, route):
+        os.makedirs(self.fixtures_dir, exist_ok=True)
+        path = os.path.join(self.fixtures_dir, self.fixture_name(start_coords, end_coords))
+        with open(path, 'w') as f:
+            json.dump({
+                'start': list(start_coords),
+                'end': list(end_coords),
+                'distance_miles': route['distance_miles'],
+                'polyline6': polyline.encode(route['path'], 6),
+                'highways': route.get('highways'),
+            }, f)
+        return path
+
+
+class SyntheticBackend(RoutingBackend):
+    """
+    Deterministic routes with no network: the great circle between the two
+    points, densified to one vertex every step_miles. distance_miles is the
+    great-circle length times detour_factor (roads are rarely straight).
+    """
+    name = 'synthetic'
+
+    def __init__(self, step_miles=None, detour_factor=None, options=None):
+        options = options or route_service_options()
+        self.step_miles = step_miles or options['SYNTHETIC_STEP_MILES']
+        self.detour_factor = detour_factor or options['SYNTHETIC_DETOUR_FACTOR']
+
+    def fetch_route(self, start_coords, end_coords):
+        a, b = to_unit_vectors([start_coords[0], end_coords[0]], [start_coords[1], end_coords[1]])
+        omega = np.arccos(np.clip(np.dot(a, b), -1.0, 1.0))
+        miles = omega * EARTH_RADIUS_MILES
+        n = max(2, int(np.ceil(miles / self.step_miles)) + 1)
+
+        # Spherical linear interpolation between the endpoints
+        t = np.linspace(0.0, 1.0, n)[:, None]
+        if omega > 1e-12:
+            xyz = (np.sin((1 - t) * omega) * a + np.sin(t * omega) * b) / np.sin(omega)
+        else:
+            xyz = np.repeat(a[None, :], n, axis=0)
+        lats = np.degrees(np.arcsin(np.clip(xyz[:, 2], -1.0, 1.0)))
+        lons = np.degrees(np.arctan2(xyz[:, 1], xyz[:, 0]))
+        lats[0], lons[0] = start_coords
+        lats[-1], lons[-1] = end_coords
+
+        path_points = list(zip(lats.tolist(), lons.tolist()))
+        return {
+            'distance_miles': float(miles * self.detour_factor),
+            'path': path_points,
+            'geojson': {'type': 'LineString', 'coordinates': [[lon, lat] for lat, lon in path_points]},
+        }
+
+
+ROUTING_BACKENDS = {
+    'osrm': OSRMBackend,
+    'replay': ReplayBackend,
+    'synthetic': SyntheticBackend,
+}
+
+
+def get_backend(name=None, options=None):
+    """Backend by short name or dotted class path (defaults to ROUTE_SERVICE['BACKEND'])."""
+    options = options or route_service_options()
+    name = name or options['BACKEND']
+    backend_cls = ROUTING_BACKENDS.get(name) or import_string(name)
+    return backend_cls(options=options)
+
+
+# Route lookups in flight in this process, shared by every RouteService
+_route_flight = SingleFlight('route')
+
+
+class RouteService:
+    # Anything that changes the routing answer belongs in the cache key
+    ROUTE_OPTIONS = {'profile': 'driving', 'overview': 'full'}
+
+    def __init__(self, cache=None, backend=None):
+        self.options = route_service_options()
+        self.backend = backend or get_backend(options=self.options)
+        if cache is None and self.backend.cacheable:
+            options = dict(ROUTE_CACHE_DEFAULTS, **getattr(settings, 'ROUTE_CACHE', {}))
+            cache = RouteCache.get_instance() if options['ENABLED'] else None
+        self.cache = cache
+        # Optionally record every fetched route as a replay fixture
+        self.recorder = ReplayBackend(self.options['RECORD_DIR']) if self.options.get('RECORD_DIR') else None
+
+    def lane_key(self, start_coords, end_coords):
+        """Identifies the route this service returns for a lane (cache and coalescing key)."""
+        precision = self.cache.precision if self.cache is not None else ROUTE_CACHE_DEFAULTS['COORD_PRECISION']
+        options = dict(self.ROUTE_OPTIONS, steps=highway_matching_options()['ENABLED'], backend=self.backend.name,
+                       **self.backend.key_options())
+        return route_key(start_coords, end_coords, options, precision)
+
+    def get_route(self, start_coords, end_coords):
+        """
+        start_coords: (lat, lon)
+        end_coords: (lat, lon)
+        Concurrent requests for the same lane share one lookup/fetch.
+        """
+        key = self.lane_key(start_coords, end_coords)
+        return _route_flight.do(key, self._get_route, key, start_coords, end_coords)
+
+    def _get_route(self, key, start_coords, end_coords):
+        if self.cache is None:
+            return self._fetch_route(start_coords, end_coords)
+
+        route = self.cache.get(key)
+        if route is None:
+            route = self._fetch_route(start_coords, end_coords)
+            self.cache.set(key, route)
+        else:
+            logger.debug("Route cache hit for %s", key)
+        return route
+
+    async def aget_route(self, start_coords, end_coords):
+        """
+        get_route for async views. Cache lookups run in a thread, the fetch
+        uses the backend's afetch_route. Coalesces with get_route callers;
+        if every caller waiting on a fetch is cancelled, the fetch is too.
+        """
+        key = self.lane_key(start_coords, end_coords)
+        return await _route_flight.arun(key, self._aget_route, key, start_coords, end_coords)
+
+    async def _aget_route(self, key, start_coords, end_coords):
+        if self.cache is not None:
+            route = await sync_to_async(self.cache.get, thread_sensitive=False)(key)
+            if route is not None:
+                logger.debug("Route cache hit for %s", key)
+                return route
+
+        route = await self.backend.afetch_route(start_coords, end_coords)
+        if self.recorder is not None:
+            await sync_to_async(self.recorder.save, thread_sensitive=False)(start_coords, end_coords, route)
+        if self.cache is not None:
+            await sync_to_async(self.cache.set, thread_sensitive=False)(key, route)
+        return route
+
+    def _fetch_route(self, start_coords, end_coords):
+        route = self.backend.fetch_route(start_coords, end_coords)
+        if self.recorder is not None:
+            self.recorder.save(start_coords, end_coords, route)
+        return route
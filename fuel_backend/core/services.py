@@ -0,0 +1,262 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+
+from .geo import encode_polyline, simplify_path
+from .data_manager import FuelStationManager
+from .optimizer import RouteOptimizer, VehicleProfile
+from .singleflight import SingleFlight
+from .streaming import STREAM_FORMATS
+
+logger = logging.getLogger(__name__)
+
+BATCH_ROUTES_DEFAULTS = {
+    # Max pairs accepted in one batch request
+    'MAX_ITEMS': 500,
+    # Concurrent routing calls per batch request
+    'ROUTE_CONCURRENCY': 8,
+    # Optimizer processes shared by all batch requests in this worker.
+    # 0 runs the optimizer in the routing threads instead.
+    'OPTIMIZE_WORKERS': min(4, os.cpu_count() or 1),
+}
+
+
+def batch_options():
+    return dict(BATCH_ROUTES_DEFAULTS, **getattr(settings, 'BATCH_ROUTES', {}))
+
+
+ASYNC_ROUTES_DEFAULTS = {
+    # Threads for CPU work (optimizer, response building) of the async route
+    # endpoint, per worker. Requests waiting on the router hold none.
+    'OPTIMIZE_THREADS': min(4, os.cpu_count() or 1),
+}
+
+
+def async_options():
+    return dict(ASYNC_ROUTES_DEFAULTS, **getattr(settings, 'ASYNC_ROUTES', {}))
+
+
+GEOMETRY_FORMATS = ('geojson', 'polyline', 'polyline6')
+
+# Vehicle profiles accepted in one route request
+MAX_VEHICLES = 20
+
+
+def geometry_options(data):
+    """
+    (geometry_format, simplify_tolerance) from a request body.
+    Raises ValueError with a client-facing message on bad values.
+    """
+    geometry_format = data.get('geometry_format', 'geojson')
+    if geometry_format not in GEOMETRY_FORMATS:
+        raise ValueError(f"Unknown geometry_format: {geometry_format}")
+
+    tolerance = data.get('simplify_tolerance')
+    if tolerance is not None:
+        try:
+            tolerance = float(tolerance)
+        except (TypeError, ValueError):
+            tolerance = -1
+        if not tolerance >= 0:
+            raise ValueError("simplify_tolerance must be a number of miles >= 0")
+    return geometry_format, tolerance
+
+
+def route_options(data):
+    """
+    Validated options of a route request body (RouteView / route_async):
+    start, finish, mode, return_map, geometry_format, simplify_tolerance,
+    stream and vehicles (VehicleProfiles, or None for the default vehicle).
+    Raises ValueError with a client-facing message on bad values.
+    """
+    options = {
+        'start': data.get('start'),
+        'finish': data.get('finish'),
+        'mode': data.get('optimizer_mode', getattr(settings, 'FUEL_OPTIMIZER_MODE', 'greedy')),
+        'return_map': data.get('return_map', True),
+        'stream': data.get('stream'),
+    }
+    if not options['start'] or not options['finish']:
+        raise ValueError("Missing start or finish location.")
+    if not isinstance(options['start'], str) or not isinstance(options['finish'], str):
+        raise ValueError("start and finish must be strings.")
+    if options['mode'] not in RouteOptimizer.MODES:
+        raise ValueError(f"Unknown optimizer_mode: {options['mode']}")
+    options['geometry_format'], options['simplify_tolerance'] = geometry_options(data)
+    # STREAM_FORMATS is a dict: check the type before looking a value up
+    stream = options['stream']
+    if stream is not None and (not isinstance(stream, str) or stream not in STREAM_FORMATS):
+        raise ValueError(f"Unknown stream format: {options['stream']}")
+
+    vehicles = data.get('vehicles')
+    if vehicles is not None:
+        if not isinstance(vehicles, list) or not vehicles:
+            raise ValueError("vehicles must be a non-empty list.")
+        if len(vehicles) > MAX_VEHICLES:
+            raise ValueError(f"Too many vehicles ({len(vehicles)}), max is {MAX_VEHICLES}.")
+        if options['stream']:
+            raise ValueError("stream is not supported with vehicles.")
+        vehicles = [VehicleProfile.from_data(vehicle) for vehicle in vehicles]
+    options['vehicles'] = vehicles
+    return options
+
+
+def route_geometry(route_data, geometry_format='geojson', simplify_tolerance=None):
+    """
+    Map geometry for a response: a GeoJSON LineString, or an encoded polyline
+    string (precision 5 or 6). simplify_tolerance (miles) runs Douglas-Peucker
+    on the path first; the OSRM GeoJSON is passed through untouched when
+    neither option applies.
+    """
+    if geometry_format == 'geojson' and not simplify_tolerance:
+        return route_data['geojson']
+
+    points = np.asarray(route_data['path'], dtype=np.float64).reshape(-1, 2)
+    if simplify_tolerance:
+        points = simplify_path(points, simplify_tolerance)
+
+    if geometry_format == 'polyline':
+        return encode_polyline(points, 5)
+    if geometry_format == 'polyline6':
+        return encode_polyline(points, 6)
+    return {'type': 'LineString', 'coordinates': points[:, ::-1].tolist()}
+
+
+def optimize_route(route_data, mode='greedy', vehicles=None):
+    """
+    Run RouteOptimizer on a route. Module-level so it can be shipped to the
+    optimizer process pool; only 'path', 'distance_miles' and 'highways' are
+    needed.
+    With vehicles, every profile is planned on the same route and corridor:
+    {"vehicles": [per-vehicle result, ...]}.
+    """
+    optimizer = RouteOptimizer(route_data)
+    if vehicles:
+        return {"vehicles": optimizer.optimize_vehicles(vehicles, mode=mode)}
+    return optimizer.optimize(mode=mode)
+
+
+# Optimizations in flight in this process (see optimize_lane)
+_optimize_flight = SingleFlight('optimize')
+
+
+def optimize_lane(lane_key, route_data, mode='greedy', pool=None, vehicles=None):
+    """
+    optimize_route for a lane (RouteService.lane_key), shared by concurrent
+    identical requests: the mode, vehicles and the current price version
+    are part of the key, so callers only ever share a plan they would have
+    computed themselves. With a pool the work runs in the optimizer processes.
+    """
+    key = _plan_key(lane_key, mode, vehicles)
+    if pool is None:
+        return _optimize_flight.do(key, optimize_route, route_data, mode, vehicles)
+    job = {'path': route_data['path'], 'distance_miles': route_data['distance_miles'],
+           'highways': route_data.get('highways')}
+    return _optimize_flight.do(key, lambda: pool.submit(optimize_route, job, mode, vehicles).result())
+
+
+async def aoptimize_lane(lane_key, route_data, mode='greedy', vehicles=None):
+    """optimize_lane for async views: runs on the bounded get_async_executor()."""
+    key = _plan_key(lane_key, mode, vehicles)
+    return await _optimize_flight.ado(key, optimize_route, route_data, mode, vehicles, executor=get_async_executor())
+
+
+def _plan_key(lane_key, mode, vehicles=None):
+    manager = FuelStationManager.get_instance()
+    manager.poll_prices()
+    vehicles = tuple(tuple(v.as_dict().items()) for v in vehicles) if vehicles else None
+    return (lane_key, mode, vehicles, manager.price_snapshot.version)
+
+
+def route_response(start_query, finish_query, route_data, result, return_map=True,
+                   geometry_format='geojson', simplify_tolerance=None):
+    # Response body shared by the single and batch endpoints
+    response_data = {
+        "route": {
+            "start": start_query,
+            "finish": finish_query,
+            "distance_miles": round(route_data['distance_miles'], 2),
+        },
+    }
+
+    if 'vehicles' in result:
+        # One plan per requested vehicle instead of the default one
+        response_data["vehicles"] = [_vehicle_response(r) for r in result['vehicles']]
+    else:
+        response_data["fuel_stops"] = result.get('stops', [])
+        response_data["total_fuel_cost"] = result.get('total_cost', 0)
+        if 'savings_vs_greedy' in result:
+            response_data["greedy_total_cost"] = result['greedy_total_cost']
+            response_data["savings_vs_greedy"] = result['savings_vs_greedy']
+
+    if return_map:
+        response_data["route"]["map_geometry"] = route_geometry(route_data, geometry_format, simplify_tolerance)
+        response_data["route"]["geometry_format"] = geometry_format
+
+    return response_data
+
+
+def _vehicle_response(result):
+    # One entry of "vehicles": the profile and its plan, or why there is none
+    data = {"vehicle": result['vehicle']}
+    if 'error' in result:
+        data["error"] = result['error']
+        return data
+    data["fuel_stops"] = result['stops']
+    data["total_fuel_cost"] = result['total_cost']
+    if 'savings_vs_greedy' in result:
+        data["greedy_total_cost"] = result['greedy_total_cost']
+        data["savings_vs_greedy"] = result['savings_vs_greedy']
+    return data
+
+
+def _init_optimizer_worker():
+    # Workers are spawned (forking a threaded web worker is unsafe), so each
+    # one sets up Django and loads the station data once at start.
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    from .data_manager import FuelStationManager
+    FuelStationManager.get_instance()
+
+
+_optimizer_pool = None
+_optimizer_pool_lock = threading.Lock()
+
+
+def get_optimizer_pool():
+    """Process pool for optimizer work, or None when OPTIMIZE_WORKERS is 0."""
+    global _optimizer_pool
+    workers = batch_options()['OPTIMIZE_WORKERS']
+    if not workers:
+        return None
+    if _optimizer_pool is None:
+        with _optimizer_pool_lock:
+            if _optimizer_pool is None:
+                _optimizer_pool = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_optimizer_worker,
+                )
+    return _optimizer_pool
+
+
+_async_executor = None
+_async_executor_lock = threading.Lock()
+
+
+def get_async_executor():
+    """Bounded thread pool for the CPU-bound part of async requests."""
+    global _async_executor
+    if _async_executor is None:
+        with _async_executor_lock:
+            if _async_executor is None:
+                _async_executor = ThreadPoolExecutor(max_workers=async_options()['OPTIMIZE_THREADS'],
+                                                     thread_name_prefix='optimize')
+    return _async_executor
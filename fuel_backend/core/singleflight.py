@@ -0,0 +1,149 @@
+import asyncio
+import contextvars
+import logging
+import threading
+from concurrent.futures import Future
+
+from .metrics import SINGLE_FLIGHT_CALLS
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    __slots__ = ('future', 'waiters', 'task')
+
+    def __init__(self):
+        self.future = Future()
+        # Marked running: a follower giving up can't cancel it for the others
+        self.future.set_running_or_notify_cancel()
+        self.waiters = 0
+        self.task = None  # asyncio task running it (arun)
+
+
+class SingleFlight:
+    """
+    Collapse concurrent identical calls into one.
+
+    The first caller for a key runs the function; callers arriving with the
+    same key while it is still running wait for that result (or exception)
+    instead of repeating the work. Nothing is kept once the call finishes,
+    so this is not a cache: it only absorbs bursts, e.g. a dispatch shift
+    asking for the same lane from many clients at once.
+
+    do() blocks the calling thread (WSGI workers, sync views under ASGI);
+    ado() awaits a function run in a thread, arun() a coroutine, without
+    blocking the event loop. All three share the same in-flight calls, so
+    sync and async callers coalesce with each other. Callers must treat
+    shared results as read-only.
+    """
+
+    def __init__(self, stage):
+        self.stage = stage  # metrics label
+        self._calls = {}  # key -> _Call
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        # (call, leader?) for key, counted as one more waiter
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                SINGLE_FLIGHT_CALLS.inc(stage=self.stage, result='executed')
+            else:
+                SINGLE_FLIGHT_CALLS.inc(stage=self.stage, result='coalesced')
+                logger.debug("Coalesced %s call for %s", self.stage, key)
+            call.waiters += 1
+            return call, leader
+
+    def _leave(self, key, call, cancelled=False):
+        # A waiter is done. If the last waiter of a cancellable call gave up,
+        # cancel the call and forget it so the next caller starts afresh.
+        with self._lock:
+            call.waiters -= 1
+            if not (cancelled and call.waiters == 0 and call.task is not None and not call.task.done()):
+                return
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.task.cancel()
+
+    def _finish(self, key, call, result=None, error=None):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        if not call.future.done():
+            if error is not None:
+                call.future.set_exception(error)
+            else:
+                call.future.set_result(result)
+
+    def _run(self, key, call, fn, args, kwargs):
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, call, error=e)
+        else:
+            self._finish(key, call, result)
+
+    def do(self, key, fn, *args, **kwargs):
+        call, leader = self._join(key)
+        try:
+            if leader:
+                self._run(key, call, fn, args, kwargs)
+            return call.future.result()
+        finally:
+            self._leave(key, call)
+
+    async def ado(self, key, fn, *args, executor=None, **kwargs):
+        """
+        Async do(): fn still runs in a thread (executor, default: the loop's).
+        A cancelled caller stops waiting; a thread can't be interrupted, so
+        the call runs to completion either way.
+        """
+        call, leader = self._join(key)
+        if leader:
+            # Carry the leader's contextvars (request spans) into the thread
+            context = contextvars.copy_context()
+            asyncio.get_running_loop().run_in_executor(executor, context.run, self._run, key, call, fn, args, kwargs)
+        return await self._wait(key, call)
+
+    async def arun(self, key, coro_fn, *args, **kwargs):
+        """
+        Async do() for a coroutine function, run as a task on this loop.
+        Once every waiter has been cancelled (clients gone), the task is
+        cancelled too, e.g. stopping the upstream HTTP request.
+        """
+        call, leader = self._join(key)
+        if leader:
+            call.task = asyncio.ensure_future(coro_fn(*args, **kwargs))
+            call.task.add_done_callback(lambda task: self._task_done(key, call, task))
+        return await self._wait(key, call)
+
+    def _task_done(self, key, call, task):
+        if task.cancelled():
+            self._finish(key, call, error=asyncio.CancelledError())
+        elif task.exception() is not None:
+            self._finish(key, call, error=task.exception())
+        else:
+            self._finish(key, call, task.result())
+
+    async def _wait(self, key, call):
+        waiter = asyncio.wrap_future(call.future)
+        try:
+            result = await asyncio.shield(waiter)
+        except asyncio.CancelledError:
+            # This caller was cancelled (unless the shared call itself was).
+            # Nobody awaits its waiter any more; retrieve the outcome so
+            # asyncio doesn't log it as never retrieved.
+            waiter.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._leave(key, call, cancelled=not call.future.done())
+            raise
+        except BaseException:
+            self._leave(key, call)
+            raise
+        self._leave(key, call)
+        return result
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,244 @@
+"""
+Versioned binary snapshot of the station and city datasets.
+
+`python manage.py build_snapshot` parses the CSVs once and writes every
+column FuelStationManager and CityGeocoder need as a plain .npy file. Workers
+np.load() them with mmap_mode='r', so startup skips CSV parsing and merging,
+and all workers on a host share the same page-cache pages.
+
+Layout (DATA_SNAPSHOT_DIR):
+
+    CURRENT                       name of the active version directory
+    <version>/manifest.json       format, version, source file stats, arrays
+    <version>/<group>.<name>.npy  one array per column (string columns as
+                                  <name>.codes + <name>.blob, see
+                                  store.StringColumn)
+
+Versions are never modified in place; a rebuild writes a new directory and
+then swaps CURRENT, so running workers keep their mappings valid.
+"""
+import datetime
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+import numpy as np
+from django.conf import settings
+
+from .store import pack_columns, unpack_columns
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 4
+
+FUEL_CSV = 'fuel-prices-for-be-assessment.csv'
+CITIES_CSV = 'us_cities.csv'
+
+
+def source_paths():
+    base_dir = settings.BASE_DIR
+    return [os.path.join(base_dir, FUEL_CSV), os.path.join(base_dir, CITIES_CSV)]
+
+
+def snapshot_dir():
+    path = getattr(settings, 'DATA_SNAPSHOT_DIR', None)
+    return str(path) if path else None
+
+
+def _source_stats(paths, with_hash=False):
+    stats = {}
+    for path in paths:
+        st = os.stat(path)
+        entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        if with_hash:
+            with open(path, 'rb') as f:
+                entry['sha1'] = hashlib.sha1(f.read()).hexdigest()
+        stats[os.path.basename(path)] = entry
+    return stats
+
+
+class Snapshot:
+    def __init__(self, path, manifest):
+        self.path = path
+        self.manifest = manifest
+        self.version = manifest['version']
+        self._arrays = {}
+
+    def array(self, group, name):
+        key = f"{group}.{name}"
+        if key not in self._arrays:
+            self._arrays[key] = np.load(os.path.join(self.path, f"{key}.npy"), mmap_mode='r')
+        return self._arrays[key]
+
+    def group(self, group):
+        return unpack_columns({name: self.array(group, name) for name in self.manifest['arrays'][group]})
+
+
+def load_snapshot(directory=None):
+    """
+    The current snapshot, or None if there is none, it was written by another
+    format version, or the source CSVs changed since it was built.
+    """
+    directory = directory or snapshot_dir()
+    if not directory:
+        return None
+    try:
+        with open(os.path.join(directory, 'CURRENT')) as f:
+            version_dir = os.path.join(directory, f.read().strip())
+        with open(os.path.join(version_dir, 'manifest.json')) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+
+    if manifest.get('format') != SNAPSHOT_FORMAT:
+        logger.warning("Ignoring data snapshot %s: format %s, expected %s",
+                       version_dir, manifest.get('format'), SNAPSHOT_FORMAT)
+        return None
+
+    current = _source_stats(source_paths())
+    recorded = {name: {k: v for k, v in entry.items() if k != 'sha1'} for name, entry in manifest['sources'].items()}
+    if current != recorded:
+        logger.warning("Ignoring stale data snapshot %s: source CSVs changed, rebuild with build_snapshot", version_dir)
+        return None
+
+    return Snapshot(version_dir, manifest)
+
+
+def source_fingerprint():
+    """
+    Short id of the source CSVs as they are on disk now (size and mtime),
+    naming the dataset when it is parsed from CSV rather than a snapshot.
+    """
+    stats = _source_stats(source_paths())
+    return hashlib.sha1(json.dumps(stats, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def write_snapshot(groups, directory=None):
+    """
+    groups: {'stations': {name: array or StringColumn}, 'cities': {...}}
+    Writes a new version directory and makes it current. Returns its path.
+    """
+    directory = directory or snapshot_dir()
+    os.makedirs(directory, exist_ok=True)
+
+    sources = _source_stats(source_paths(), with_hash=True)
+    digest = hashlib.sha1(json.dumps(
+        {name: entry['sha1'] for name, entry in sources.items()}, sort_keys=True
+    ).encode()).hexdigest()[:12]
+    version = f"v{SNAPSHOT_FORMAT}-{digest}"
+
+    version_dir = os.path.join(directory, version)
+    tmp_dir = tempfile.mkdtemp(prefix=f".{version}-", dir=directory)
+    os.chmod(tmp_dir, 0o755)  # mkdtemp is owner-only; workers may run as another user
+    arrays = {}
+    for group, columns in groups.items():
+        arrays[group] = {}
+        for name, values in pack_columns(columns).items():
+            values = np.ascontiguousarray(values)
+            if values.dtype == object:
+                raise ValueError(f"{group}.{name}: object arrays can't be memory-mapped")
+            np.save(os.path.join(tmp_dir, f"{group}.{name}.npy"), values, allow_pickle=False)
+            arrays[group][name] = {'dtype': values.dtype.str, 'shape': list(values.shape)}
+
+    manifest = {
+        'format': SNAPSHOT_FORMAT,
+        'version': version,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'sources': sources,
+        'arrays': arrays,
+    }
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    if os.path.exists(version_dir):
+        # Same source content -> same arrays. Keep the existing (possibly
+        # mapped) files and only refresh the manifest's source stats.
+        os.replace(os.path.join(tmp_dir, 'manifest.json'), os.path.join(version_dir, 'manifest.json'))
+        _remove_tree(tmp_dir)
+    else:
+        os.rename(tmp_dir, version_dir)
+
+    current_tmp = os.path.join(directory, '.CURRENT.tmp')
+    with open(current_tmp, 'w') as f:
+        f.write(version)
+    os.replace(current_tmp, os.path.join(directory, 'CURRENT'))
+    return version_dir
+
+
+def _remove_tree(path):
+    for name in os.listdir(path):
+        os.remove(os.path.join(path, name))
+    os.rmdir(path)
+
+
+# Price snapshots
+#
+# Prices change daily while station geometry doesn't, so refreshed prices are
+# stored separately, per station dataset (FuelStationManager.dataset_id: the
+# snapshot version, or a fingerprint of the CSVs when loaded from them, so
+# prices refreshed for older files never override a newly shipped CSV):
+#
+#     prices/<dataset_id>/CURRENT          latest price version number
+#     prices/<dataset_id>/prices-<N>.npy   price per station, dataset order
+#
+# Writers (refresh_prices command, admin endpoint) add a new numbered file;
+# workers poll CURRENT and swap the new array in.
+
+def _prices_dir(dataset_id, directory=None):
+    directory = directory or snapshot_dir()
+    if not directory:
+        return None
+    return os.path.join(directory, 'prices', dataset_id)
+
+
+def current_price_version(dataset_id, directory=None):
+    path = _prices_dir(dataset_id, directory)
+    if path is None:
+        return None
+    try:
+        with open(os.path.join(path, 'CURRENT')) as f:
+            return int(f.read().strip())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def read_prices(dataset_id, price_version, directory=None):
+    path = _prices_dir(dataset_id, directory)
+    return np.load(os.path.join(path, f"prices-{price_version}.npy"), mmap_mode='r')
+
+
+def write_prices(dataset_id, prices, min_version=1, directory=None):
+    """
+    Store a new price array and make it current. Returns its version number,
+    the first free number >= min_version (safe against concurrent writers).
+    """
+    path = _prices_dir(dataset_id, directory)
+    if path is None:
+        return None
+    os.makedirs(path, exist_ok=True)
+
+    fd, tmp = tempfile.mkstemp(prefix='.prices-', suffix='.npy', dir=path)
+    with os.fdopen(fd, 'wb') as f:
+        np.save(f, np.ascontiguousarray(prices, dtype=np.float64), allow_pickle=False)
+    os.chmod(tmp, 0o644)
+
+    version = max(min_version, (current_price_version(dataset_id, directory) or 0) + 1)
+    while True:
+        try:
+            # link() fails if the name exists, so two writers can't both claim N
+            os.link(tmp, os.path.join(path, f"prices-{version}.npy"))
+            break
+        except FileExistsError:
+            version += 1
+    os.remove(tmp)
+
+    if (current_price_version(dataset_id, directory) or 0) > version:
+        # A concurrent writer already published something newer
+        return version
+    current_tmp = os.path.join(path, f".CURRENT.{os.getpid()}")
+    with open(current_tmp, 'w') as f:
+        f.write(str(version))
+    os.replace(current_tmp, os.path.join(path, 'CURRENT'))
+    return version
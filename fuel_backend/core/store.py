@@ -0,0 +1,73 @@
+import numpy as np
+
+
+class StringColumn:
+    """
+    Dictionary-encoded string column: one int32 code per row, indexing a
+    side table of the distinct values. Station names, addresses and cities
+    repeat a lot (7.5k rows, ~3k distinct cities), so this is a fraction of
+    the size of a fixed-width unicode array, equal strings share one Python
+    object, and a row's value is a list lookup with no decoding.
+
+    In the snapshot the table is stored as one UTF-8 blob next to the codes
+    (see to_arrays / from_arrays).
+    """
+
+    def __init__(self, codes, values):
+        self.codes = np.asarray(codes, dtype=np.int32)
+        self.values = list(values)
+
+    @classmethod
+    def from_values(cls, values):
+        uniques, codes = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+        return cls(codes, uniques.tolist())
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, idx):
+        if np.ndim(idx) == 0:
+            return self.values[self.codes[idx]]
+        return StringColumn(self.codes[idx], self.values)
+
+    def tolist(self):
+        values = self.values
+        return [values[c] for c in self.codes.tolist()]
+
+    def to_numpy(self):
+        # Object array of the shared str values (for pandas)
+        return np.array(self.values, dtype=object)[self.codes]
+
+    def to_arrays(self):
+        """{'codes', 'blob'} plain arrays for the snapshot."""
+        # NUL-terminated UTF-8, so loading is one decode and one split
+        blob = np.frombuffer(''.join(v + '\0' for v in self.values).encode('utf-8'), dtype=np.uint8)
+        return {'codes': self.codes, 'blob': blob}
+
+    @classmethod
+    def from_arrays(cls, codes, blob):
+        return cls(codes, np.asarray(blob).tobytes().decode('utf-8').split('\0')[:-1])
+
+
+def pack_columns(columns):
+    """Flatten StringColumns into '<name>.codes' / '<name>.blob' arrays."""
+    flat = {}
+    for name, column in columns.items():
+        if isinstance(column, StringColumn):
+            for part, values in column.to_arrays().items():
+                flat[f"{name}.{part}"] = values
+        else:
+            flat[name] = column
+    return flat
+
+
+def unpack_columns(flat):
+    """Inverse of pack_columns."""
+    columns = {}
+    for key, values in flat.items():
+        name, _, part = key.partition('.')
+        if not part:
+            columns[name] = values
+        elif part == 'codes':
+            columns[name] = StringColumn.from_arrays(values, flat[f"{name}.blob"])
+    return columns
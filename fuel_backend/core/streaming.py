@@ -0,0 +1,153 @@
+"""
+Streamed route responses, for clients that want the trip summary and fuel
+stops before the (large) map geometry is built and sent.
+
+    {"event": "route", "data": {"start": ..., "finish": ..., "distance_miles": ...}}
+    {"event": "fuel_stop", "data": {...}}      one per stop, as the optimizer picks it
+    {"event": "summary", "data": {"total_fuel_cost": ..., ...}}
+    {"event": "geometry", "data": {"index": 0, "coordinates": [...]}}   chunks of the map
+    {"event": "end", "data": {}}
+
+as NDJSON (one object per line) or Server-Sent Events (event:/data: frames).
+A failure after the first byte is sent as an "error" event, followed by "end".
+"""
+import json
+import logging
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+from .geo import encode_polyline, simplify_path
+from .optimizer import OptimizerError, RouteOptimizer
+
+try:
+    import orjson
+except ImportError:  # optional, as in renderers.py
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+STREAM_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'sse': 'text/event-stream',
+}
+
+# Route points per geometry event
+GEOMETRY_CHUNK_POINTS = 1000
+
+
+def route_events(start_query, finish_query, route_data, mode='greedy', return_map=True,
+                 geometry_format='geojson', simplify_tolerance=None):
+    """
+    (event, data) pairs for one route, produced lazily: the optimizer only
+    runs once the route event is on its way, and geometry chunks are built
+    one at a time, so a response never holds the whole encoded body.
+    Same fields as services.route_response.
+    """
+    route = {
+        "start": start_query,
+        "finish": finish_query,
+        "distance_miles": round(route_data['distance_miles'], 2),
+    }
+    if return_map:
+        route["geometry_format"] = geometry_format
+    yield 'route', route
+
+    try:
+        optimizer = RouteOptimizer(route_data)
+        total_fuel_cost = 0.0 if mode == 'exact' else 0
+        for stop, cost in optimizer.iter_stops(mode):
+            total_fuel_cost += cost
+            yield 'fuel_stop', stop
+
+        summary = {"total_fuel_cost": round(total_fuel_cost, 2)}
+        if mode == 'exact':
+            greedy = optimizer.optimize_greedy()
+            if 'error' not in greedy:
+                summary["greedy_total_cost"] = greedy['total_cost']
+                summary["savings_vs_greedy"] = round(greedy['total_cost'] - summary["total_fuel_cost"], 2)
+        yield 'summary', summary
+    except OptimizerError as e:
+        yield 'error', {"error": str(e)}
+        yield 'end', {}
+        return
+    except Exception as e:
+        logger.error(f"Optimization failed: {e}")
+        yield 'error', {"error": f"Optimization Error: {str(e)}"}
+        yield 'end', {}
+        return
+
+    if return_map:
+        yield from geometry_events(route_data, geometry_format, simplify_tolerance)
+    yield 'end', {}
+
+
+def geometry_events(route_data, geometry_format='geojson', simplify_tolerance=None):
+    """
+    The map geometry (see services.route_geometry) in consecutive pieces of
+    GEOMETRY_CHUNK_POINTS points. GeoJSON chunks carry "coordinates" to
+    concatenate; polyline chunks are each a complete encoded polyline, to be
+    decoded and concatenated.
+    """
+    if geometry_format == 'geojson' and not simplify_tolerance:
+        # Pass the OSRM GeoJSON through, as route_geometry does
+        coordinates = route_data['geojson']['coordinates']
+        for index, start in enumerate(range(0, len(coordinates), GEOMETRY_CHUNK_POINTS)):
+            yield 'geometry', {"index": index, "coordinates": coordinates[start:start + GEOMETRY_CHUNK_POINTS]}
+        return
+
+    points = np.asarray(route_data['path'], dtype=np.float64).reshape(-1, 2)
+    if simplify_tolerance:
+        points = simplify_path(points, simplify_tolerance)
+
+    for index, start in enumerate(range(0, len(points), GEOMETRY_CHUNK_POINTS)):
+        chunk = points[start:start + GEOMETRY_CHUNK_POINTS]
+        if geometry_format == 'geojson':
+            yield 'geometry', {"index": index, "coordinates": chunk[:, ::-1].tolist()}
+        else:
+            precision = 6 if geometry_format == 'polyline6' else 5
+            yield 'geometry', {"index": index, "polyline": encode_polyline(chunk, precision)}
+
+
+def _dumps(data):
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY)
+        except TypeError:
+            pass
+    return json.dumps(data, cls=JSONEncoder, separators=(',', ':')).encode('utf-8')
+
+
+def encode_event(event, data, stream_format='ndjson'):
+    if stream_format == 'sse':
+        return b'event: ' + event.encode('ascii') + b'\ndata: ' + _dumps(data) + b'\n\n'
+    return _dumps({"event": event, "data": data}) + b'\n'
+
+
+async def _aiter(iterator):
+    # Advance a sync generator from a worker thread one item at a time.
+    # Handing Django's ASGI handler the sync generator itself would make it
+    # read the whole thing into a list before sending the first byte.
+    step = sync_to_async(next, thread_sensitive=False)
+    done = object()
+    while True:
+        item = await step(iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+def streaming_response(events, stream_format='ndjson', asynchronous=False):
+    """
+    StreamingHttpResponse for (event, data) pairs. asynchronous=True when
+    served by the ASGI app (asgi.py), so chunks go out as they are produced.
+    """
+    chunks = (encode_event(event, data, stream_format) for event, data in events)
+    response = StreamingHttpResponse(_aiter(chunks) if asynchronous else chunks,
+                                     content_type=STREAM_FORMATS[stream_format])
+    response['Cache-Control'] = 'no-cache'
+    # Don't let nginx buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,956 @@
+import asyncio
+import copy
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import types
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import polyline
+import requests
+from scipy.optimize import linprog
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+
+from . import routing, services, streaming, views
+from .benchmarks import load_fixtures
+from .apps import serving_process
+from .corridor import RouteCorridor
+from .data_manager import CityGeocoder, FuelStationManager
+from .geo import (EARTH_RADIUS_MILES, cumulative_distance, encode_polyline, haversine_miles, resample_path,
+                  segment_distances, simplify_path)
+from .highways import highway_matching_options, parse_address, parse_ref
+from .optimizer import RouteOptimizer, VehicleProfile
+from .results import RouteResultCache
+from .routing import CircuitBreaker, OSRMBackend, ReplayBackend, RouteCache, RouteService, SyntheticBackend
+from .services import _plan_key, route_geometry, route_options
+from .singleflight import SingleFlight
+from .snapshot import SNAPSHOT_FORMAT, load_snapshot, write_prices
+from .tiles import StationTileCache
+
+OSRM_OPTIONS = {
+    'OSRM_BASE_URL': 'http://osrm.test/route/v1/driving',
+    'CONNECT_TIMEOUT': 1,
+    'READ_TIMEOUT': 1,
+    'RETRIES': 0,
+    'BACKOFF_SECONDS': 0,
+    'BACKOFF_MAX_SECONDS': 0,
+}
+
+
+def half_open_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0)
+    breaker.record_failure()
+    assert breaker.state == 'half_open'
+    return breaker
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_half_open_lets_one_trial_through(self):
+        breaker = half_open_breaker()
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_unexpected_error_releases_the_trial(self):
+        breaker = half_open_breaker()
+        session = mock.Mock()
+        session.get.side_effect = requests.exceptions.ChunkedEncodingError('connection broken')
+        backend = OSRMBackend(options=OSRM_OPTIONS)
+
+        with mock.patch.object(OSRMBackend, 'get_breaker', return_value=breaker), \
+                mock.patch.object(OSRMBackend, 'get_session', return_value=session):
+            with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+                backend._request('http://osrm.test/route')
+            # The failed trial re-opened the breaker (reset_seconds=0: half-open
+            # again right away) instead of leaving it waiting forever
+            self.assertTrue(breaker.allow())
+
+    def cancelled_arequest(self, breaker):
+        client = mock.Mock()
+        client.get = mock.AsyncMock(side_effect=asyncio.CancelledError)
+        backend = OSRMBackend(options=OSRM_OPTIONS)
+        # httpx is optional; only its TransportError is looked at here
+        fake_httpx = types.SimpleNamespace(TransportError=type('TransportError', (Exception,), {}))
+
+        with mock.patch.object(routing, 'httpx', fake_httpx), \
+                mock.patch.object(OSRMBackend, 'get_breaker', return_value=breaker), \
+                mock.patch.object(OSRMBackend, 'get_async_client', return_value=client):
+            with self.assertRaises(asyncio.CancelledError):
+                asyncio.run(backend._arequest('http://osrm.test/route'))
+
+    def test_cancellation_is_not_a_failure(self):
+        # Clients going away don't open a closed breaker...
+        breaker = CircuitBreaker(failure_threshold=5, reset_seconds=30)
+        for _ in range(5):
+            self.cancelled_arequest(breaker)
+        self.assertEqual((breaker.state, breaker.failures), ('closed', 0))
+
+        # ...nor re-open a half-open one; the trial slot is freed for the next call
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0.05)
+        breaker.record_failure()
+        time.sleep(0.05)
+        self.assertEqual(breaker.state, 'half_open')
+        self.cancelled_arequest(breaker)
+        self.assertEqual((breaker.state, breaker.failures), ('half_open', 1))
+        self.assertTrue(breaker.allow())
+
+
+class DistanceKernelTests(SimpleTestCase):
+    def test_close_to_the_geodesic(self):
+        rng = np.random.default_rng(0)
+        starts = np.column_stack([rng.uniform(25, 49, 200), rng.uniform(-124, -67, 200)])
+        # Route-geometry segments (a few hundred feet to a few miles) and
+        # coast-to-coast pairs, zipped into one path
+        path = np.vstack([starts, starts + rng.normal(0, 0.02, starts.shape)])
+        path = path.reshape(2, -1, 2).transpose(1, 0, 2).reshape(-1, 2)
+
+        expected = segment_distances(path, 'geodesic')
+        for method, tolerance in (('ellipsoidal', 1e-5), ('haversine', 5e-3)):
+            with self.subTest(method=method):
+                seg = segment_distances(path, method)
+                self.assertLess(np.max(np.abs(seg - expected) / expected), tolerance)
+                cum = cumulative_distance(path, method)
+                self.assertEqual(cum[0], 0)
+                self.assertTrue(np.allclose(np.diff(cum), seg))
+
+    def test_degenerate_paths(self):
+        for method in ('ellipsoidal', 'haversine'):
+            with self.subTest(method=method):
+                self.assertEqual(segment_distances([(35.0, -97.0)] * 3, method).tolist(), [0.0, 0.0])
+                self.assertEqual(cumulative_distance([(35.0, -97.0)], method).tolist(), [0.0])
+        with self.assertRaises(ValueError):
+            segment_distances([(35.0, -97.0), (36.0, -97.0)], 'vincenty')
+
+
+class SnapshotTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def load(self, cls, directory):
+        with override_settings(DATA_SNAPSHOT_DIR=directory):
+            instance = cls()
+            instance.load_data()
+        return instance
+
+    def test_same_data_as_the_csv(self):
+        call_command('build_snapshot', output=self.directory, stdout=io.StringIO())
+        empty = tempfile.TemporaryDirectory()
+        self.addCleanup(empty.cleanup)
+
+        from_csv = self.load(FuelStationManager, empty.name)
+        mapped = self.load(FuelStationManager, self.directory)
+        self.assertEqual(from_csv.data_version, 'csv')
+        self.assertTrue(mapped.data_version.startswith(f'v{SNAPSHOT_FORMAT}-'))
+        self.assertIsInstance(mapped.arrays['price'], np.memmap)
+        for name in ('opis_ids', 'points', 'prices', 'location_points', 'location_members', 'location_start'):
+            self.assertTrue(np.array_equal(getattr(mapped, name), getattr(from_csv, name)), name)
+        pd.testing.assert_frame_equal(mapped.df, from_csv.df)
+        self.assertEqual(mapped.station_record(123), from_csv.station_record(123))
+
+        cities_csv = self.load(CityGeocoder, empty.name)
+        cities = self.load(CityGeocoder, self.directory)
+        self.assertEqual(cities.data_version, mapped.data_version)
+        for query in ('Dallas, TX', 'saint louis, missouri', "O'Fallon, MO", 'Nowhere, ZZ'):
+            self.assertEqual(cities.geocode(query), cities_csv.geocode(query), query)
+
+    def test_stale_snapshots_are_ignored(self):
+        call_command('build_snapshot', output=self.directory, stdout=io.StringIO())
+        self.assertIsNotNone(load_snapshot(self.directory))
+        with open(os.path.join(self.directory, 'CURRENT')) as f:
+            manifest_path = os.path.join(self.directory, f.read().strip(), 'manifest.json')
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+        for change in ({'format': SNAPSHOT_FORMAT - 1},
+                       {'sources': {name: dict(entry, size=entry['size'] + 1)
+                                    for name, entry in manifest['sources'].items()}}):
+            with self.subTest(change=list(change)):
+                with open(manifest_path, 'w') as f:
+                    json.dump(dict(manifest, **change), f)
+                with self.assertLogs('fuel_backend.core.snapshot', 'WARNING'):
+                    self.assertIsNone(load_snapshot(self.directory))
+                    self.assertEqual(self.load(FuelStationManager, self.directory).data_version, 'csv')
+
+
+class PriceVersionTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(DATA_SNAPSHOT_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_prices_of_other_csv_files_are_ignored(self):
+        # No snapshot in the (empty) directory: loaded from the CSVs
+        manager = FuelStationManager()
+        manager.load_data()
+        self.assertEqual(manager.data_version, 'csv')
+        prices = np.asarray(manager.prices) + 0.5
+
+        # Same station count, refreshed for other (older) source files
+        write_prices('csv', prices, min_version=2)
+        write_prices('csv-000000000000', prices, min_version=2)
+        self.assertFalse(manager.poll_prices(force=True))
+
+        version = write_prices(manager.dataset_id, prices, min_version=2)
+        self.assertTrue(manager.poll_prices(force=True))
+        self.assertEqual(manager.price_version, version)
+
+    @override_settings(DATA_SNAPSHOT_DIR=None)
+    def test_refresh_prices_needs_a_snapshot_dir(self):
+        with self.assertRaisesMessage(CommandError, 'DATA_SNAPSHOT_DIR is not set'):
+            call_command('refresh_prices', str(settings.BASE_DIR / 'fuel-prices-for-be-assessment.csv'))
+
+
+class HighwayParsingTests(SimpleTestCase):
+    def test_address(self):
+        cases = {
+            'I-44, EXIT 283 & US-69': (['I-44', 'US-69'], '283'),
+            'I-39/US-51, EXIT 111 & SR-72': (['I-39', 'US-51', 'SR-72'], '111'),
+            'I-94, EXIT 19 & US HWY 63': (['I-94', 'US-63'], '19'),
+            'I-10, US HWY 180, EXIT 82A': (['I-10', 'US-180'], '82A'),
+            'US HIGHWAY 20': (['US-20'], None),
+            'US HWY 224 & OH 225': (['US-224', 'SR-225'], None),
+            'US-190 & LA-103': (['US-190', 'SR-103'], None),
+            'I-35W, EXIT 52B & TX-121': (['I-35', 'SR-121'], '52B'),
+            'I-25, EXIT 227 OR 225': (['I-25'], '227'),
+            'CO RD 5 & I-70': (['I-70'], None),
+        }
+        for address, expected in cases.items():
+            with self.subTest(address=address):
+                self.assertEqual(parse_address(address), expected)
+
+    def test_ref(self):
+        self.assertEqual(parse_ref('I 44;US 69'), ['I-44', 'US-69'])
+        self.assertEqual(parse_ref('US 63'), parse_address('US HWY 63')[0])
+        self.assertEqual(parse_ref('TX 114'), ['SR-114'])
+        self.assertEqual(parse_ref('OR 58'), ['SR-58'])
+
+
+@override_settings(ROUTE_SERVICE=dict(settings.ROUTE_SERVICE, BACKEND='synthetic'))
+class RouteBatchTests(SimpleTestCase):
+    def test_bad_items_are_reported_in_place(self):
+        pairs = [
+            {'start': 'Dallas, TX', 'finish': 'Tulsa, OK'},
+            {'start': 5, 'finish': 'Tulsa, OK'},
+            {'start': 'Dallas, TX', 'finish': ['Tulsa, OK']},
+            {'start': 'Dallas, TX'},
+            'Dallas, TX',
+        ]
+        response = self.client.post(reverse('route-batch'), {'pairs': pairs}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([r['status'] for r in results], ['ok', 'error', 'error', 'error', 'error'])
+        self.assertEqual(results[1]['error'], 'start and finish must be strings.')
+        self.assertEqual(results[3]['error'], 'Missing start or finish location.')
+        self.assertEqual(response.json()['errors'], 4)
+
+
+def parse_stream(response):
+    body = b''.join(response.streaming_content).decode()
+    if response['Content-Type'] == 'text/event-stream':
+        frames = [frame.split('\n') for frame in body.split('\n\n') if frame]
+        return [(event[len('event: '):], json.loads(data[len('data: '):])) for event, data in frames]
+    return [(line['event'], line['data']) for line in map(json.loads, body.splitlines())]
+
+
+@override_settings(ROUTE_SERVICE=dict(settings.ROUTE_SERVICE, BACKEND='synthetic'))
+class StreamingTests(SimpleTestCase):
+    def test_frames_match_the_plain_response(self):
+        body = {'start': 'Dallas, TX', 'finish': 'Atlanta, GA', 'optimizer_mode': 'exact'}
+        plain = self.client.post(reverse('route'), body, content_type='application/json').json()
+        self.assertGreater(len(plain['fuel_stops']), 1)
+
+        for stream in ('ndjson', 'sse'):
+            with self.subTest(stream=stream):
+                # Small chunks, so the map comes in several
+                with mock.patch.object(streaming, 'GEOMETRY_CHUNK_POINTS', 100):
+                    response = self.client.post(reverse('route'), dict(body, stream=stream),
+                                                content_type='application/json')
+                    events = parse_stream(response)
+                self.assertEqual(response.status_code, 200)
+                names = [event for event, _ in events]
+                stops = len(plain['fuel_stops'])
+                # Summary and stops first, then the map in chunks, then end
+                self.assertEqual(names[:stops + 2], ['route'] + ['fuel_stop'] * stops + ['summary'])
+                self.assertEqual(set(names[stops + 2:-1]), {'geometry'})
+                self.assertGreater(len(names[stops + 2:-1]), 1)
+                self.assertEqual(events[-1], ('end', {}))
+
+                data = dict(events)
+                self.assertEqual(data['route']['distance_miles'], plain['route']['distance_miles'])
+                self.assertEqual([d for e, d in events if e == 'fuel_stop'], plain['fuel_stops'])
+                self.assertEqual(data['summary'], {key: plain[key] for key in
+                                                   ('total_fuel_cost', 'greedy_total_cost', 'savings_vs_greedy')})
+                chunks = [d for e, d in events if e == 'geometry']
+                self.assertEqual([c['index'] for c in chunks], list(range(len(chunks))))
+                self.assertEqual([p for c in chunks for p in c['coordinates']],
+                                 plain['route']['map_geometry']['coordinates'])
+
+
+class RouteOptionsTests(SimpleTestCase):
+    def test_bad_values_are_client_errors(self):
+        bodies = [
+            {'finish': 'Tulsa, OK'},
+            {'start': 5, 'finish': 'Tulsa, OK'},
+            {'start': 'Dallas, TX', 'finish': ['Tulsa, OK']},
+            {'start': 'Dallas, TX', 'finish': 'Tulsa, OK', 'stream': ['x']},
+            {'start': 'Dallas, TX', 'finish': 'Tulsa, OK', 'stream': 'xml'},
+            {'start': 'Dallas, TX', 'finish': 'Tulsa, OK', 'optimizer_mode': ['exact']},
+            {'start': 'Dallas, TX', 'finish': 'Tulsa, OK', 'geometry_format': {}},
+        ]
+        for body in bodies:
+            with self.subTest(body=body):
+                with self.assertRaises(ValueError):
+                    route_options(body)
+                response = self.client.post(reverse('route'), body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+
+
+def location_pairs(point_idx, location_idx, dist):
+    # {(point, location): miles}, for comparing radius searches regardless of order
+    return dict(zip(zip(point_idx.tolist(), location_idx.tolist()), dist.tolist()))
+
+
+class StationIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.manager = FuelStationManager.get_instance()
+        rng = np.random.default_rng(0)
+        # South Texas to the Canadian border, plus points right at stations
+        self.points = np.vstack([
+            np.column_stack([rng.uniform(26, 49, 300), rng.uniform(-124, -67, 300)]),
+            self.manager.location_points[::200],
+        ])
+        locations = self.manager.location_points
+        self.dist = haversine_miles(self.points[:, 0, None], self.points[:, 1, None], locations[:, 0], locations[:, 1])
+
+    def test_radius_is_in_miles_at_every_latitude(self):
+        for radius in (5, 25, 60):
+            with self.subTest(radius=radius):
+                expected = dict(zip(map(tuple, np.argwhere(self.dist <= radius).tolist()),
+                                    self.dist[self.dist <= radius].tolist()))
+                found = location_pairs(*self.manager.query_locations(self.points, radius))
+                self.assertEqual(found.keys(), expected.keys())
+                self.assertTrue(np.allclose([found[k] for k in expected], list(expected.values())))
+                self.assertTrue(any(self.points[p, 0] > 45 for p, _ in expected))
+
+                # One entry per station at each of those locations
+                point_idx, station_idx, dist = self.manager.query_radius(self.points, radius)
+                self.assertEqual(len(station_idx), sum(
+                    self.manager.location_start[loc + 1] - self.manager.location_start[loc] for _, loc in expected))
+                self.assertTrue(np.allclose(dist, self.dist[point_idx, self.manager.station_location[station_idx]]))
+
+    def test_nearest(self):
+        station_idx, dist = self.manager.query_nearest(self.points, k=3)
+        station_dist = self.dist[:, self.manager.station_location]
+        expected = np.sort(station_dist, axis=1)[:, :3]
+        self.assertTrue(np.allclose(dist, expected))
+        self.assertTrue(np.allclose(np.take_along_axis(station_dist, station_idx, axis=1), expected))
+
+        # Beyond radius_miles: padded with len(df) and inf
+        station_idx, dist = self.manager.query_nearest(self.points, k=2, radius_miles=15)
+        missing = expected[:, :2] > 15
+        self.assertTrue(missing.any() and (~missing).any())
+        self.assertTrue(np.all(station_idx[missing] == len(self.manager.df)))
+        self.assertTrue(np.all(np.isinf(dist[missing])))
+        self.assertTrue(np.allclose(dist[~missing], expected[:, :2][~missing]))
+
+
+class ResampleTests(SimpleTestCase):
+    def setUp(self):
+        self.path = np.asarray(SyntheticBackend(step_miles=0.5).fetch_route((32.78, -96.80), (36.15, -95.99))['path'])
+        self.cum = cumulative_distance(self.path)
+
+    def test_even_spacing(self):
+        points, miles = resample_path(self.path, 2.0)
+        self.assertEqual(miles[0], 0)
+        self.assertAlmostEqual(miles[-1], self.cum[-1])
+        self.assertTrue(np.allclose(np.diff(miles)[:-1], 2.0))
+        self.assertTrue(0 < miles[-1] - miles[-2] <= 2.0)
+        self.assertTrue(np.array_equal(points[[0, -1]], self.path[[0, -1]]))
+        # Straight-line hops between resampled points are about the step
+        self.assertTrue(np.allclose(segment_distances(points)[:-1], 2.0, rtol=1e-3))
+
+        # A caller's cumulative distance (e.g. scaled to the router's total)
+        # sets the miles; the points stay where they were
+        scaled_points, scaled_miles = resample_path(self.path, 2.4, cum_dist=self.cum * 1.2)
+        self.assertTrue(np.allclose(scaled_miles, miles * 1.2))
+        self.assertTrue(np.allclose(scaled_points, points))
+
+    def test_vertex_density_does_not_matter(self):
+        # Same road, drawn with extra vertices halfway along every segment
+        dense = np.empty((2 * len(self.path) - 1, 2))
+        dense[::2] = self.path
+        dense[1::2] = (self.path[:-1] + self.path[1:]) / 2
+        points, miles = resample_path(self.path, 2.0)
+        dense_points, dense_miles = resample_path(dense, 2.0)
+        self.assertEqual(len(dense_points), len(points))
+        self.assertTrue(np.allclose(dense_points, points, atol=1e-4))
+
+        # The optimizer's work follows the trip length, not the vertex count
+        sparse = {'path': self.path[::10].tolist(), 'distance_miles': self.cum[-1]}
+        full = dict(sparse, path=dense.tolist())
+        self.assertEqual(len(RouteOptimizer(sparse, resample_miles=1.0).route_points),
+                         len(RouteOptimizer(full, resample_miles=1.0).route_points))
+
+    def test_degenerate_paths(self):
+        for path, step in (([(35.0, -97.0)], 2.0), ([(35.0, -97.0)] * 3, 2.0), (self.path[:5], 0)):
+            with self.subTest(n=len(path), step=step):
+                points, miles = resample_path(path, step)
+                self.assertTrue(np.array_equal(points, path))
+                self.assertTrue(np.array_equal(miles, cumulative_distance(path)))
+
+
+class RouteCorridorTests(SimpleTestCase):
+    def test_same_stations_as_a_full_scan(self):
+        manager = FuelStationManager.get_instance()
+        route = SyntheticBackend(step_miles=0.5).fetch_route((32.78, -96.80), (41.88, -87.63))
+        points, miles = resample_path(route['path'], 2.0)
+        corridor = RouteCorridor(points, miles, manager, radius_miles=10)
+
+        # Every route point against every location
+        locations = manager.location_points
+        dist = haversine_miles(points[:, 0, None], points[:, 1, None], locations[:, 0], locations[:, 1])
+        near = np.flatnonzero(dist.min(axis=0) <= 10)
+        self.assertGreater(len(near), 20)
+
+        found = manager.station_location[corridor.station_idx]
+        self.assertEqual(sorted(found.tolist()), near.tolist())
+        self.assertTrue(np.array_equal(corridor.route_idx, dist[:, found].argmin(axis=0)))
+        self.assertTrue(np.allclose(corridor.offroute, dist[:, found].min(axis=0)))
+        self.assertTrue(np.array_equal(corridor.miles, miles[corridor.route_idx]))
+        self.assertTrue(np.all(np.diff(corridor.miles) >= 0))
+
+        # The cheapest station of each location (lowest index on a tie)
+        prices = manager.price_snapshot.prices
+        for location, station in zip(found, corridor.station_idx):
+            members = manager.location_members[manager.location_start[location]:manager.location_start[location + 1]]
+            cheapest = members[prices[members] == prices[members].min()]
+            self.assertEqual(station, cheapest.min())
+        self.assertTrue(np.array_equal(corridor.prices, prices[corridor.station_idx]))
+
+        for lo, hi in ((0, 100), (250.5, 600), (miles[-1] - 50, miles[-1])):
+            inside = np.flatnonzero((corridor.miles >= lo) & (corridor.miles <= hi))
+            self.assertEqual(list(range(len(corridor))[corridor.window(lo, hi)]), inside.tolist())
+
+
+def every_station(optimizer, route_data):
+    """
+    optimizer with its corridor expanded back to every station at each
+    location, instead of the cheapest one, in the order RouteCorridor sorts.
+    """
+    manager, corridor = optimizer.manager, optimizer.corridor
+    location = manager.station_location[corridor.station_idx]
+    starts, counts = manager.location_start[location], np.diff(manager.location_start)[location]
+    owner = np.repeat(np.arange(len(location)), counts)
+    members = manager.location_members[starts[owner] + np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)]
+    highways = highway_matching_options()
+    if highways['ENABLED'] and route_data.get('highways'):
+        # Only the stations RouteCorridor would consider on this route
+        keep = manager.highways.on_route(members, corridor.miles[owner], route_data['highways'], highways['WINDOW_MILES'])
+        members, owner = members[keep], owner[keep]
+    order = np.lexsort((members, corridor.miles[owner]))
+    members, owner = members[order], owner[order]
+
+    expanded = copy.copy(corridor)
+    expanded.station_idx = expanded.station_idx_last = members
+    expanded.route_idx = corridor.route_idx[owner]
+    expanded.miles = corridor.miles[owner]
+    expanded.offroute = corridor.offroute[owner]
+    expanded.prices = optimizer.price_snapshot.prices[members]
+    optimizer = copy.copy(optimizer)
+    optimizer.corridor = expanded
+    optimizer._shared = {}
+    return optimizer
+
+
+class CollapsedStationsTests(SimpleTestCase):
+    VEHICLES = [{}, {'tank_range_miles': 60, 'start_fuel': 0.5}, {'tank_range_miles': 150, 'mpg': 6.5}]
+
+    def test_same_plans_as_with_every_station(self):
+        checked = 0
+        for lane, route_data in load_fixtures().items():
+            for vehicle in self.VEHICLES:
+                collapsed = RouteOptimizer(route_data, **vehicle)
+                expanded = every_station(collapsed, route_data)
+                self.assertLess(len(collapsed.corridor), len(expanded.corridor))
+                for mode in RouteOptimizer.MODES:
+                    with self.subTest(lane=lane, mode=mode, **vehicle):
+                        result = collapsed.optimize(mode)
+                        self.assertEqual(result, expanded.optimize(mode))
+                        checked += 'error' not in result
+        self.assertGreater(checked, len(self.VEHICLES) * 2)
+
+
+def lp_minimum_cost(optimizer):
+    """
+    Cheapest plan for optimizer's corridor as a linear program: buy b_i miles
+    of fuel at station i, arrive everywhere (and at the destination) with
+    the reserve intact, never hold more than a full tank.
+    """
+    miles = np.asarray(optimizer.corridor.miles, dtype=np.float64)
+    prices = np.asarray(optimizer.corridor.prices, dtype=np.float64)
+    n = len(miles)
+    capacity = optimizer.tank_range - optimizer.safety_buffer
+    start = optimizer.tank_range * optimizer.start_fuel - optimizer.safety_buffer
+    before = np.tri(n, k=-1)  # before[k, i]: station i comes before station k
+
+    a_ub = np.vstack([
+        -before,                # fuel on arrival at k: start + bought before - miles[k] >= 0
+        before + np.eye(n),     # fuel after buying at k <= capacity
+        -np.ones((1, n)),       # fuel on arrival at the destination >= 0
+    ])
+    b_ub = np.concatenate([start - miles, capacity - start + miles, [start - optimizer.cum_dist[-1]]])
+    result = linprog(prices / optimizer.mpg, A_ub=a_ub, b_ub=b_ub, bounds=(0, None), method='highs')
+    return result.fun if result.success else None
+
+
+class ExactOptimizerTests(SimpleTestCase):
+    LANES = [
+        ('Dallas, TX', 'Tulsa, OK'),
+        ('Chicago, IL', 'St. Louis, MO'),
+        ('Denver, CO', 'Albuquerque, NM'),
+        ('Atlanta, GA', 'Nashville, TN'),
+        ('Memphis, TN', 'Jackson, MS'),
+        ('St. Louis, MO', 'Kansas City, MO'),
+    ]
+    VEHICLES = [
+        {'tank_range_miles': 120, 'start_fuel': 1.0},
+        {'tank_range_miles': 150, 'start_fuel': 0.5},
+        {'tank_range_miles': 200, 'start_fuel': 0.2, 'safety_buffer_miles': 25},
+    ]
+
+    def test_exact_matches_linear_program(self):
+        geocoder = CityGeocoder.get_instance()
+        backend = SyntheticBackend(step_miles=0.5)
+        checked = 0
+        for start, finish in self.LANES:
+            route_data = backend.fetch_route(geocoder.geocode(start), geocoder.geocode(finish))
+            for vehicle in self.VEHICLES:
+                with self.subTest(start=start, finish=finish, **vehicle):
+                    optimizer = RouteOptimizer(route_data, **vehicle)
+                    expected = lp_minimum_cost(optimizer)
+                    result = optimizer.optimize('exact')
+                    if expected is None:
+                        self.assertIn('error', result)
+                        continue
+                    checked += 1
+                    self.assertAlmostEqual(result['total_cost'], expected, delta=0.01)
+                    # Same constraints, so greedy (when it finds a plan) can't
+                    # beat the optimum
+                    self.assertGreaterEqual(result.get('savings_vs_greedy', 0), 0)
+        self.assertGreater(checked, len(self.LANES))
+
+
+class GeocoderTests(SimpleTestCase):
+    def test_apostrophes(self):
+        geocoder = CityGeocoder.get_instance()
+        # us_cities.csv: "O Fallon", "Coeur D Alene", "Lees Summit", "Oneill"
+        for query, expected in [("O'Fallon, MO", 'O Fallon, MO'), ("Coeur d\u2019Alene, ID", 'Coeur D Alene, ID'),
+                                ("Lee's Summit, MO", 'Lees Summit, MO'), ("O'Neill, Nebraska", 'Oneill, NE')]:
+            with self.subTest(query=query):
+                self.assertIsNotNone(geocoder.geocode(expected))
+                self.assertEqual(geocoder.geocode(query), geocoder.geocode(expected))
+
+
+class SingleFlightTests(SimpleTestCase):
+    def run_threads(self, flight, fn, count=4):
+        # do() from count threads while fn is held, so all of them join one call
+        release = threading.Event()
+        outcomes = [None] * count
+
+        def held():
+            release.wait(5)
+            return fn()
+
+        def caller(i):
+            try:
+                outcomes[i] = flight.do('key', held)
+            except Exception as e:
+                outcomes[i] = e
+
+        threads = [threading.Thread(target=caller, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for _ in range(500):
+            call = flight._calls.get('key')
+            if call is not None and call.waiters == count:
+                break
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        return outcomes
+
+    def test_do_shares_result(self):
+        flight = SingleFlight('test')
+        calls = []
+        outcomes = self.run_threads(flight, lambda: calls.append(1) or {'route': 1})
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(outcome is outcomes[0] for outcome in outcomes))
+        self.assertEqual(flight.in_flight(), 0)
+
+    def test_do_shares_exception(self):
+        flight = SingleFlight('test')
+        calls = []
+
+        def fail():
+            calls.append(1)
+            raise ValueError('router down')
+        outcomes = self.run_threads(flight, fail)
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(isinstance(outcome, ValueError) for outcome in outcomes))
+        self.assertEqual(flight.in_flight(), 0)
+
+    def test_ado_shares_result(self):
+        flight = SingleFlight('test')
+        release = threading.Event()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            release.wait(5)
+            return {'route': 1}
+
+        async def main():
+            waiters = [asyncio.ensure_future(flight.ado('key', fn)) for _ in range(3)]
+            await asyncio.sleep(0.05)
+            release.set()
+            return await asyncio.gather(*waiters)
+        results = asyncio.run(main())
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(result is results[0] for result in results))
+
+    def test_arun_shares_result_and_exception(self):
+        flight = SingleFlight('test')
+        calls = []
+
+        async def fetch(value):
+            calls.append(value)
+            await asyncio.sleep(0.01)
+            if isinstance(value, Exception):
+                raise value
+            return value
+
+        async def main():
+            results = await asyncio.gather(*(flight.arun('ok', fetch, {'route': 1}) for _ in range(3)))
+            errors = await asyncio.gather(*(flight.arun('bad', fetch, ValueError('no route')) for _ in range(3)),
+                                          return_exceptions=True)
+            return results, errors
+        results, errors = asyncio.run(main())
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertTrue(all(error is errors[0] and isinstance(error, ValueError) for error in errors))
+
+    def test_arun_cancelled_with_its_last_waiter(self):
+        flight = SingleFlight('test')
+        started, cancelled = [], []
+
+        async def fetch():
+            started.append(1)
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+
+        async def main():
+            first = asyncio.ensure_future(flight.arun('key', fetch))
+            second = asyncio.ensure_future(flight.arun('key', fetch))
+            await asyncio.sleep(0.01)
+            call = flight._calls['key']
+
+            # One waiter left: the shared call keeps running
+            first.cancel()
+            await asyncio.sleep(0.01)
+            self.assertFalse(call.task.done())
+
+            # Last waiter gone: the call is cancelled and forgotten
+            second.cancel()
+            await asyncio.gather(first, second, return_exceptions=True)
+            await asyncio.sleep(0.01)
+            self.assertTrue(call.task.cancelled())
+        asyncio.run(main())
+        self.assertEqual((len(started), len(cancelled)), (1, 1))
+        self.assertEqual(flight.in_flight(), 0)
+
+
+class PriceUpdateKeyTests(SimpleTestCase):
+    def setUp(self):
+        self.manager = FuelStationManager.get_instance()
+        self.addCleanup(setattr, self.manager, 'price_snapshot', self.manager.price_snapshot)
+        # An empty snapshot dir, so the keys don't pick up prices refreshed
+        # by other processes (poll_prices)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(DATA_SNAPSHOT_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def update_first_station(self):
+        station = self.manager.df.iloc[0]
+        stats = self.manager.apply_price_update(pd.DataFrame([{
+            'OPIS Truckstop ID': station['OPIS Truckstop ID'], 'Truckstop Name': station['name'],
+            'Address': station['address'], 'City': station['City_Norm'], 'State': station['State_Norm'],
+            'Retail Price': station['price'] + 0.1,
+        }]), persist=False)
+        self.assertEqual(stats['changed'], 1)
+
+    def test_keys_change_after_price_update(self):
+        lane_key = 'lane'
+        options = route_options({'start': 'Dallas, TX', 'finish': 'Tulsa, OK', 'optimizer_mode': 'exact'})
+        result_key = RouteResultCache().key(lane_key, options)
+        plan_key = _plan_key(lane_key, 'exact')
+        self.assertEqual(RouteResultCache().key(lane_key, options), result_key)
+
+        self.update_first_station()
+        self.assertNotEqual(RouteResultCache().key(lane_key, options), result_key)
+        self.assertNotEqual(_plan_key(lane_key, 'exact'), plan_key)
+
+    @override_settings(ROUTE_SERVICE=dict(settings.ROUTE_SERVICE, BACKEND='synthetic'))
+    def test_repeated_quotes_come_from_the_cache(self):
+        caches[RouteResultCache.get_instance().alias].clear()
+
+        def post(**body):
+            response = self.client.post(reverse('route'), dict({'start': 'Dallas, TX', 'finish': 'Tulsa, OK'}, **body),
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            return response.json()
+
+        with mock.patch.object(views, 'optimize_lane', wraps=services.optimize_lane) as optimize_lane:
+            first = post()
+            self.assertEqual(optimize_lane.call_count, 1)
+
+            # Same lane, other spelling: served from the cache, with this request's strings
+            again = post(start='dallas tx')
+            self.assertEqual(optimize_lane.call_count, 1)
+            self.assertEqual(again['route']['start'], 'dallas tx')
+            again['route']['start'] = first['route']['start']
+            self.assertEqual(again, first)
+
+            # Other vehicles are another result
+            post(vehicles=[{'tank_range_miles': 200}])
+            self.assertEqual(optimize_lane.call_count, 2)
+
+            # New prices: computed again
+            self.update_first_station()
+            post()
+            self.assertEqual(optimize_lane.call_count, 3)
+            post()
+            self.assertEqual(optimize_lane.call_count, 3)
+
+
+class WarmupTests(SimpleTestCase):
+    def serving(self, argv, run_main=None):
+        environ = {'RUN_MAIN': run_main} if run_main else {}
+        with mock.patch('sys.argv', argv), mock.patch.dict('os.environ', environ, clear=True):
+            return serving_process()
+
+    def test_only_serving_processes_warm_up(self):
+        self.assertTrue(self.serving(['/venv/bin/gunicorn', 'fuel_backend.wsgi']))
+        self.assertTrue(self.serving(['manage.py', 'runserver'], run_main='true'))
+        self.assertTrue(self.serving(['manage.py', 'runserver', '--noreload']))
+        # Autoreloader parent, other commands
+        self.assertFalse(self.serving(['manage.py', 'runserver']))
+        self.assertFalse(self.serving(['manage.py', 'migrate']))
+        self.assertFalse(self.serving(['manage.py', 'refresh_prices', 'prices.csv']))
+
+    def test_pool_workers_skip_warm_up(self):
+        with mock.patch('multiprocessing.parent_process', return_value=object()):
+            self.assertFalse(self.serving(['/venv/bin/gunicorn', 'fuel_backend.wsgi']))
+
+
+class ReplayBackendTests(SimpleTestCase):
+    def test_shipped_settings_serve_the_recorded_lanes(self):
+        geocoder = CityGeocoder.get_instance()
+        route_data = ReplayBackend().fetch_route(geocoder.geocode('Chicago, IL'), geocoder.geocode('Milwaukee, WI'))
+        self.assertGreater(route_data['distance_miles'], 50)
+        self.assertGreater(len(route_data['path']), 2)
+
+    def test_raw_osrm_response_with_steps(self):
+        geocoder = CityGeocoder.get_instance()
+        route_data = ReplayBackend().fetch_route(geocoder.geocode('Dallas, TX'), geocoder.geocode('Kansas City, MO'))
+        self.assertEqual([ids for _, _, ids in route_data['highways']],
+                         [['I-635'], ['I-35'], ['I-35', 'I-40'], ['I-35'], ['I-35', 'US-50'], ['I-35']])
+        self.assertAlmostEqual(route_data['highways'][-1][1], route_data['distance_miles'], delta=5)
+
+        # Stops off I-35 (US-54 in Emporia, I-20 in Dallas...) are left out
+        matched = RouteOptimizer(route_data)
+        with override_settings(HIGHWAY_MATCHING=dict(settings.HIGHWAY_MATCHING, ENABLED=False)):
+            unmatched = RouteOptimizer(route_data)
+        self.assertLess(len(matched.corridor), len(unmatched.corridor))
+        addresses = [stop['address'] for stop in matched.optimize('greedy')['stops']]
+        self.assertTrue(addresses and all('I-35' in address for address in addresses))
+
+
+class RouteCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.route = SyntheticBackend(step_miles=5).fetch_route((32.78, -96.80), (36.15, -95.99))
+
+    def disk_cache(self, **kwargs):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        cache = RouteCache(path=f"{directory.name}/routes.sqlite3", **kwargs)
+        self.addCleanup(cache._db.close)
+        return cache
+
+    def test_memory_tier_evicts_least_recently_used(self):
+        cache = RouteCache(max_entries=2)
+        cache.set('a', self.route)
+        cache.set('b', self.route)
+        cache.get('a')  # b is now the least recently used
+        cache.set('c', self.route)
+        self.assertIsNone(cache.get('b'))
+        self.assertIs(cache.get('a'), self.route)
+        self.assertIs(cache.get('c'), self.route)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_disk_tier_expires_after_ttl(self):
+        cache = self.disk_cache(max_entries=1, ttl_seconds=60)
+        now = time.time()
+        with mock.patch('time.time', return_value=now):
+            cache.set('a', self.route)
+            cache.set('b', self.route)  # pushes a out of memory
+            route = cache.get('a')
+        self.assertEqual(cache.stats()['disk_hits'], 1)
+        self.assertAlmostEqual(route['distance_miles'], self.route['distance_miles'])
+
+        with mock.patch('time.time', return_value=now + 61):
+            self.assertIsNone(cache.get('a'))
+            self.assertIsNone(cache.get('b'))
+
+    def test_lane_key_covers_the_router(self):
+        cache = RouteCache()
+        start, end = (32.78, -96.80), (36.15, -95.99)
+        old = RouteService(cache=cache, backend=OSRMBackend(base_url='http://osrm-a.test/route/v1/driving'))
+        new = RouteService(cache=cache, backend=OSRMBackend(base_url='http://osrm-b.test/route/v1/driving'))
+        cache.set(old.lane_key(start, end), self.route)
+        self.assertIs(cache.get(old.lane_key(start, end)), self.route)
+        self.assertIsNone(cache.get(new.lane_key(start, end)))
+
+        with override_settings(HIGHWAY_MATCHING={'ENABLED': False}):
+            self.assertIsNone(cache.get(old.lane_key(start, end)))
+
+
+class StationTileTests(SimpleTestCase):
+    def test_same_pairs_as_the_kd_tree(self):
+        manager = FuelStationManager.get_instance()
+        route = SyntheticBackend(step_miles=2).fetch_route((32.78, -96.80), (41.88, -87.63))['path']
+        # Points on tile edges and corners too, and right at station locations
+        edges = [(35.0, -95.25), (35.25, -95.0), (36.0, -94.999999), (35.999999, -94.0)]
+        points = np.vstack([route, edges, manager.location_points[:50]])
+
+        # Few tiles: later lookups run into evicted tiles and rebuild them
+        tiles = StationTileCache(tile_degrees=0.25, max_tiles=8)
+        for radius in (10, 25):
+            expected = location_pairs(*manager.query_locations(points, radius))
+            self.assertTrue(expected)
+            for _ in range(2):
+                found = location_pairs(*tiles.query_locations(manager, points, radius))
+                self.assertEqual(found.keys(), expected.keys())
+                self.assertTrue(np.allclose([found[k] for k in expected], list(expected.values())))
+        self.assertGreater(tiles.stats()['evictions'], 0)
+
+
+def max_deviation_miles(points, kept):
+    # Farthest distance of any point from the kept polyline, in the same
+    # local projection simplify_path uses
+    points, kept = np.asarray(points), np.asarray(kept)
+    scale = np.radians(1) * EARTH_RADIUS_MILES * np.array([1.0, np.cos(np.radians(points[:, 0].mean()))])
+    p, a, b = points * scale, kept[:-1] * scale, kept[1:] * scale
+    ab = b - a
+    t = np.clip(((p[:, None] - a) * ab).sum(-1) / np.maximum((ab * ab).sum(-1), 1e-12), 0, 1)
+    nearest = a + t[..., None] * ab
+    return np.linalg.norm(p[:, None] - nearest, axis=-1).min(axis=1).max()
+
+
+class GeometryTests(SimpleTestCase):
+    def setUp(self):
+        self.route = SyntheticBackend(step_miles=0.5).fetch_route((32.78, -96.80), (36.15, -95.99))
+        rng = np.random.default_rng(0)
+        # A wiggly path, so simplification has something to drop and keep
+        self.path = np.asarray(self.route['path']) + rng.normal(0, 0.002, (len(self.route['path']), 2))
+
+    def test_encode_polyline(self):
+        # Reference vector from the format's documentation
+        self.assertEqual(encode_polyline([(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]),
+                         '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+        points = np.vstack([self.path, [(-33.8688, 151.2093), (0.0, 0.0), (-0.000004, -179.999996)]])
+        for precision in (5, 6):
+            with self.subTest(precision=precision):
+                encoded = encode_polyline(points, precision)
+                self.assertEqual(encoded, polyline.encode([tuple(p) for p in points.tolist()], precision))
+                decoded = np.asarray(polyline.decode(encoded, precision))
+                self.assertLessEqual(np.abs(decoded - points).max(), 0.5 / 10 ** precision + 1e-12)
+        self.assertEqual(encode_polyline([]), '')
+
+    def test_simplify_path(self):
+        for tolerance in (0.05, 0.5, 2.0):
+            with self.subTest(tolerance=tolerance):
+                kept = simplify_path(self.path, tolerance)
+                self.assertLess(len(kept), len(self.path))
+                self.assertTrue((kept[0] == self.path[0]).all() and (kept[-1] == self.path[-1]).all())
+                self.assertLessEqual(max_deviation_miles(self.path, kept), tolerance + 1e-9)
+        self.assertEqual(len(simplify_path(self.path, 0)), len(self.path))
+
+    def test_route_geometry(self):
+        route_data = dict(self.route, path=self.path.tolist())
+        # Nothing to do: the router's GeoJSON as is
+        self.assertIs(route_geometry(route_data, 'geojson', 0), route_data['geojson'])
+        self.assertEqual(route_geometry(route_data, 'polyline6', 0), encode_polyline(self.path, 6))
+        simplified = route_geometry(route_data, 'geojson', 0.5)
+        self.assertEqual(simplified['coordinates'], simplify_path(self.path, 0.5)[:, ::-1].tolist())
+
+
+class VehicleSweepTests(SimpleTestCase):
+    def setUp(self):
+        geocoder = CityGeocoder.get_instance()
+        route_data = SyntheticBackend(step_miles=0.5).fetch_route(geocoder.geocode('Dallas, TX'),
+                                                                 geocoder.geocode('Chicago, IL'))
+        self.optimizer = RouteOptimizer(route_data)
+
+    def test_default_vehicle_sweep_matches_the_default_plan(self):
+        for mode in RouteOptimizer.MODES:
+            with self.subTest(mode=mode):
+                [result] = self.optimizer.optimize_vehicles([VehicleProfile()], mode)
+                self.assertEqual(result.pop('vehicle'), VehicleProfile().as_dict())
+                self.assertEqual(result, self.optimizer.optimize(mode))
+
+    def test_infeasible_vehicle_fails_alone(self):
+        vehicles = [VehicleProfile(name='tiny', tank_range_miles=20), VehicleProfile(name='sleeper', tank_range_miles=900)]
+        tiny, sleeper = self.optimizer.optimize_vehicles(vehicles, 'exact')
+        self.assertEqual(tiny['vehicle']['name'], 'tiny')
+        self.assertIn('error', tiny)
+        self.assertNotIn('error', sleeper)
+        self.assertEqual(sleeper, dict(vehicle=vehicles[1].as_dict(),
+                                       **self.optimizer.for_vehicle(vehicles[1]).optimize('exact')))
+
+    def test_bad_profiles_are_client_errors(self):
+        bad = [
+            {'mpg': 0}, {'mpg': -3}, {'tank_range_miles': 0}, {'tank_range_miles': -100},
+            {'tank_range_miles': 100, 'safety_buffer_miles': 100}, {'safety_buffer_miles': -1},
+            {'start_fuel': 1.5}, {'mpg': '7'}, {'mpg': True}, {'fuel': 'diesel'}, {'name': 5}, 'truck',
+        ]
+        for vehicle in bad:
+            body = {'start': 'Dallas, TX', 'finish': 'Tulsa, OK', 'vehicles': [{'name': 'ok'}, vehicle]}
+            with self.subTest(vehicle=vehicle):
+                with self.assertRaises(ValueError):
+                    VehicleProfile.from_data(vehicle)
+                with self.assertRaises(ValueError):
+                    route_options(body)
+                response = self.client.post(reverse('route'), body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
@@ -0,0 +1,149 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from .geo import chord_to_miles, haversine_miles, miles_to_chord, to_unit_vectors
+from .metrics import REGISTRY
+
+STATION_TILES_DEFAULTS = {
+    'ENABLED': True,
+    # Grid cell size in degrees (0.25 ~ 17 x 13 miles at 40N)
+    'TILE_DEGREES': 0.25,
+    # Tiles kept per worker; least recently used are evicted beyond this
+    'MAX_TILES': 4096,
+}
+
+
+def station_tiles_options():
+    return dict(STATION_TILES_DEFAULTS, **getattr(settings, 'STATION_TILES', {}))
+
+
+class StationTileCache:
+    """
+    Candidate station locations per grid tile, for corridor searches.
+
+    Traffic follows a handful of interstates, so consecutive requests do
+    radius searches around nearly the same route points. Route points are
+    bucketed into fixed lat/lon tiles; for each tile we keep every station
+    location within the search radius of any point in the tile (a radius
+    search from the tile centre, widened by the centre-to-corner distance).
+    A lookup then only measures the route points against their tile's
+    candidates, and returns exactly what FuelStationManager.query_locations
+    would.
+
+    Tiles hold locations, not prices: the cheapest station per location
+    comes from the caller's PriceSnapshot, so a price update doesn't
+    invalidate anything. A station data reload clears the cache.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    options = station_tiles_options()
+                    cls._instance = StationTileCache(tile_degrees=options['TILE_DEGREES'],
+                                                     max_tiles=options['MAX_TILES'])
+        return cls._instance
+
+    def __init__(self, tile_degrees=0.25, max_tiles=4096):
+        self.tile_degrees = tile_degrees
+        self.max_tiles = max_tiles
+        self._tiles = OrderedDict()  # (radius, lat tile, lon tile) -> location_idx
+        self._locations = None  # manager.location_points the tiles were built from
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def query_locations(self, manager, points, radius_miles=10):
+        """Same contract as FuelStationManager.query_locations: (point_idx, location_idx, dist_miles)."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if len(points) == 0:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp), np.zeros(0)
+
+        cells = np.floor(points / self.tile_degrees).astype(np.int64)
+        # One int per tile (a 1-d unique is much faster than unique(axis=0))
+        _, first, tile_of_point = np.unique(cells[:, 0] * (1 << 32) + cells[:, 1], return_index=True, return_inverse=True)
+        candidates = self._candidates(manager, cells[first], radius_miles)
+
+        # Every (point, candidate of its tile) pair, as in FuelStationManager._expand_locations
+        counts = np.fromiter((len(c) for c in candidates), dtype=np.intp, count=len(candidates))
+        flat = np.concatenate(candidates) if candidates else np.zeros(0, dtype=np.intp)
+        starts = np.cumsum(counts) - counts
+        point_counts = counts[tile_of_point]
+        point_idx = np.repeat(np.arange(len(points)), point_counts)
+        offset = np.arange(len(point_idx)) - np.repeat(np.cumsum(point_counts) - point_counts, point_counts)
+        location_idx = flat[starts[tile_of_point][point_idx] + offset]
+
+        xyz = to_unit_vectors(points[:, 0], points[:, 1])
+        chord = np.linalg.norm(xyz[point_idx] - manager.location_xyz[location_idx], axis=1)
+        near = chord <= miles_to_chord(radius_miles)
+        return point_idx[near], location_idx[near], chord_to_miles(chord[near])
+
+    def _candidates(self, manager, tiles, radius_miles):
+        # location_idx arrays for each tile, filling misses with one batched search
+        keys = [(radius_miles, i, j) for i, j in zip(tiles[:, 0].tolist(), tiles[:, 1].tolist())]
+        found = [None] * len(keys)
+        with self._lock:
+            if self._locations is not manager.location_points:
+                self._tiles.clear()
+                self._locations = manager.location_points
+            for n, key in enumerate(keys):
+                entry = self._tiles.get(key)
+                if entry is not None:
+                    self._tiles.move_to_end(key)
+                    found[n] = entry
+            missing = [n for n, entry in enumerate(found) if entry is None]
+            self._counters['hits'] += len(keys) - len(missing)
+            self._counters['misses'] += len(missing)
+
+        if missing:
+            south_west = tiles[missing] * self.tile_degrees
+            centres = south_west + self.tile_degrees / 2
+            # The corner nearer the equator is the furthest from the centre
+            corner_lat = np.where(centres[:, 0] >= 0, south_west[:, 0], south_west[:, 0] + self.tile_degrees)
+            # (plus a little slack for rounding between the distance formulas)
+            reach = haversine_miles(centres[:, 0], centres[:, 1], corner_lat, south_west[:, 1]) + 0.1
+            point_idx, location_idx, dist = manager.query_locations(centres, radius_miles + reach.max())
+            # Trim each tile back to its own reach (the batch used the largest)
+            keep = dist <= radius_miles + reach[point_idx]
+            point_idx, location_idx = point_idx[keep], location_idx[keep]
+            order = np.argsort(point_idx, kind='stable')
+            bounds = np.searchsorted(point_idx[order], np.arange(len(missing) + 1))
+            with self._lock:
+                for m, n in enumerate(missing):
+                    found[n] = location_idx[order[bounds[m]:bounds[m + 1]]]
+                    if self._locations is manager.location_points:
+                        self._tiles[keys[n]] = found[n]
+                while len(self._tiles) > self.max_tiles:
+                    self._tiles.popitem(last=False)
+                    self._counters['evictions'] += 1
+        return found
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters, tiles=len(self._tiles))
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+@REGISTRY.register_collector
+def station_tile_metrics():
+    cache = StationTileCache._instance
+    if cache is None:
+        return
+    stats = cache.stats()
+    yield ('fuel_station_tile_lookups_total', 'counter', 'Station tile cache lookups by result.', [
+        ({'result': 'hit'}, stats['hits']),
+        ({'result': 'miss'}, stats['misses']),
+    ])
+    yield ('fuel_station_tile_evictions_total', 'counter', 'Station tile cache evictions.', [({}, stats['evictions'])])
+    yield ('fuel_station_tiles', 'gauge', 'Tiles in the station tile cache.', [({}, stats['tiles'])])
@@ -1,6 +1,11 @@
-from django.urls import path
-from .views import RouteView
+from django.urls import path, re_path
+from .views import RouteView, RouteBatchView, ReadinessView, PriceUpdateView, MetricsView, route_async
 
 urlpatterns = [
     path('route/', RouteView.as_view(), name='route'),
+    re_path(r'^route/async/?$', route_async, name='route-async'),
+    re_path(r'^routes/batch/?$', RouteBatchView.as_view(), name='route-batch'),
+    re_path(r'^ready/?$', ReadinessView.as_view(), name='ready'),
+    re_path(r'^admin/prices/?$', PriceUpdateView.as_view(), name='admin-prices'),
+    re_path(r'^metrics/?$', MetricsView.as_view(), name='metrics'),
 ]
@@ -1,11 +1,29 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import JSONRenderer
 from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from .data_manager import FuelStationManager, CityGeocoder
 from .routing import RouteService
 from .optimizer import RouteOptimizer
+from .services import (aoptimize_lane, batch_options, geometry_options, get_async_executor, get_optimizer_pool,
+                       optimize_lane, route_options, route_response)
+from .metrics import REGISTRY, span
+from .streaming import route_events, streaming_response
+from .renderers import FastJSONRenderer
+from .results import RouteResultCache, result_cache_options
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
+import contextvars
+import io
+import json
 import logging
+import pandas as pd
 
 logger = logging.getLogger(__name__)
 
@@ -15,63 +33,332 @@ class RouteView(APIView):
         Input: 
         {
             "start": "City, State",
-            "finish": "City, State"
+            "finish": "City, State",
+            "optimizer_mode": "greedy" | "exact",  (optional)
+            "geometry_format": "geojson" | "polyline" | "polyline6",  (optional)
+            "simplify_tolerance": 0.05,            (optional, miles)
+            "stream": "ndjson" | "sse",            (optional, see streaming.py)
+            "vehicles": [{"name", "tank_range_miles", "mpg",
+                          "safety_buffer_miles", "start_fuel"}, ...]  (optional)
         }
+        With vehicles, the response has a "vehicles" list (stops and cost per
+        profile, all planned on one route) instead of top-level fuel_stops.
         """
-        data = request.data
-        start_query = data.get('start')
-        finish_query = data.get('finish')
-        
-        if not start_query or not finish_query:
-            return Response({"error": "Missing start or finish location."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            options = route_options(request.data)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        start_query, finish_query, mode = options['start'], options['finish'], options['mode']
+        geometry_format, simplify_tolerance = options['geometry_format'], options['simplify_tolerance']
+        stream_format = options['stream']
         
         # 1. Geocode
-        print(f"Geocoding {start_query} and {finish_query}...")
-        geocoder = CityGeocoder.get_instance()
-        start_coords = geocoder.geocode(start_query)
-        finish_coords = geocoder.geocode(finish_query)
-        print(f"Coords: {start_coords}, {finish_coords}")
+        with span('geocode'):
+            geocoder = CityGeocoder.get_instance()
+            start_coords = geocoder.geocode(start_query)
+            finish_coords = geocoder.geocode(finish_query)
+        logger.debug("Geocoded %r -> %s, %r -> %s", start_query, start_coords, finish_query, finish_coords)
         
         if not start_coords:
             return Response({"error": f"Could not find start location: {start_query}"}, status=status.HTTP_400_BAD_REQUEST)
         if not finish_coords:
             return Response({"error": f"Could not find finish location: {finish_query}"}, status=status.HTTP_400_BAD_REQUEST)
-            
-        # 2. Route
-        print("Fetching route from OSRM...")
-        
+
         router = RouteService()
+        lane_key = router.lane_key(start_coords, finish_coords)
+        results = _result_cache() if not stream_format else None
+        if results is not None:
+            result_key = results.key(lane_key, options)
+            body = results.get(result_key, start_query, finish_query)
+            if body is not None:
+                return self._cached_response(request, body)
+
+        # 2. Route
         try:
-            route_data = router.get_route(start_coords, finish_coords)
-            print(f"Route fetched. Distance: {route_data['distance_miles']} miles. Points: {len(route_data['path'])}")
+            with span('route_fetch'):
+                route_data = router.get_route(start_coords, finish_coords)
+            logger.debug("Route fetched: %s miles, %s points", route_data['distance_miles'], len(route_data['path']))
         except Exception as e:
             logger.error(f"Routing failed: {e}")
             return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
             
-        # 3. Optimize
-        print("Optimizing route...")
-        optimizer = RouteOptimizer(route_data)
+        return_map = options['return_map']
+        if stream_format:
+            # 3-4. Optimize and respond as a stream (summary and stops first)
+            events = route_events(start_query, finish_query, route_data, mode, return_map,
+                                  geometry_format, simplify_tolerance)
+            return streaming_response(events, stream_format, asynchronous=isinstance(request._request, ASGIRequest))
+
+        # 3. Optimize (shared with identical requests already in flight)
         try:
-            result = optimizer.optimize()
-            print("Optimization complete.")
+            result = optimize_lane(lane_key, route_data, mode, vehicles=options['vehicles'])
         except Exception as e:
             logger.error(f"Optimization failed: {e}")
             return Response({"error": f"Optimization Error: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
             
         # 4. Construct Response
-        return_map = data.get('return_map', True)
-        
-        response_data = {
-            "route": {
-                "start": start_query,
-                "finish": finish_query,
-                "distance_miles": round(route_data['distance_miles'], 2),
-            },
-            "fuel_stops": result.get('stops', []),
-            "total_fuel_cost": result.get('total_cost', 0)
+        with span('response'):
+            response_data = route_response(start_query, finish_query, route_data, result, return_map,
+                                           geometry_format, simplify_tolerance)
+        if results is None or 'error' in result:
+            return Response(response_data)
+
+        # Rendered once, for the cache and (usually) this response
+        body = FastJSONRenderer().render(response_data)
+        results.set(result_key, start_query, finish_query, body)
+        return self._cached_response(request, body)
+
+    @staticmethod
+    def _cached_response(request, body):
+        # Cached bodies are JSON; other renderers (browsable API) get the data
+        if isinstance(request.accepted_renderer, JSONRenderer):
+            return HttpResponse(body, content_type='application/json')
+        return Response(json.loads(body))
+
+
+def _result_cache():
+    return RouteResultCache.get_instance() if result_cache_options()['ENABLED'] else None
+
+
+@csrf_exempt
+@require_POST
+async def route_async(request):
+    """
+    RouteView for the ASGI app (same body and response), for deployments
+    where most of a request is spent waiting on the router. The router call
+    is awaited on an async HTTP client, so waiting requests hold no thread;
+    optimization and response building run on the bounded executor
+    (ASYNC_ROUTES). A client disconnect cancels the request, and with it the
+    pending router call unless an identical request is still waiting on it.
+    """
+    try:
+        data = json.loads(request.body or b'{}')
+        if not isinstance(data, dict):
+            raise ValueError
+    except ValueError:
+        return _json_response({"error": "Request body must be a JSON object."}, status.HTTP_400_BAD_REQUEST)
+    try:
+        options = route_options(data)
+    except ValueError as e:
+        return _json_response({"error": str(e)}, status.HTTP_400_BAD_REQUEST)
+    start_query, finish_query, mode = options['start'], options['finish'], options['mode']
+
+    # 1. Geocode (in-memory lookups, loaded at startup; fine on the loop)
+    with span('geocode'):
+        geocoder = CityGeocoder.get_instance()
+        start_coords = geocoder.geocode(start_query)
+        finish_coords = geocoder.geocode(finish_query)
+
+    if not start_coords:
+        return _json_response({"error": f"Could not find start location: {start_query}"}, status.HTTP_400_BAD_REQUEST)
+    if not finish_coords:
+        return _json_response({"error": f"Could not find finish location: {finish_query}"}, status.HTTP_400_BAD_REQUEST)
+
+    router = RouteService()
+    lane_key = router.lane_key(start_coords, finish_coords)
+    results = _result_cache() if not options['stream'] else None
+    if results is not None:
+        # (the key polls the price dir at most every PRICE_POLL_SECONDS)
+        result_key = results.key(lane_key, options)
+        body = await results.aget(result_key, start_query, finish_query)
+        if body is not None:
+            return HttpResponse(body, content_type='application/json')
+
+    # 2. Route
+    try:
+        with span('route_fetch'):
+            route_data = await router.aget_route(start_coords, finish_coords)
+    except Exception as e:
+        logger.error(f"Routing failed: {e}")
+        return _json_response({"error": str(e)}, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    if options['stream']:
+        events = route_events(start_query, finish_query, route_data, mode, options['return_map'],
+                              options['geometry_format'], options['simplify_tolerance'])
+        return streaming_response(events, options['stream'], asynchronous=True)
+
+    # 3. Optimize
+    try:
+        result = await aoptimize_lane(lane_key, route_data, mode, vehicles=options['vehicles'])
+    except Exception as e:
+        logger.error(f"Optimization failed: {e}")
+        return _json_response({"error": f"Optimization Error: {str(e)}"}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    # 4. Construct Response (geometry encoding and serialization are CPU too)
+    def render():
+        with span('response'):
+            response_data = route_response(start_query, finish_query, route_data, result, options['return_map'],
+                                           options['geometry_format'], options['simplify_tolerance'])
+        return FastJSONRenderer().render(response_data)
+
+    loop = asyncio.get_running_loop()
+    content = await loop.run_in_executor(get_async_executor(), contextvars.copy_context().run, render)
+    if results is not None and 'error' not in result:
+        await results.aset(result_key, start_query, finish_query, content)
+    return HttpResponse(content, content_type='application/json')
+
+
+def _json_response(data, status_code=status.HTTP_200_OK):
+    return HttpResponse(FastJSONRenderer().render(data), content_type='application/json', status=status_code)
+
+
+class RouteBatchView(APIView):
+    def post(self, request):
+        """
+        Input:
+        {
+            "pairs": [{"start": "City, State", "finish": "City, State"}, ...],
+            "return_map": false,                   (optional, default false)
+            "optimizer_mode": "greedy" | "exact",  (optional)
+            "geometry_format", "simplify_tolerance"  (optional, as in RouteView)
         }
-        
-        if return_map:
-            response_data["route"]["map_geometry"] = route_data['geojson']
-        
-        return Response(response_data)
+        Identical lanes are routed and optimized once. Results come back in
+        input order, each with "status": "ok" or "error".
+        """
+        data = request.data
+        pairs = data.get('pairs')
+        mode = data.get('optimizer_mode', getattr(settings, 'FUEL_OPTIMIZER_MODE', 'greedy'))
+        return_map = data.get('return_map', False)
+        options = batch_options()
+
+        if not isinstance(pairs, list) or not pairs:
+            return Response({"error": "Expected a non-empty list of pairs."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(pairs) > options['MAX_ITEMS']:
+            return Response({"error": f"Too many pairs ({len(pairs)}), max is {options['MAX_ITEMS']}."}, status=status.HTTP_400_BAD_REQUEST)
+        if mode not in RouteOptimizer.MODES:
+            return Response({"error": f"Unknown optimizer_mode: {mode}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            geometry_format, simplify_tolerance = geometry_options(data)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # 1. Check every pair, then geocode the valid ones in one pass.
+        # A bad item is reported in place rather than failing the batch.
+        queries = []
+        results = [None] * len(pairs)
+        for i, pair in enumerate(pairs):
+            pair = pair if isinstance(pair, dict) else {}
+            start_query, finish_query = pair.get('start'), pair.get('finish')
+            if not start_query or not finish_query:
+                results[i] = {"status": "error", "error": "Missing start or finish location."}
+            elif not isinstance(start_query, str) or not isinstance(finish_query, str):
+                results[i] = {"status": "error", "error": "start and finish must be strings."}
+            queries.append((start_query, finish_query))
+        with span('geocode'):
+            geocoder = CityGeocoder.get_instance()
+            coords = geocoder.geocode_many([q if results[i] is None else None
+                                            for i, pair in enumerate(queries) for q in pair])
+
+        # 2. Dedupe lanes by resolved coordinates
+        lanes = {}
+        for i, (start_query, finish_query) in enumerate(queries):
+            start_coords, finish_coords = coords[2 * i], coords[2 * i + 1]
+            if results[i] is not None:
+                continue
+            if not start_coords:
+                results[i] = {"status": "error", "error": f"Could not find start location: {start_query}"}
+            elif not finish_coords:
+                results[i] = {"status": "error", "error": f"Could not find finish location: {finish_query}"}
+            else:
+                lanes.setdefault((start_coords, finish_coords), []).append(i)
+
+        # 3. Route concurrently; optimize in the process pool
+        # (station data is loaded up front rather than inside the threads)
+        FuelStationManager.get_instance()
+        router = RouteService()
+        pool = get_optimizer_pool()
+
+        def run_lane(lane):
+            route_data = router.get_route(*lane)
+            return route_data, optimize_lane(router.lane_key(*lane), route_data, mode, pool)
+
+        with ThreadPoolExecutor(max_workers=options['ROUTE_CONCURRENCY']) as executor:
+            futures = {executor.submit(run_lane, lane): lane for lane in lanes}
+            for future in as_completed(futures):
+                indices = lanes[futures[future]]
+                try:
+                    route_data, result = future.result()
+                    if 'error' in result:
+                        raise Exception(result['error'])
+                except Exception as e:
+                    logger.error(f"Batch lane failed: {e}")
+                    for i in indices:
+                        results[i] = {"status": "error", "error": str(e)}
+                    continue
+                for i in indices:
+                    start_query, finish_query = queries[i]
+                    results[i] = dict(status="ok", **route_response(start_query, finish_query, route_data, result, return_map,
+                                                                    geometry_format, simplify_tolerance))
+
+        for i, (start_query, finish_query) in enumerate(queries):
+            if results[i]["status"] == "error":
+                results[i].update(start=start_query, finish=finish_query)
+
+        return Response({
+            "count": len(results),
+            "unique_lanes": len(lanes),
+            "errors": sum(1 for r in results if r["status"] == "error"),
+            "results": results,
+        })
+
+
+class ReadinessView(APIView):
+    def get(self, request):
+        """
+        Load-balancer readiness probe. 200 once the station and city data are
+        loaded in this worker, 503 before that. Never triggers a load itself.
+        """
+        components = {
+            "stations": FuelStationManager.status(),
+            "geocoder": CityGeocoder.status(),
+        }
+        ready = all(c["status"] == "loaded" for c in components.values())
+        return Response(
+            {"ready": ready, "components": components},
+            status=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+
+
+class PriceUpdateView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        manager = FuelStationManager.get_instance()
+        snapshot = manager.price_snapshot
+        return Response({
+            "data_version": manager.data_version,
+            "price_version": snapshot.version,
+            "source": snapshot.source,
+            "updated_at": snapshot.updated_at,
+        })
+
+    def post(self, request):
+        """
+        Upload a new OPIS price CSV, either as multipart field "file" or as
+        a raw text/csv body. Applies to this worker immediately; other
+        workers pick it up from the data snapshot dir within PRICE_POLL_SECONDS.
+        """
+        if request.content_type.startswith('text/csv'):
+            source = io.BytesIO(request.body)
+        else:
+            source = request.FILES.get('file')
+            if source is None:
+                return Response({"error": "Send the CSV as a 'file' upload or a text/csv body."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            fuel_df = pd.read_csv(source)
+            stats = FuelStationManager.get_instance().apply_price_update(fuel_df, source='admin upload')
+        except (ValueError, pd.errors.ParserError) as e:
+            return Response({"error": f"Invalid price file: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(stats)
+
+
+class MetricsView(APIView):
+    def get(self, request):
+        """
+        Prometheus text exposition of this worker's metrics: request and
+        stage latency histograms, KD-tree / candidate counters, route cache
+        and data status.
+        """
+        return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost, so request latency includes the other middleware and rendering
+    'fuel_backend.core.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -123,3 +126,159 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Fuel optimizer
+# 'greedy' (cheapest reachable station, fill to full) or 'exact' (min-cost
+# partial fills). Can be overridden per request with "optimizer_mode".
+
+FUEL_OPTIMIZER_MODE = 'greedy'
+
+
+# The optimizer resamples each route to one point every N miles before
+# searching for stations (N well under the 10 mile search radius).
+
+ROUTE_RESAMPLE_MILES = 2.0
+
+
+# Station tile cache (see core/tiles.py): candidate station locations per
+# lat/lon grid tile, reused by later routes through the same tiles.
+
+STATION_TILES = {
+    'ENABLED': True,
+    'TILE_DEGREES': 0.25,
+    'MAX_TILES': 4096,
+}
+
+
+# Highway matching (see core/highways.py): candidate stations must be on a
+# highway the route uses (OSRM step refs) within WINDOW_MILES of them.
+
+HIGHWAY_MATCHING = {
+    'ENABLED': True,
+    'WINDOW_MILES': 15,
+}
+
+
+# Route cache (see core/routing.py for all options)
+# Memory LRU per worker plus a SQLite tier shared across workers/restarts.
+
+ROUTE_CACHE = {
+    'ENABLED': True,
+    'MAX_ENTRIES': 128,
+    'PATH': BASE_DIR / 'cache' / 'routes.sqlite3',
+    'MAX_DISK_ENTRIES': 5000,
+    'TTL_SECONDS': 7 * 24 * 3600,
+}
+
+
+# Route result cache (see core/results.py): finished responses per lane,
+# request options and price version, so repeat quotes skip routing and
+# optimization. Any Django cache backend works; 'route_results' below is
+# per worker. For a cache shared by all workers and kept across restarts:
+#     'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+#     'LOCATION': BASE_DIR / 'cache' / 'results',
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'route_results': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'route-results',
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+
+RESULT_CACHE = {
+    'ENABLED': True,
+    'CACHE_ALIAS': 'route_results',
+    'TIMEOUT': 3600,
+}
+
+
+# Routing backend and HTTP client (see core/routing.py ROUTE_SERVICE_DEFAULTS)
+
+ROUTE_SERVICE = {
+    # 'osrm' | 'replay' | 'synthetic' (offline, deterministic)
+    'BACKEND': os.environ.get('ROUTING_BACKEND', 'osrm'),
+    'OSRM_BASE_URL': os.environ.get('OSRM_BASE_URL'),
+    # The committed benchmark routes (manage.py benchmark --record)
+    'REPLAY_DIR': BASE_DIR / 'benchmarks' / 'routes',
+    'POOL_MAXSIZE': 16,
+    'ASYNC_MAX_CONNECTIONS': 100,
+    'CONNECT_TIMEOUT': 3.05,
+    'READ_TIMEOUT': 15,
+    'RETRIES': 2,
+    'BREAKER_FAILURE_THRESHOLD': 5,
+    'BREAKER_RESET_SECONDS': 30,
+}
+
+
+# Batch route costing (POST /api/routes/batch)
+
+BATCH_ROUTES = {
+    'MAX_ITEMS': 500,
+    'ROUTE_CONCURRENCY': 8,
+    # Optimizer processes per web worker; 0 = optimize in the request threads
+    'OPTIMIZE_WORKERS': 4,
+}
+
+
+# Async route endpoint (POST /api/route/async/, ASGI only)
+
+ASYNC_ROUTES = {
+    # Threads for optimization and response building per worker
+    'OPTIMIZE_THREADS': 4,
+}
+
+
+# Binary data snapshot (python manage.py build_snapshot). Loaded memory-mapped
+# at startup when present and up to date; otherwise the CSVs are parsed.
+
+DATA_SNAPSHOT_DIR = BASE_DIR / 'snapshot'
+
+
+# Load station/city data at startup instead of on the first request:
+# 'sync' (block in AppConfig.ready), 'background' (thread; /api/ready
+# returns 503 until loaded) or None (lazy). Only applies to serving
+# processes, never to management commands or optimizer pool workers.
+
+DATA_WARMUP = os.environ.get('DATA_WARMUP') or None
+
+
+# Hot price updates (manage.py refresh_prices / POST /api/admin/prices):
+# how often each worker checks the snapshot dir for a newer price version.
+
+PRICE_POLL_SECONDS = 10
+
+
+# DRF: orjson-backed JSON output (falls back to the stdlib encoder if orjson
+# isn't installed). The browsable API stays available for development.
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'fuel_backend.core.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+
+# Logging: everything to stderr through one handler. Set LOG_LEVEL=DEBUG for
+# per-request stage timings (fuel_backend.core.middleware).
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'default': {'format': '%(asctime)s %(levelname)s %(name)s %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'default'},
+    },
+    'root': {'handlers': ['console'], 'level': 'WARNING'},
+    'loggers': {
+        'django': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'fuel_backend': {'level': os.environ.get('LOG_LEVEL', 'INFO')},
+    },
+}